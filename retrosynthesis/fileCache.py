@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Content-addressed on-disk cache of files with a size bounded LRU eviction. Entries are written atomically so that concurrent processes can share the same cache folder
+
+"""
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+import contextlib
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+CACHE_MAX_SIZE = 10*1024*1024*1024 # 10 GB
+ENTRY_META = 'meta.json'
+HASH_BLOCK = 1024*1024
+#temporary folders older than this are left over by killed processes
+STALE_TMP_AGE = 24*3600
+
+
+def cacheKey(*parts):
+    """Return the key of a cache entry from JSON serialisable parts
+
+    :param parts: The values that identify the entry
+
+    :type parts: list
+
+    :rtype: str
+    :return: The sha256 hex digest of the parts
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def fileHash(path, cache_dir=None):
+    """Return the sha256 of the content of a file
+
+    If a cache folder is given, the digest is memoised in the cache folder and reused as long as
+    the size and modification time of the file are unchanged, to avoid reading large files at every call
+
+    :param path: Path to the file
+    :param cache_dir: Path to the cache folder (Default: None)
+
+    :type path: str
+    :type cache_dir: str
+
+    :rtype: str
+    :return: The sha256 hex digest of the file content
+    """
+    stat = os.stat(path)
+    memo_path = None
+    if cache_dir:
+        memo_path = os.path.join(cache_dir, 'hashes', hashlib.sha1(os.path.realpath(path).encode('utf-8')).hexdigest()+'.json')
+        try:
+            with open(memo_path, 'r') as f:
+                memo = json.load(f)
+            if memo['size']==stat.st_size and memo['mtime']==stat.st_mtime:
+                return memo['sha256']
+        except (OSError, ValueError, KeyError):
+            pass
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    digest = digest.hexdigest()
+    if memo_path:
+        try:
+            os.makedirs(os.path.dirname(memo_path), exist_ok=True)
+            _atomicWrite(memo_path, json.dumps({'path': os.path.realpath(path), 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest}))
+        except OSError as e:
+            logger.warning('Cannot memoise the hash of '+str(path)+': '+str(e))
+    return digest
+
+
+def _atomicWrite(path, content):
+    """Write a text file by renaming a temporary file in the same folder
+
+    :param path: Path to the file
+    :param content: The content of the file
+
+    :type path: str
+    :type content: str
+
+    :rtype: None
+    :return: None
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def getEntry(cache_dir, key):
+    """Return the folder of a cache entry and mark it as recently used
+
+    :param cache_dir: Path to the cache folder
+    :param key: The key of the entry
+
+    :type cache_dir: str
+    :type key: str
+
+    :rtype: str
+    :return: Path to the entry folder or None if the entry does not exist
+    """
+    entry_path = os.path.join(cache_dir, key)
+    try:
+        os.utime(os.path.join(entry_path, ENTRY_META))
+    except OSError:
+        return None
+    logger.debug('Cache hit for '+str(key))
+    return entry_path
+
+
+def getMeta(entry_path):
+    """Return the metadata of a cache entry
+
+    :param entry_path: Path to the entry folder
+
+    :type entry_path: str
+
+    :rtype: dict
+    :return: The metadata stored with the entry
+    """
+    with open(os.path.join(entry_path, ENTRY_META), 'r') as f:
+        return json.load(f)
+
+
+def putEntry(cache_dir, key, files, meta={}, max_size=CACHE_MAX_SIZE):
+    """Add files to the cache under a key
+
+    The entry is built in a temporary folder of the cache and renamed to its key, so that readers
+    never see a partial entry. If another process has added the same key first, its entry is kept
+
+    :param cache_dir: Path to the cache folder
+    :param key: The key of the entry
+    :param files: Dictionnary of the name of the file in the entry to the path of the file to store
+    :param meta: Metadata stored with the entry (Default: {})
+    :param max_size: Maximal size of the cache in bytes (Default: 10 GB)
+
+    :type cache_dir: str
+    :type key: str
+    :type files: dict
+    :type meta: dict
+    :type max_size: int
+
+    :rtype: str
+    :return: Path to the entry folder or None if it could not be written
+    """
+    entry_path = os.path.join(cache_dir, key)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_entry_path = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp-')
+        try:
+            for name in files:
+                shutil.copy(files[name], os.path.join(tmp_entry_path, name))
+            entry_meta = dict(meta)
+            entry_meta['created'] = time.time()
+            with open(os.path.join(tmp_entry_path, ENTRY_META), 'w') as f:
+                json.dump(entry_meta, f)
+            os.rename(tmp_entry_path, entry_path)
+        except OSError:
+            shutil.rmtree(tmp_entry_path, ignore_errors=True)
+            if not os.path.exists(os.path.join(entry_path, ENTRY_META)):
+                raise
+            logger.debug('Cache entry '+str(key)+' already added by another process')
+    except OSError as e:
+        logger.warning('Cannot add the entry '+str(key)+' to the cache: '+str(e))
+        return None
+    evict(cache_dir, max_size)
+    return entry_path
+
+
+def removeEntry(cache_dir, key):
+    """Remove an entry from the cache
+
+    :param cache_dir: Path to the cache folder
+    :param key: The key of the entry
+
+    :type cache_dir: str
+    :type key: str
+
+    :rtype: bool
+    :return: If the entry has been removed
+    """
+    entry_path = os.path.join(cache_dir, key)
+    #rename first so that readers never see a partially removed entry
+    try:
+        tmp_entry_path = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp-')
+    except OSError:
+        return False
+    try:
+        os.rename(entry_path, os.path.join(tmp_entry_path, 'entry'))
+    except OSError:
+        shutil.rmtree(tmp_entry_path, ignore_errors=True)
+        return False
+    shutil.rmtree(tmp_entry_path, ignore_errors=True)
+    return True
+
+
+@contextlib.contextmanager
+def lockEntry(cache_dir, key):
+    """Hold an exclusive lock on a key of the cache
+
+    The lock is an flock on a file of the cache folder, so that the processes and threads computing the
+    same entry wait for the first one instead of computing it again. It is released if the holder dies
+
+    :param cache_dir: Path to the cache folder
+    :param key: The key of the entry
+
+    :type cache_dir: str
+    :type key: str
+
+    :rtype: None
+    :return: None
+    """
+    lock_dir = os.path.join(cache_dir, 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, key+'.lock'), 'a') as f:
+        start = time.time()
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if time.time()-start>1.0:
+            logger.debug('Waited '+str(round(time.time()-start, 1))+' seconds for the lock of '+str(key))
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def evict(cache_dir, max_size=CACHE_MAX_SIZE):
+    """Remove the least recently used entries until the cache is below its maximal size
+
+    :param cache_dir: Path to the cache folder
+    :param max_size: Maximal size of the cache in bytes (Default: 10 GB)
+
+    :type cache_dir: str
+    :type max_size: int
+
+    :rtype: int
+    :return: The number of entries removed
+    """
+    entries = []
+    total_size = 0
+    for name in os.listdir(cache_dir):
+        entry_path = os.path.join(cache_dir, name)
+        if name.startswith('.tmp-'):
+            try:
+                if time.time()-os.stat(entry_path).st_mtime>STALE_TMP_AGE:
+                    shutil.rmtree(entry_path, ignore_errors=True)
+            except OSError:
+                pass
+            continue
+        try:
+            last_used = os.stat(os.path.join(entry_path, ENTRY_META)).st_mtime
+            size = sum(i.stat().st_size for i in os.scandir(entry_path) if i.is_file())
+        except OSError:
+            continue
+        entries.append((last_used, size, entry_path))
+        total_size += size
+    count = 0
+    for last_used, size, entry_path in sorted(entries):
+        if total_size<=max_size:
+            break
+        if not removeEntry(cache_dir, os.path.basename(entry_path)):
+            continue
+        total_size -= size
+        count += 1
+    if count:
+        logger.debug('Evicted '+str(count)+' entries from the cache '+str(cache_dir))
+    return count
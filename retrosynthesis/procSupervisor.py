@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Supervise the subprocesses of the pipeline stages. The output is streamed to bounded ring buffers and a log file, failure patterns are matched as the lines arrive and the whole process group is killed on timeout or on a fatal error. The process tree is sampled from /proc while it runs to report the resources it used
+
+"""
+
+import os
+import time
+import shutil
+import signal
+import logging
+import resource
+import threading
+import subprocess
+import collections
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+#number of lines of each stream kept in memory
+RING_LINES = 1000
+#lines longer than this are truncated in the ring buffers
+MAX_LINE_LENGTH = 4096
+#seconds to wait for the readers once the process has exited
+READER_TIMEOUT = 10
+#seconds between two samples of the process tree
+SAMPLE_INTERVAL = 1.0
+#seconds between two checks of the exit of the process
+WAIT_INTERVAL = 0.1
+#seconds given to the process group to exit after SIGTERM before it is killed
+STOP_TIMEOUT = 30
+#util-linux wrapper setting the resource limits of the command it executes
+PRLIMIT = 'prlimit'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def tree_pids(pid):
+    """Return the process and all its descendants, read from /proc
+
+    :param pid: The process id of the root of the tree
+
+    :type pid: int
+
+    :rtype: list
+    :return: The process ids of the tree
+    """
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', name, 'stat'), 'r') as f:
+                #the command name may contain spaces, the parent id follows the closing parenthesis
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    pids = [pid]
+    for i in pids:
+        pids += children.get(i, [])
+    return pids
+
+
+def tree_stats(pid):
+    """Return the resources used by a process and all its descendants, read from /proc
+
+    The CPU times include the children that have already exited and been waited for
+
+    :param pid: The process id of the root of the tree
+
+    :type pid: int
+
+    :rtype: dict
+    :return: The resident memory in bytes, the number of threads and the user and system CPU times in seconds
+    """
+    stats = {'rss': 0, 'threads': 0, 'user_time': 0.0, 'sys_time': 0.0}
+    for i in tree_pids(pid):
+        try:
+            with open(os.path.join('/proc', str(i), 'stat'), 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            #the fields are numbered from the state, the third field of the file
+            stats['user_time'] += (int(fields[11])+int(fields[13]))/CLOCK_TICKS
+            stats['sys_time'] += (int(fields[12])+int(fields[14]))/CLOCK_TICKS
+            stats['threads'] += int(fields[17])
+            stats['rss'] += int(fields[21])*PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+    return stats
+
+
+def dir_size(path):
+    """Return the size of the files of a folder and its subfolders
+
+    :param path: Path to the folder
+
+    :type path: str
+
+    :rtype: int
+    :return: The size in bytes
+    """
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class TreeSampler(object):
+    """Sample the resources used by a process tree and the size of its output folder
+
+    :param pid: The process id of the root of the tree
+    :param output_dir: Path to the output folder, not measured if None (Default: None)
+
+    :type pid: int
+    :type output_dir: str
+    """
+    def __init__(self, pid, output_dir=None):
+        self.pid = pid
+        self.output_dir = output_dir
+        self.start = time.time()
+        self.first = None
+        self.last = None
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self.output_size = 0
+        self.samples = 0
+
+    def sample(self):
+        stats = tree_stats(self.pid)
+        if self.first is None:
+            self.first = stats
+        self.last = stats
+        self.peak_rss = max(self.peak_rss, stats['rss'])
+        self.peak_threads = max(self.peak_threads, stats['threads'])
+        if self.output_dir:
+            self.output_size = dir_size(self.output_dir)
+        self.samples += 1
+
+    def metrics(self, rusage=None):
+        """Return the metrics of the run
+
+        :param rusage: The resource usage of the process returned by wait4, the CPU times are sampled if None (Default: None)
+
+        :type rusage: resource.struct_rusage
+
+        :rtype: dict
+        :return: The wall time, user and system CPU times, peak resident memory, peak number of threads and output size
+        """
+        metrics = {'wall_time': round(time.time()-self.start, 3),
+                   'user_time': None,
+                   'sys_time': None,
+                   'peak_rss': self.peak_rss,
+                   'peak_threads': self.peak_threads,
+                   'output_size': dir_size(self.output_dir) if self.output_dir else None,
+                   'samples': self.samples}
+        if rusage:
+            metrics['user_time'] = round(rusage.ru_utime, 3)
+            metrics['sys_time'] = round(rusage.ru_stime, 3)
+            #ru_maxrss is in kilobytes
+            metrics['peak_rss'] = max(self.peak_rss, rusage.ru_maxrss*1024)
+        elif self.first:
+            metrics['user_time'] = round(self.last['user_time']-self.first['user_time'], 3)
+            metrics['sys_time'] = round(self.last['sys_time']-self.first['sys_time'], 3)
+        return metrics
+
+
+def kill_group(process, sig=signal.SIGKILL):
+    """Send a signal to the process group of a process started in its own session
+
+    :param process: The process
+    :param sig: The signal (Default: SIGKILL)
+
+    :type process: subprocess.Popen
+    :type sig: int
+
+    :rtype: bool
+    :return: If the signal was sent
+    """
+    try:
+        os.killpg(process.pid, sig)
+    except OSError:
+        return False
+    return True
+
+
+def limit_virtual_memory(command, max_virtual_memory):
+    """Return a command that runs under a virtual memory limit
+
+    The limit is set by the prlimit wrapper before the command is executed, which is safe to start from
+    any thread unlike a preexec_fn. Setting it on the started process would leave it running without limit
+    until then, so a ValueError is raised if prlimit is not installed. The hard limit is left unchanged
+    and a limit above it raises a ValueError
+
+    :param command: The command and its arguments
+    :param max_virtual_memory: The virtual memory limit in bytes
+
+    :type command: list
+    :type max_virtual_memory: int
+
+    :rtype: list
+    :return: The wrapped command
+    """
+    hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    if max_virtual_memory<0 or (not hard==resource.RLIM_INFINITY and max_virtual_memory>hard):
+        raise ValueError('Cannot set the virtual memory limit to '+str(max_virtual_memory)+' bytes, the hard limit is '+str(hard))
+    prlimit = shutil.which(PRLIMIT)
+    if not prlimit:
+        raise ValueError('Cannot set the virtual memory limit, '+str(PRLIMIT)+' is not installed')
+    return [prlimit, '--as='+str(int(max_virtual_memory))+':', '--']+list(command)
+
+
+def _read_stream(stream, name, ring, log_f, log_lock, patterns, state):
+    """Read the lines of a stream of the process
+
+    :param stream: The stream to read
+    :param name: The name of the stream
+    :param ring: The ring buffer of the lines
+    :param log_f: The log file, or None
+    :param log_lock: The lock of the log file
+    :param patterns: The patterns to match as (pattern, is_fatal)
+    :param state: The shared state of the supervision
+
+    :type stream: file
+    :type name: str
+    :type ring: collections.deque
+    :type log_f: file
+    :type log_lock: threading.Lock
+    :type patterns: list
+    :type state: dict
+
+    :rtype: None
+    :return: None
+    """
+    for line in iter(stream.readline, b''):
+        line = line.decode('utf-8', 'replace')
+        if log_f:
+            with log_lock:
+                if not log_f.closed:
+                    log_f.write(line)
+        ring.append(line[:MAX_LINE_LENGTH])
+        for pattern, is_fatal in patterns:
+            if pattern in line and not pattern in state['matched']:
+                state['matched'].append(pattern)
+                if is_fatal and not state['fatal']:
+                    state['fatal'] = pattern
+                    logger.warning('Detected "'+str(pattern)+'" in the '+str(name)+', killing the process group')
+                    kill_group(state['process'])
+    stream.close()
+
+
+def run(command, timeout=None, log_path=None, fatal_patterns=[], watch_patterns=[], max_virtual_memory=None, cwd=None, output_dir=None, monitor=None):
+    """Run a command in its own process group and supervise it
+
+    The process is waited for with wait4 to collect its resource usage, and its process tree is sampled
+    every SAMPLE_INTERVAL seconds for its resident memory, threads and the size of its output folder.
+    When the monitor returns a reason to stop, the process group is sent SIGTERM and is killed if it
+    has not exited after STOP_TIMEOUT seconds
+
+    :param command: The command and its arguments
+    :param timeout: The timeout in seconds, no timeout if None (Default: None)
+    :param log_path: Path to the file where both streams are written, no log if None (Default: None)
+    :param fatal_patterns: The strings that kill the process group when found in its output (Default: [])
+    :param watch_patterns: The strings that are only recorded when found in its output (Default: [])
+    :param max_virtual_memory: The virtual memory limit in bytes of the command, no limit if None (Default: None)
+    :param cwd: The working directory of the command (Default: None)
+    :param output_dir: Path to the output folder of the command, to measure its size (Default: None)
+    :param monitor: Function called every SAMPLE_INTERVAL seconds, returning the reason to stop the command or None (Default: None)
+
+    :type command: list
+    :type timeout: float
+    :type log_path: str
+    :type fatal_patterns: list
+    :type watch_patterns: list
+    :type max_virtual_memory: int
+    :type cwd: str
+    :type output_dir: str
+    :type monitor: function
+
+    :rtype: dict
+    :return: The return code, the end of the stdout and stderr, if it timed out, the fatal pattern found, the patterns found, the reason it was stopped by the monitor and the metrics of the run
+    """
+    patterns = [(i, True) for i in fatal_patterns]+[(i, False) for i in watch_patterns]
+    state = {'matched': [], 'fatal': None, 'process': None}
+    rings = {'stdout': collections.deque(maxlen=RING_LINES), 'stderr': collections.deque(maxlen=RING_LINES)}
+    log_lock = threading.Lock()
+    if max_virtual_memory is not None:
+        command = limit_virtual_memory(command, max_virtual_memory)
+    log_f = open(log_path, 'w') if log_path else None
+    process = None
+    try:
+        process = subprocess.Popen(command,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   cwd=cwd,
+                                   start_new_session=True)
+        state['process'] = process
+        readers = []
+        for name in ['stdout', 'stderr']:
+            reader = threading.Thread(target=_read_stream, args=(getattr(process, name), name, rings[name], log_f, log_lock, patterns, state))
+            reader.daemon = True
+            reader.start()
+            readers.append(reader)
+        sampler = TreeSampler(process.pid, output_dir)
+        is_time_out = False
+        stopped = None
+        stop_deadline = None
+        rusage = None
+        next_sample = sampler.start
+        while True:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+                break
+            now = time.time()
+            if timeout is not None and not is_time_out and now-sampler.start>timeout:
+                logger.warning('Timeout of '+str(timeout)+' seconds, killing the process group')
+                is_time_out = True
+                kill_group(process)
+                continue
+            if stop_deadline and now>stop_deadline:
+                logger.warning('The process group has not exited '+str(STOP_TIMEOUT)+' seconds after SIGTERM, killing it')
+                stop_deadline = None
+                kill_group(process)
+            if now>=next_sample:
+                sampler.sample()
+                next_sample = now+SAMPLE_INTERVAL
+                if monitor and not stopped and not is_time_out:
+                    stopped = monitor()
+                    if stopped:
+                        logger.info('Stopping the process group: '+str(stopped))
+                        stop_deadline = now+STOP_TIMEOUT
+                        kill_group(process, signal.SIGTERM)
+            time.sleep(WAIT_INTERVAL)
+        #the pipes may be held open by processes that left the group
+        deadline = time.time()+READER_TIMEOUT
+        for reader in readers:
+            reader.join(max(deadline-time.time(), 0))
+    finally:
+        #the supervision has failed or was interrupted, the process group must not outlive it
+        if process and process.returncode is None:
+            kill_group(process)
+            process.wait()
+        if log_f:
+            with log_lock:
+                log_f.close()
+    return {'returncode': process.returncode,
+            'stdout': ''.join(rings['stdout']),
+            'stderr': ''.join(rings['stderr']),
+            'time_out': is_time_out,
+            'fatal': state['fatal'],
+            'matched': state['matched'],
+            'stopped': stopped,
+            'metrics': sampler.metrics(rusage)}
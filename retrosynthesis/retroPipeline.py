@@ -1,16 +1,255 @@
 import os
+import csv
+import json
+import sqlite3
+import time
 import logging
+import contextlib
 import tempfile
 import argparse
 import shutil
 import tarfile
 import glob
+import concurrent.futures
 
 import runRR
 import runRP2
 import runRP2paths
+import fileCache
+import rrDedup
+import rrScreen
+import rp2Preflight
+import rp2Results
+import rp2pathsShards
+import rp2pathsReader
+import rp2Database
+import rp2pathsRanking
 
 RR_FILE_FORMAT = 'csv'
+RR_CACHE_PATH = '/home/retrorules/cache/'
+RP2_CACHE_PATH = '/home/rp2/cache/'
+#pipeline status and error message of each RetroPath2.0 status stopping the pipeline
+RP2_STATUSES = {'timeouterror': ('rp2_time_out', 'Timeout of RetroPath2.0 -- Try increasing the time_out limit of the tool'),
+                'memerror': ('rp2_mem', 'RetroPath2.0 has exceeded its memory limit'),
+                'sourceinsinkerror': ('rp2_source_in_sink', 'Source exists in the sink'),
+                'sourceinsinknotfounderror': ('rp2_knime', 'Cannot find the sink-in-source file'),
+                'ramerror': ('rp2_ram', 'Memory allocation error'),
+                'oserror': ('rp2_os', 'RetroPath2.0 has generated an OS error'),
+                'noresulterror': ('rp2_no_rp2_results', 'No Results found')}
+#RetroPath2.0 statuses with partial results, passed on to rp2paths with rp2_continue_partial and else stopping the pipeline as their error
+RP2_PARTIAL_STATUSES = ['timeoutwarning', 'memwarning', 'noresultwarning', 'oswarning', 'ramwarning']
+RP2PATHS_STATUSES = {'filenotfounderror': ('rp2paths_filenotfound', 'FileNotFound Error from rp2paths'),
+                     'oserror': ('rp2paths_oserror', 'rp2paths has generated an OS error'),
+                     'memoryerror': ('rp2paths_mem', 'rp2paths does not have sufficient memory to continue'),
+                     'ramerror': ('rp2paths_ram', 'Could not setup a RAM limit'),
+                     'timeout': ('rp2paths_time_out', 'rp2paths has reached its time_out limit, try to increase it'),
+                     '': ('rp2paths_empty', 'rp2paths has not found any pathway and returns empty files')}
+#pipeline statuses of a level without pathway, on which the deepening goes on to the next level
+LEVEL_EMPTY_STATUSES = ['rp2_no_rp2_results', 'rp2paths_filenotfound', 'rp2paths_empty']
+#number of distinct transformations of a scope above which the enumeration of rp2paths is expected to be long
+RP2PATHS_LONG_SCOPE = 5000
+#minutes of the time budget of the deepening below which a stage is not started
+MIN_LEVEL_TIMEOUT = 1.0
+
+
+def _rrCacheKey(cache_dir, rr_type, rr_diameters, rr_input_file=None, rr_input_file_format=None, rr_dedup=False, rr_screen=None):
+    """Return the cache key of a reaction rules file
+
+    The key is built from the hash of the source rule file and all the parameters that change the generated rules
+
+    :param cache_dir: Path to the cache folder
+    :param rr_type: The rule type to return
+    :param rr_diameters: The diameters to return
+    :param rr_input_file: Path to the user rule file (Default: None)
+    :param rr_input_file_format: The format of the user rule file (Default: None)
+    :param rr_dedup: If the duplicate rules are merged (Default: False)
+    :param rr_screen: The screening parameters of the rules, as the mode, source InChI and steps (Default: None)
+
+    :type cache_dir: str
+    :type rr_type: str
+    :type rr_diameters: list
+    :type rr_input_file: str
+    :type rr_input_file_format: str
+    :type rr_dedup: bool
+    :type rr_screen: list
+
+    :rtype: str
+    :return: The cache key or None if the source rule file cannot be read
+    """
+    if rr_input_file:
+        source_file = rr_input_file
+    else:
+        source_file = runRR.RULE_FILES[rr_type]
+    try:
+        source_hash = fileCache.fileHash(source_file, cache_dir)
+        if isinstance(rr_diameters, str):
+            rr_diameters = rr_diameters.split(',')
+        diameters = sorted(set([int(i) for i in rr_diameters]))
+    except (OSError, ValueError) as e:
+        logging.warning('Cannot build the reaction rules cache key: '+str(e))
+        return None
+    return fileCache.cacheKey('rules', source_hash, rr_type, diameters, rr_input_file_format, RR_FILE_FORMAT, bool(rr_dedup), rr_screen)
+
+def _rp2Status(rp2_status, continue_partial=False):
+    """Return the pipeline status of a RetroPath2.0 status
+
+    :param rp2_status: The status returned by run_rp2
+    :param continue_partial: Pass the partial results of an interrupted run on to rp2paths, instead of stopping with its error (Default: False)
+
+    :type rp2_status: str
+    :type continue_partial: bool
+
+    :rtype: str
+    :return: The pipeline status, or None if the results are passed on to rp2paths
+    """
+    if rp2_status=='noerror':
+        return None
+    if rp2_status=='earlystopwarning':
+        logging.info('RetroPath2.0 has been stopped once it found enough results')
+        return None
+    if rp2_status in RP2_PARTIAL_STATUSES:
+        if continue_partial:
+            logging.warning('Passing on the partial results of RetroPath2.0: '+str(rp2_status))
+            return None
+        rp2_status = rp2_status[:-len('warning')]+'error'
+    if rp2_status in RP2_STATUSES:
+        logging.error(RP2_STATUSES[rp2_status][1])
+        return RP2_STATUSES[rp2_status][0]
+    logging.error('Could not recognise the status message returned: '+str(rp2_status))
+    return 'rp2_status'
+
+
+def _rp2pathsStatus(rp2paths_status):
+    """Return the pipeline status of a rp2paths status
+
+    :param rp2paths_status: The status returned by run_rp2paths
+
+    :type rp2paths_status: str
+
+    :rtype: str
+    :return: The pipeline status, or None if the pathways have been enumerated
+    """
+    if rp2paths_status=='noerror':
+        return None
+    if rp2paths_status in RP2PATHS_STATUSES:
+        logging.error(RP2PATHS_STATUSES[rp2paths_status][1])
+        return RP2PATHS_STATUSES[rp2paths_status][0]
+    logging.error('Cannot interpret the rp2paths output: '+str(rp2paths_status))
+    return 'bad_rp2paths_output'
+
+
+def _checkScope(rp2_results, rp2_report):
+    """Summarise the scope of RetroPath2.0 before enumerating its pathways
+
+    The summary is read from the index written by run_rp2, or the results are scanned once
+
+    :param rp2_results: Path to the results of RetroPath2.0
+    :param rp2_report: The report of the RetroPath2.0 stage, the summary is added to it
+
+    :type rp2_results: str
+    :type rp2_report: dict
+
+    :rtype: str
+    :return: The pipeline status if rp2paths cannot find any pathway, or None
+    """
+    try:
+        scope = rp2Results.results_index(rp2_results)
+    except (OSError, csv.Error) as e:
+        logging.warning('Cannot summarise the RetroPath2.0 results: '+str(e))
+        return None
+    rp2_report['scope'] = {i: scope[i] for i in runRP2.RESULTS_METRICS}
+    #a pathway ends with a reaction whose substrates are all in the sink
+    if rp2Results.IN_SINK_COLUMN in scope['columns'] and not scope['sink_rows']:
+        logging.error('No RetroPath2.0 results row reaches the sink, not running rp2paths')
+        return 'rp2paths_empty'
+    if scope['transformations']>RP2PATHS_LONG_SCOPE:
+        logging.warning('The scope has '+str(scope['transformations'])+' transformations, the enumeration of rp2paths may be long')
+    return None
+
+
+def _remainingTime(budget_end):
+    """Return what is left of the time budget of the deepening
+
+    :param budget_end: The time at which the budget is spent
+
+    :type budget_end: float
+
+    :rtype: float
+    :return: The minutes left, or None if less than MIN_LEVEL_TIMEOUT are left
+    """
+    remaining = (budget_end-time.time())/60.0
+    if remaining<MIN_LEVEL_TIMEOUT:
+        return None
+    return remaining
+
+
+def _countPathways(out_paths):
+    """Return the number of pathways of a rp2paths output
+
+    :param out_paths: Path to the out_paths.csv file of rp2paths
+
+    :type out_paths: str
+
+    :rtype: int
+    :return: The number of pathways
+    """
+    try:
+        return sum([1 for i in rp2pathsReader.read_pathways(out_paths)])
+    except (OSError, ValueError, csv.Error) as e:
+        logging.warning('Cannot count the pathways of '+str(out_paths)+': '+str(e))
+        return 0
+
+
+def _publish(files):
+    """Copy the output files of a run to their destination
+
+    Each file is written next to its destination and renamed, so that a reader never sees a partial file
+    when the outputs of a deeper level replace the previous ones
+
+    :param files: Dictionnary of the path of each file to its destination
+
+    :type files: dict
+
+    :rtype: None
+    :return: None
+    """
+    for source in files:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(files[source])), prefix='.tmp-')
+        os.close(fd)
+        try:
+            shutil.copy(source, tmp_path)
+            os.replace(tmp_path, files[source])
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+@contextlib.contextmanager
+def _runReport(run_report):
+    """Collect the status and metrics of the stages and write them as JSON once the run is over
+
+    The report is written whatever the stage at which the run stops
+
+    :param run_report: Path to the JSON report, nothing is written if None
+
+    :type run_report: str
+
+    :rtype: dict
+    :return: The report, to be filled by the stages
+    """
+    report = {'start': time.time(), 'stages': {}}
+    try:
+        yield report
+    finally:
+        report['wall_time'] = round(time.time()-report['start'], 3)
+        if run_report:
+            try:
+                with open(run_report, 'w') as f:
+                    json.dump(report, f, indent=2)
+            except OSError as e:
+                logging.warning('Cannot write the run report '+str(run_report)+': '+str(e))
+
 
 def run(sink_path,
         source_inchi,
@@ -18,6 +257,8 @@ def run(sink_path,
         rp2_output='',
         rp2_paths='',
         rp2_cmps='',
+        rp2_db='',
+        rp2_db_only=False,
         tar_all=None,
         rr_diameters=[2,4,6,8,10,12,14,16],
         rr_type='all',
@@ -31,130 +272,331 @@ def run(sink_path,
         mwmax_cof=1000,
         time_out=120,
         ram_limit=None,
-        partial_retro=False):
-    with tempfile.TemporaryDirectory() as tmp_dir:
+        partial_retro=False,
+        rr_cache_dir=None,
+        rr_cache_size=fileCache.CACHE_MAX_SIZE,
+        rr_dedup=False,
+        rr_screen=None,
+        rp2_executor=None,
+        rp2paths_pool=None,
+        rp2paths_workers=None,
+        rp2paths_top=None,
+        rp2paths_rank_by=rp2pathsRanking.RANK_BY,
+        rp2_scores='',
+        run_report=None,
+        cpus=None,
+        rp2_stop_sink_rows=None,
+        rp2_stop_idle=None,
+        rp2_cache_dir=None,
+        rp2_cache_size=fileCache.CACHE_MAX_SIZE,
+        rp2_cache_partial=False,
+        rp2_continue_partial=False,
+        rp2_deepening=False,
+        rp2_min_steps=1,
+        rp2_min_pathways=None,
+        on_level=None):
+    with tempfile.TemporaryDirectory() as tmp_dir, _runReport(run_report) as report:
         rp2paths_out_paths = os.path.join(tmp_dir, 'out_paths.csv')
         rp2paths_out_compounds = os.path.join(tmp_dir, 'out_compounds.csv')
         rp2_path_results = os.path.join(tmp_dir, 'results.csv')
         if not rr_type in ['all', 'forward', 'retro']:
             logging.error('Cannot recognise the input rr_type: '+str(rr_type))
             return 'rr_type' 
+        if rp2paths_top and not rp2paths_rank_by in rp2pathsRanking.RANK_KEYS:
+            logging.error('Cannot recognise the input rp2paths_rank_by: '+str(rp2paths_rank_by))
+            return 'rp2paths_rank_by'
+        ################ Preflight ######################
+        #the source and sink are checked once, before generating the rules, and not again by run_rp2 at each level
+        preflight_status, preflight_message = rp2Preflight.preflight(sink_path, None, source_inchi, rp2_cache_dir)
+        report['stages']['preflight'] = {'status': preflight_status or 'noerror'}
+        if preflight_status:
+            logging.error(preflight_message)
+            return _rp2Status(preflight_status)
         ################ RetroRules #####################
         rules_path = os.path.join(tmp_dir, 'reaction_rules.csv')
-        if not rr_input_file:
-            rr_status = runRR.passRules(output=rules_path,
-                                        rules_type=rr_type, 
-                                        diameters=rr_diameters, 
-                                        output_format=RR_FILE_FORMAT)
-        else:
-            rr_status = runRR.parseRules(rule_file=rr_input_file, 
-                                         output=rules_path, 
-                                         rules_type=rr_type, 
-                                         diameters=rr_diameters, 
-                                         input_format=rr_input_file_format, 
-                                         output_format=RR_FILE_FORMAT)
+        rules_mapping_path = os.path.join(tmp_dir, 'rules_mapping.csv')
+        rr_start = time.time()
+        rr_key = None
+        rr_entry = None
+        screen_inchi = None
+        screen_key = None
+        if rr_screen:
+            if not rr_screen in rrScreen.SCREEN_MODES:
+                logging.error('Cannot recognise the input rr_screen: '+str(rr_screen))
+                return 'rr_screen'
+            screen_inchi = source_inchi
+            #the target screening does not depend on the number of steps
+            screen_key = [rr_screen, source_inchi, max_steps if rr_screen=='conservative' else None]
+        if rr_cache_dir:
+            rr_key = _rrCacheKey(rr_cache_dir, rr_type, rr_diameters, rr_input_file, rr_input_file_format, rr_dedup, screen_key)
+            if rr_key:
+                rr_entry = fileCache.getEntry(rr_cache_dir, rr_key)
+        if rr_entry:
+            try:
+                shutil.copy(os.path.join(rr_entry, 'reaction_rules.csv'), rules_path)
+                if rr_dedup:
+                    shutil.copy(os.path.join(rr_entry, 'rules_mapping.csv'), rules_mapping_path)
+                rr_status = True
+                logging.debug('Using the cached reaction rules '+str(rr_key))
+            except OSError:
+                #the entry has been evicted in the meantime
+                rr_entry = None
+        if not rr_entry:
+            if not rr_input_file:
+                rr_status = runRR.passRules(output=rules_path,
+                                            rules_type=rr_type, 
+                                            diameters=rr_diameters, 
+                                            output_format=RR_FILE_FORMAT,
+                                            screen_inchi=screen_inchi,
+                                            screen_mode=rr_screen,
+                                            screen_steps=max_steps)
+            else:
+                rr_status = runRR.parseRules(rule_file=rr_input_file, 
+                                             output=rules_path, 
+                                             rules_type=rr_type, 
+                                             diameters=rr_diameters, 
+                                             input_format=rr_input_file_format, 
+                                             output_format=RR_FILE_FORMAT,
+                                             screen_inchi=screen_inchi,
+                                             screen_mode=rr_screen,
+                                             screen_steps=max_steps)
+        report['stages']['rr'] = {'status': bool(rr_status), 'cached': bool(rr_entry), 'metrics': {'wall_time': round(time.time()-rr_start, 3)}}
         if not rr_status:
             logging.error('Reaction rule failed')
             return 'rr_status'
-        ############### RetroPath2 ######################
-        rp2_results = runRP2.run_rp2(sink_path=sink_path,
-                                     rules_path=rules_path,
-                                     source_inchi=source_inchi,
-                                     results_csv=rp2_path_results,
-                                     max_steps=max_steps,
-                                     source_name=source_name,
-                                     topx=topx,
-                                     dmin=dmin,
-                                     dmax=dmax,
-                                     mwmax_source=mwmax_source,
-                                     mwmax_cof=mwmax_cof,
-                                     timeout=time_out,
-                                     ram_limit=ram_limit,
-                                     partial_retro=partial_retro)
-        if rp2_results[0]=='time_outerror' or rp2_results[0]=='time_outwarning':
-            logging.error('Timeout of RetroPath2.0 -- Try increasing the time_out limit of the tool')
-            return 'rp2_time_out'
-        elif rp2_results[0]=='memwarning' or rp2_results[0]=='memerror':
-            logging.error('RetroPath2.0 has exceeded its memory limit')
-            return 'rp2_mem'
-        elif rp2_results[0]=='sourceinsinkerror':
-            logging.error('Source exists in the sink')
-            return 'rp2_source_in_sink'
-        elif rp2_results[0]=='sourceinsinknotfounderror':
-            logging.error('Cannot find the sink-in-source file')
-            return 'rp2_knime'
-        elif rp2_results[0]=='ramerror' or rp2_results[0]=='ramwarning':
-            logging.error('Memory allocation error')
-            return 'rp2_ram'
-        elif rp2_results[0]=='oserror' or rp2_results[0]=='oswarning':
-            logging.error('RetroPath2.0 has generated an OS error')
-            return 'rp2_os'
-        elif rp2_results[0]=='norp2_resultswarning':
-            logging.error('RetroPath2.0 could not complete successfully')
-            return 'rp2_no_rp2_results'
-        elif rp2_results[0]=='norp2_resultserror':
-            logging.error('Empty rp2_rp2_results')
-            return 'rp2_no_rp2_results'
-        elif rp2_results[0]=='noresulterror':
-            logging.error('No Results found')
-            return 'rp2_no_rp2_results'
-        elif rp2_results[0]=='noerror':
-            pass
+        rr_files = {'reaction_rules.csv': rules_path}
+        if rr_dedup and not rr_entry:
+            removed = rrDedup.dedupRules(rules_path, rules_path, rules_mapping_path)
+            if removed is None:
+                logging.error('Reaction rule deduplication failed')
+                return 'rr_status'
+            logging.info('Merged '+str(removed)+' duplicate reaction rules')
+            rr_files['rules_mapping.csv'] = rules_mapping_path
+        if rr_key and not rr_entry:
+            fileCache.putEntry(rr_cache_dir, rr_key, rr_files, max_size=rr_cache_size)
+        report['stages']['rr']['metrics']['wall_time'] = round(time.time()-rr_start, 3)
+        report['stages']['rr']['metrics']['output_size'] = os.path.getsize(rules_path)
+        ############### RetroPath2 and RP2paths ######################
+        if rp2_deepening:
+            #the levels share the time budget, each one is given what the previous ones have left
+            levels = list(range(max(1, min(rp2_min_steps, max_steps)), max_steps+1))
+            budget_end = time.time()+time_out*60.0
+            report['stages']['levels'] = []
         else:
-            logging.error('Could not recognise the status message returned: '+str(rp2_results[0]))
-            return 'rp2_status'
-        ############### RP2paths ####################
-        rp2paths_results = runRP2paths.run_rp2paths(rp2_pathways=rp2_path_results, 
-                                                    out_paths=rp2paths_out_paths, 
-                                                    out_compounds=rp2paths_out_compounds, 
-                                                    timeout=time_out, 
-                                                    ram_limit=ram_limit)
-        if rp2paths_results[0]=='filenotfounderror':
-            logging.error("FileNotFound Error from rp2paths")
-            return 'rp2paths_filenotfound'
-        elif rp2paths_results[0]=='oserror':
-            logging.error("rp2paths has generated an OS error")
-            return 'rp2paths_oserror'
-        elif rp2paths_results[0]=='memoryerror':
-            logging.error("rp2paths does not have sufficient memory to continue")
-            return 'rp2paths_mem'
-        elif rp2paths_results[0]=='ramerror':
-            logging.error("Could not setup a RAM limit")
-            return 'rp2paths_ram'
-        elif rp2paths_results[0]=='time_out':
-            logging.error("rp2paths has reached its time_out limit, try to increase it")
-            return 'rp2paths_time_out'
-        elif rp2paths_results[0]=='':
-            logging.error("rp2paths has not found any rp2paths_resultss and returns empty files")
-            return 'rp2paths_empty'
-        elif rp2paths_results[0]=='noerror':
-            pass
-        else:
-            logging.error('Cannot interpret the rp2paths output: '+str(rp2paths_results[0]))
-            return 'bad_rp2paths_output'
-        if rp2_output:
-            shutil.copy(rp2_path_results, rp2_output)
-        else:
-            shutil.copy(rp2_path_results, os.path.join(os.getcwd(), 'rp2_output.csv'))
-        if rp2_paths:
-            shutil.copy(rp2paths_out_paths, rp2_paths)
-        else:
-            shutil.copy(rp2paths_out_paths, os.path.join(os.getcwd(), 'rp2paths_out_paths.csv'))
-        if rp2_cmps:
-            shutil.copy(rp2paths_out_compounds, rp2_cmps)
-        else:
-            shutil.copy(rp2paths_out_compounds, os.path.join(os.getcwd(), 'rp2paths_out_compounds.csv'))
+            levels = [max_steps]
+        published = None
+        status = None
+        for steps in levels:
+            level_timeout = time_out
+            if rp2_deepening:
+                level_timeout = _remainingTime(budget_end)
+                if level_timeout is None:
+                    logging.warning('The time budget is spent before running '+str(steps)+' steps')
+                    status = 'rp2_time_out'
+                    break
+            level_dir = os.path.join(tmp_dir, 'steps_'+str(steps))
+            os.mkdir(level_dir)
+            level_files = {'results': os.path.join(level_dir, 'results.csv'),
+                           'paths': os.path.join(level_dir, 'out_paths.csv'),
+                           'compounds': os.path.join(level_dir, 'out_compounds.csv')}
+            rp2_results = runRP2.run_rp2(sink_path=sink_path,
+                                         rules_path=rules_path,
+                                         source_inchi=source_inchi,
+                                         results_csv=level_files['results'],
+                                         max_steps=steps,
+                                         source_name=source_name,
+                                         topx=topx,
+                                         dmin=dmin,
+                                         dmax=dmax,
+                                         mwmax_source=mwmax_source,
+                                         mwmax_cof=mwmax_cof,
+                                         timeout=level_timeout,
+                                         ram_limit=ram_limit,
+                                         partial_retro=partial_retro,
+                                         executor=rp2_executor,
+                                         cpus=cpus,
+                                         stop_sink_rows=rp2_stop_sink_rows,
+                                         stop_idle=rp2_stop_idle,
+                                         cache_dir=rp2_cache_dir,
+                                         cache_size=rp2_cache_size,
+                                         cache_partial=rp2_cache_partial,
+                                         preflight=False)
+            report['stages']['rp2'] = {'status': rp2_results[0], 'metrics': rp2_results[2]}
+            level_report = {'max_steps': steps, 'rp2': report['stages']['rp2']}
+            if rp2_deepening:
+                report['stages']['levels'].append(level_report)
+            status = _rp2Status(rp2_results[0], rp2_continue_partial)
+            if not status:
+                status = _checkScope(level_files['results'], report['stages']['rp2'])
+            if not status and rp2_deepening:
+                level_timeout = _remainingTime(budget_end)
+                if level_timeout is None:
+                    logging.error('The time budget is spent before running rp2paths on '+str(steps)+' steps')
+                    report['stages']['rp2paths'] = {'status': 'timeout', 'metrics': None}
+                    level_report['rp2paths'] = report['stages']['rp2paths']
+                    status = 'rp2paths_time_out'
+            if not status:
+                if rp2paths_workers and rp2paths_workers>1:
+                    rp2paths_results = rp2pathsShards.run_rp2paths_sharded(rp2_pathways=level_files['results'],
+                                                                          out_paths=level_files['paths'],
+                                                                          out_compounds=level_files['compounds'],
+                                                                          timeout=level_timeout,
+                                                                          ram_limit=ram_limit,
+                                                                          pool=rp2paths_pool,
+                                                                          workers=rp2paths_workers)
+                else:
+                    rp2paths_results = runRP2paths.run_rp2paths(rp2_pathways=level_files['results'],
+                                                                out_paths=level_files['paths'],
+                                                                out_compounds=level_files['compounds'],
+                                                                timeout=level_timeout,
+                                                                ram_limit=ram_limit,
+                                                                pool=rp2paths_pool)
+                report['stages']['rp2paths'] = {'status': rp2paths_results[0], 'metrics': rp2paths_results[2]}
+                level_report['rp2paths'] = report['stages']['rp2paths']
+                status = _rp2pathsStatus(rp2paths_results[0])
+            if status:
+                if rp2_deepening and status in LEVEL_EMPTY_STATUSES:
+                    logging.info('No pathway of '+str(steps)+' steps')
+                    continue
+                break
+            outputs = {}
+            if rp2paths_top:
+                ranked_paths = os.path.join(level_dir, 'ranked_paths.csv')
+                try:
+                    report['stages']['ranking'] = {'status': 'noerror', 'metrics': rp2pathsRanking.rank_pathways(level_files['paths'],
+                                                                                                                 level_files['results'],
+                                                                                                                 ranked_paths,
+                                                                                                                 top=rp2paths_top,
+                                                                                                                 rank_by=rp2paths_rank_by,
+                                                                                                                 out_scores=os.path.join(level_dir, 'scores.csv'))}
+                    level_files['all_paths'] = level_files['paths']
+                    level_files['paths'] = ranked_paths
+                    level_files['scores'] = os.path.join(level_dir, 'scores.csv')
+                    if rp2_scores:
+                        outputs[level_files['scores']] = rp2_scores
+                except (OSError, ValueError, KeyError, csv.Error) as e:
+                    logging.warning('Cannot rank the pathways, returning all of them: '+str(e))
+                    report['stages']['ranking'] = {'status': 'error'}
+            if rp2_db:
+                level_files['db'] = os.path.join(level_dir, 'rp2_output.db')
+                try:
+                    report['stages']['db'] = {'status': 'noerror', 'metrics': rp2Database.write_database(level_files['db'],
+                                                                                                        level_files['results'],
+                                                                                                        level_files['paths'],
+                                                                                                        level_files['compounds'])}
+                except (OSError, ValueError, csv.Error, sqlite3.Error) as e:
+                    logging.error('Cannot write the database of the outputs: '+str(e))
+                    report['stages']['db'] = {'status': 'error'}
+                    status = 'rp2_db'
+                    break
+                outputs[level_files['db']] = rp2_db
+            if not rp2_db_only:
+                outputs.update({level_files['results']: rp2_output or os.path.join(os.getcwd(), 'rp2_output.csv'),
+                                level_files['paths']: rp2_paths or os.path.join(os.getcwd(), 'rp2paths_out_paths.csv'),
+                                level_files['compounds']: rp2_cmps or os.path.join(os.getcwd(), 'rp2paths_out_compounds.csv')})
+            _publish(outputs)
+            published = level_files
+            if rp2_deepening:
+                pathways = _countPathways(level_files.get('all_paths', level_files['paths']))
+                level_report['pathways'] = pathways
+                logging.info('Found '+str(pathways)+' pathways of up to '+str(steps)+' steps')
+                if on_level:
+                    try:
+                        on_level(steps, pathways)
+                    except Exception as e:
+                        logging.warning('The level callback has failed: '+str(e))
+                if rp2_min_pathways and pathways>=rp2_min_pathways:
+                    logging.info('Found at least '+str(rp2_min_pathways)+' pathways, not searching deeper')
+                    break
+        if not published:
+            #the budget has been spent before the first level has run
+            return status or 'rp2_time_out'
+        if status:
+            logging.warning('Returning the pathways of a previous level after: '+str(status))
         if tar_all:
             if not tar_all.endswith('tar.gz'):
                 tar_all += '.tar.gz'
             with tarfile.open(tar_all, "w:gz") as tar:
-                tar.add(rp2paths_out_paths, arcname=os.path.basename(rp2paths_out_paths))
-                tar.add(rp2paths_out_compounds, arcname=os.path.basename(rp2paths_out_compounds))
+                tar.add(published['paths'], arcname=os.path.basename(rp2paths_out_paths))
+                tar.add(published['compounds'], arcname=os.path.basename(rp2paths_out_compounds))
                 tar.add(rules_path, arcname=os.path.basename(rules_path))
-                tar.add(rp2_path_results, arcname=os.path.basename(rp2_path_results))
+                if rr_dedup:
+                    tar.add(rules_mapping_path, arcname=os.path.basename(rules_mapping_path))
+                tar.add(published['results'], arcname=os.path.basename(rp2_path_results))
+                if 'db' in published:
+                    tar.add(published['db'], arcname=os.path.basename(published['db']))
+                if 'all_paths' in published:
+                    tar.add(published['all_paths'], arcname='all_'+os.path.basename(rp2paths_out_paths))
+                    tar.add(published['scores'], arcname=os.path.basename(published['scores']))
         return 'noerrors'
 
 
+def _jobOutputs(job):
+    """Return the absolute paths of the files written by a pipeline job
+
+    :param job: The arguments of run
+
+    :type job: dict
+
+    :rtype: list
+    :return: The output paths
+    """
+    outputs = []
+    if not job.get('rp2_db_only'):
+        outputs += [job.get('rp2_output') or 'rp2_output.csv',
+                    job.get('rp2_paths') or 'rp2paths_out_paths.csv',
+                    job.get('rp2_cmps') or 'rp2paths_out_compounds.csv']
+    for i in ['rp2_db', 'rp2_scores', 'tar_all', 'run_report']:
+        if job.get(i):
+            outputs.append(job[i])
+    return [os.path.abspath(i) for i in outputs]
+
+
+def run_many(jobs, workers=None, rp2_executor=None, rp2paths_pool=None):
+    """Run many pipelines in parallel in the same process
+
+    Each job runs in a thread, as the stages wait on their KNIME and rp2paths subprocesses. The RAM limit
+    and working directory are passed to each subprocess, so that the jobs do not share any state but the
+    reaction rules cache and the pools of workers
+
+    :param jobs: The arguments of run for each pipeline, they must not share any output file
+    :param workers: The number of pipelines running at the same time, the number of CPUs if None (Default: None)
+    :param rp2_executor: Pool of warm RetroPath2.0 workers shared by the jobs, unless a job sets its own (Default: None)
+    :param rp2paths_pool: Pool of warm rp2paths workers shared by the jobs, unless a job sets its own (Default: None)
+
+    :type jobs: list
+    :type workers: int
+    :type rp2_executor: rp2Executor.RP2Executor
+    :type rp2paths_pool: rp2pathsPool.RP2pathsPool
+
+    :rtype: list
+    :return: The status of each job, in the order of the jobs, or None if the jobs write to the same files
+    """
+    outputs = [j for i in jobs for j in _jobOutputs(i)]
+    if len(set(outputs))<len(outputs):
+        logging.error('The pipelines must write to different files')
+        return None
+    if not workers:
+        workers = os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for job in jobs:
+            job = dict(job)
+            if rp2_executor and not job.get('rp2_executor'):
+                job['rp2_executor'] = rp2_executor
+            if rp2paths_pool and not job.get('rp2paths_pool'):
+                job['rp2paths_pool'] = rp2paths_pool
+            futures.append(pool.submit(run, **job))
+        statuses = []
+        for job, future in zip(jobs, futures):
+            try:
+                statuses.append(future.result())
+            except Exception as e:
+                logging.error('The pipeline of '+str(job.get('source_inchi'))+' has failed: '+str(e))
+                statuses.append('pipeline_error')
+    return statuses
+
+
 def main():
     parser = argparse.ArgumentParser(description='Run the retrosynthesis pipeline')
     parser.add_argument("-sink", "--sink_path", type=str, help="Input sink (organims) molecule", required=True)
@@ -162,6 +604,8 @@ def main():
     parser.add_argument("-orp", "--rp2_output", type=str, help="RP2 results file", default='')
     parser.add_argument("-orp2p", "--rp2_paths", type=str, help="RP2paths pathway results file", default='')
     parser.add_argument("-orp2pc", "--rp2_cmps", type=str, help="RP2paths compounds results file", default='')
+    parser.add_argument("-odb", "--rp2_db", type=str, help="Output SQLite file of the RP2 results, the RP2paths pathways and compounds", default='')
+    parser.add_argument("-dbo", "--rp2_db_only", action='store_true', help='Only write the SQLite file, not the CSV files')
     parser.add_argument("-co", "--compressed_results", type=str, help="Output TAR with all the intermediate files", default='')
     parser.add_argument("-s", "--max_steps", type=int, help="Maximum heterologous pathway length", default=5)
     parser.add_argument("-d", "--rr_diameters", type=str, help="Diameters of the reaction rules", default='2,4,6,8,10,12,14,16')
@@ -177,6 +621,23 @@ def main():
     parser.add_argument("-to", "--time_out", type=int, help='Time out', default=120)
     parser.add_argument("-r", "--ram_limit", type=int, help='Ram limit of the execution', default=20)
     parser.add_argument("-p", "--partial_retro", type=bool, help='Ram limit of the execution', default=False)
+    parser.add_argument("-rrc", "--rr_cache_dir", type=str, help='Cache folder of the reaction rules, for example '+RR_CACHE_PATH+', no cache if not set', default=None)
+    parser.add_argument("-rrd", "--rr_dedup", action='store_true', help='Merge the reaction rules with the same canonical SMARTS before RetroPath2.0')
+    parser.add_argument("-rrs", "--rr_screen", type=str, help='Drop the reaction rules that cannot fire on the source (target or conservative)', default=None, choices=rrScreen.SCREEN_MODES)
+    parser.add_argument("-rep", "--run_report", type=str, help='Output JSON report of the status and resources used by each stage', default=None)
+    parser.add_argument("-cpus", "--cpus", type=int, help='Number of CPUs given to the JVM of RetroPath2.0', default=None)
+    parser.add_argument("-rp2n", "--rp2_stop_sink_rows", type=int, help='Stop RetroPath2.0 once this number of results rows reach the sink', default=None)
+    parser.add_argument("-rp2i", "--rp2_stop_idle", type=float, help='Stop RetroPath2.0 when no new results row has been found for this number of minutes', default=None)
+    parser.add_argument("-rp2c", "--rp2_cache_dir", type=str, help='Cache folder of the RetroPath2.0 results, for example '+RP2_CACHE_PATH+', no cache if not set', default=None)
+    parser.add_argument("-rp2cp", "--rp2_cache_partial", action='store_true', help='Cache and reuse the partial RetroPath2.0 results')
+    parser.add_argument("-rp2pc", "--rp2_continue_partial", action='store_true', help='Run rp2paths on the partial results of a RetroPath2.0 run that has timed out or failed')
+    parser.add_argument("-rp2d", "--rp2_deepening", action='store_true', help='Run RetroPath2.0 and rp2paths with increasing numbers of steps up to max_steps, sharing the time_out')
+    parser.add_argument("-rp2s", "--rp2_min_steps", type=int, help='Number of steps of the first level of the deepening', default=1)
+    parser.add_argument("-rp2p", "--rp2_min_pathways", type=int, help='Stop the deepening once this number of pathways is found', default=None)
+    parser.add_argument("-rp2pw", "--rp2paths_workers", type=int, help='Run rp2paths on this number of independent parts of the scope in parallel', default=None)
+    parser.add_argument("-rp2pt", "--rp2paths_top", type=int, help='Only return this number of pathways, ranked on the scores of their RP2 transformations', default=None)
+    parser.add_argument("-rp2pr", "--rp2paths_rank_by", type=str, help='The pathway aggregate that ranks the pathways', default=rp2pathsRanking.RANK_BY, choices=list(rp2pathsRanking.RANK_KEYS))
+    parser.add_argument("-orp2ps", "--rp2_scores", type=str, help='Output CSV of the aggregates of the ranked pathways', default='')
     args = parser.parse_args()
     run(sink_path=args.sink_path,
         source_inchi=args.source_inchi,
@@ -184,6 +645,8 @@ def main():
         rp2_output=args.rp2_output,
         rp2_paths=args.rp2_paths,
         rp2_cmps=args.rp2_cmps,
+        rp2_db=args.rp2_db,
+        rp2_db_only=args.rp2_db_only,
         tar_all=args.compressed_results,
         rr_diameters=[int(i) for i in args.rr_diameters.split(',')],
         rr_type=args.rr_type,
@@ -197,7 +660,24 @@ def main():
         mwmax_cof=args.mwmax_cof,
         time_out=args.time_out,
         ram_limit=args.ram_limit,
-        partial_retro=args.partial_retro)
+        partial_retro=args.partial_retro,
+        rr_cache_dir=args.rr_cache_dir,
+        rr_dedup=args.rr_dedup,
+        rr_screen=args.rr_screen,
+        run_report=args.run_report,
+        cpus=args.cpus,
+        rp2_stop_sink_rows=args.rp2_stop_sink_rows,
+        rp2_stop_idle=args.rp2_stop_idle,
+        rp2_cache_dir=args.rp2_cache_dir,
+        rp2_cache_partial=args.rp2_cache_partial,
+        rp2_continue_partial=args.rp2_continue_partial,
+        rp2_deepening=args.rp2_deepening,
+        rp2_min_steps=args.rp2_min_steps,
+        rp2_min_pathways=args.rp2_min_pathways,
+        rp2paths_workers=args.rp2paths_workers,
+        rp2paths_top=args.rp2paths_top,
+        rp2paths_rank_by=args.rp2paths_rank_by,
+        rp2_scores=args.rp2_scores)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Load the RetroPath2.0 scope, the rp2paths pathways and their compounds into a single indexed SQLite file
+
+The compound, rule and transformation IDs are stored once in their own tables and referenced by integer keys. The
+links of the steps to their compounds and rules are keyed on the compound or rule, so that the pathways through a
+compound are read from a single range of the table. The files are streamed into the tables in a single transaction
+and the other indexes are built once the rows are loaded
+
+"""
+
+import os
+import csv
+import time
+import sqlite3
+import logging
+import argparse
+
+import rp2Results
+import rp2pathsReader
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+SCHEMA_VERSION = '1'
+#columns of the scope table and the RetroPath2.0 results columns they are read from
+SCOPE_COLUMNS = [('source', 'Initial source'),
+                 ('reaction_smiles', 'Reaction SMILES'),
+                 ('substrate_smiles', 'Substrate SMILES'),
+                 ('substrate_inchi', 'Substrate InChI'),
+                 ('product_smiles', 'Product SMILES'),
+                 ('product_inchi', 'Product InChI'),
+                 ('sink_name', 'Sink name'),
+                 ('ec_number', 'EC number'),
+                 ('diameter', 'Diameter')]
+RULE_COLUMN = 'Rule ID'
+SCORE_COLUMN = 'Score'
+SIDES = {'substrate': 0, 'product': 1}
+#number of rows buffered before they are inserted
+BATCH_SIZE = 50000
+SCHEMA = ['CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)',
+          'CREATE TABLE compounds (id INTEGER PRIMARY KEY, compound_id TEXT NOT NULL UNIQUE, structure TEXT)',
+          'CREATE TABLE rules (id INTEGER PRIMARY KEY, rule_id TEXT NOT NULL UNIQUE)',
+          'CREATE TABLE transformations (id INTEGER PRIMARY KEY, transformation_id TEXT NOT NULL UNIQUE)',
+          'CREATE TABLE scope (id INTEGER PRIMARY KEY, transformation INTEGER REFERENCES transformations(id), '+', '.join([i[0]+' TEXT' for i in SCOPE_COLUMNS])+', in_sink INTEGER, score REAL, iteration INTEGER)',
+          'CREATE TABLE scope_rules (rule INTEGER REFERENCES rules(id), scope INTEGER REFERENCES scope(id), PRIMARY KEY (rule, scope)) WITHOUT ROWID',
+          'CREATE TABLE steps (id INTEGER PRIMARY KEY, path_id INTEGER, position INTEGER, transformation INTEGER REFERENCES transformations(id))',
+          'CREATE TABLE step_rules (rule INTEGER REFERENCES rules(id), step INTEGER REFERENCES steps(id), PRIMARY KEY (rule, step)) WITHOUT ROWID',
+          'CREATE TABLE step_compounds (compound INTEGER REFERENCES compounds(id), step INTEGER REFERENCES steps(id), side INTEGER, coefficient REAL, PRIMARY KEY (compound, step, side)) WITHOUT ROWID',
+          'CREATE VIEW pathway_compounds AS SELECT DISTINCT steps.path_id, compounds.compound_id, compounds.structure FROM steps JOIN step_compounds ON step_compounds.step=steps.id JOIN compounds ON compounds.id=step_compounds.compound',
+          'CREATE VIEW pathway_rules AS SELECT DISTINCT steps.path_id, rules.rule_id FROM steps JOIN step_rules ON step_rules.step=steps.id JOIN rules ON rules.id=step_rules.rule']
+#built after the bulk load, the link tables are stored in the order of the compound or rule IDs and need no index on them
+INDEXES = ['CREATE INDEX scope_transformation ON scope (transformation)',
+           'CREATE INDEX scope_iteration ON scope (iteration)',
+           'CREATE INDEX scope_rules_scope ON scope_rules (scope)',
+           'CREATE INDEX steps_path ON steps (path_id, position)',
+           'CREATE INDEX steps_transformation ON steps (transformation)',
+           'CREATE INDEX step_rules_step ON step_rules (step)',
+           'CREATE INDEX step_compounds_step ON step_compounds (step)']
+
+
+class _Interner(dict):
+    """Give an integer key to each distinct ID, in the order they are met
+    """
+    def __missing__(self, name):
+        key = len(self)+1
+        self[name] = key
+        return key
+
+    def rows(self, values=None):
+        return [(key, name, (values or {}).get(name)) for name, key in self.items()]
+
+
+def _scope_rows(results_path, transformations, rules):
+    """Read the rows of the scope table from the RetroPath2.0 results, skipping the repeated header rows
+
+    :rtype: generator
+    :return: The row of the scope table with the rows of the scope_rules table
+    """
+    with open(results_path, newline='') as f:
+        reader = csv.reader(f, delimiter=',', quotechar='"')
+        header = next(reader, None)
+        if not header:
+            return
+        for row_id, row in enumerate((i for i in reader if i and not i==header), 1):
+            row = dict(zip(header, row))
+            row_rules = [(rules[i], row_id) for i in set([j.strip() for j in row.get(RULE_COLUMN, '').strip('[]').split(',')]) if i]
+            try:
+                score = float(row.get(SCORE_COLUMN))
+            except (TypeError, ValueError):
+                score = None
+            iteration = row.get(rp2Results.ITERATION_COLUMN)
+            yield tuple([row_id, transformations[row.get(rp2Results.TRANSFORMATION_COLUMN, '')]]
+                        +[row.get(i[1]) for i in SCOPE_COLUMNS]
+                        +[int(rp2Results.in_sink(row)), score, int(iteration) if iteration and iteration.isdigit() else None]), row_rules
+
+
+def _flush(connection, tables):
+    """Insert the buffered rows of some tables and empty the buffers
+
+    :param connection: The connection to the database
+    :param tables: The name and the list of rows of each table
+
+    :type connection: sqlite3.Connection
+    :type tables: list
+
+    :rtype: dict
+    :return: The number of rows inserted in each table
+    """
+    counts = {}
+    for table, rows in tables:
+        counts[table] = len(rows)
+        if rows:
+            connection.executemany('INSERT INTO '+table+' VALUES ('+', '.join(['?']*len(rows[0]))+')', rows)
+            del rows[:]
+    return counts
+
+
+def write_database(db_path, results_path=None, out_paths=None, out_compounds=None):
+    """Write the outputs of a run to a SQLite file
+
+    The file is written next to db_path and renamed, so that it replaces a previous one at once
+
+    :param db_path: Path to the SQLite file
+    :param results_path: Path to the RetroPath2.0 results, not loaded if None (Default: None)
+    :param out_paths: Path to the pathways of rp2paths, not loaded if None (Default: None)
+    :param out_compounds: Path to the compounds of rp2paths, not loaded if None (Default: None)
+
+    :type db_path: str
+    :type results_path: str
+    :type out_paths: str
+    :type out_compounds: str
+
+    :rtype: dict
+    :return: The number of rows of each table and the time taken to write the file
+    """
+    start = time.time()
+    tmp_path = db_path+'.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    compounds = _Interner()
+    structures = {}
+    rules = _Interner()
+    transformations = _Interner()
+    counts = {'scope': 0, 'scope_rules': 0, 'steps': 0, 'step_rules': 0, 'step_compounds': 0}
+    scope = []
+    scope_rules = []
+    steps = []
+    step_rules = []
+    step_compounds = []
+    pathways = 0
+    connection = sqlite3.connect(tmp_path)
+
+    def flush(tables):
+        for table, count in _flush(connection, tables).items():
+            counts[table] += count
+
+    try:
+        #the file is not visible before it is renamed, it does not need to survive a crash
+        connection.execute('PRAGMA journal_mode=OFF')
+        connection.execute('PRAGMA synchronous=OFF')
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.executemany('INSERT INTO metadata VALUES (?, ?)', [('schema_version', SCHEMA_VERSION),
+                                                                            ('results', os.path.basename(results_path or '')),
+                                                                            ('out_paths', os.path.basename(out_paths or '')),
+                                                                            ('out_compounds', os.path.basename(out_compounds or ''))])
+            if out_compounds:
+                #the compounds of the file are given the first keys, in its order
+                for compound_id, structure in rp2pathsReader.read_compounds(out_compounds):
+                    structures[compound_id] = structure
+                    compounds[compound_id]
+            if results_path:
+                for row, row_rules in _scope_rows(results_path, transformations, rules):
+                    scope.append(row)
+                    scope_rules.extend(row_rules)
+                    if len(scope)>=BATCH_SIZE:
+                        flush([('scope', scope), ('scope_rules', scope_rules)])
+                flush([('scope', scope), ('scope_rules', scope_rules)])
+            if out_paths:
+                step_id = 0
+                for pathway in rp2pathsReader.read_pathways(out_paths):
+                    pathways += 1
+                    for position, step in enumerate(pathway.steps, 1):
+                        step_id += 1
+                        steps.append((step_id, pathway.path_id, position, transformations[step.transformation_id]))
+                        step_rules.extend([(rules[i], step_id) for i in set(step.rule_ids)])
+                        #a compound on both sides of a step is stored once per side
+                        for side, members in [(SIDES['substrate'], step.substrates), (SIDES['product'], step.products)]:
+                            coefficients = {}
+                            for compound_id, coefficient in members:
+                                coefficients[compound_id] = coefficients.get(compound_id, 0)+coefficient
+                            step_compounds.extend([(compounds[i], step_id, side, coefficients[i]) for i in coefficients])
+                    if len(step_compounds)>=BATCH_SIZE:
+                        flush([('steps', steps), ('step_rules', step_rules), ('step_compounds', step_compounds)])
+                flush([('steps', steps), ('step_rules', step_rules), ('step_compounds', step_compounds)])
+            connection.executemany('INSERT INTO compounds VALUES (?, ?, ?)', compounds.rows(structures))
+            connection.executemany('INSERT INTO rules VALUES (?, ?)', [i[:2] for i in rules.rows()])
+            connection.executemany('INSERT INTO transformations VALUES (?, ?)', [i[:2] for i in transformations.rows()])
+            for statement in INDEXES:
+                connection.execute(statement)
+        connection.execute('ANALYZE')
+    except BaseException:
+        connection.close()
+        os.remove(tmp_path)
+        raise
+    connection.close()
+    os.replace(tmp_path, db_path)
+    counts.update({'compounds': len(compounds), 'rules': len(rules), 'transformations': len(transformations), 'pathways': pathways})
+    counts['wall_time'] = round(time.time()-start, 3)
+    logger.debug('Wrote '+str(counts['pathways'])+' pathways and '+str(counts['scope'])+' scope rows to '+str(db_path))
+    return counts
+
+
+def pathways_with_compound(db_path, compound_id):
+    """Return the IDs of the pathways that hold a compound
+
+    :param db_path: Path to the SQLite file
+    :param compound_id: The compound ID
+
+    :type db_path: str
+    :type compound_id: str
+
+    :rtype: list
+    :return: The sorted path IDs
+    """
+    connection = sqlite3.connect(db_path)
+    try:
+        return [i[0] for i in connection.execute('SELECT DISTINCT steps.path_id FROM compounds JOIN step_compounds ON step_compounds.compound=compounds.id JOIN steps ON steps.id=step_compounds.step WHERE compounds.compound_id=? ORDER BY steps.path_id', (compound_id,))]
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser('Load the outputs of RetroPath2.0 and rp2paths into a SQLite file')
+    parser.add_argument('-db', type=str, required=True)
+    parser.add_argument('-rp2_results', type=str, default=None)
+    parser.add_argument('-out_paths', type=str, default=None)
+    parser.add_argument('-out_compounds', type=str, default=None)
+    params = parser.parse_args()
+    write_database(params.db, params.rp2_results, params.out_paths, params.out_compounds)
+
+if __name__ == "__main__":
+    main()
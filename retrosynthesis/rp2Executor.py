@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Pool of long-lived RetroPath2.0 workers fed through watched directories, so that the JVM startup, OSGi bundle loading and workflow load are paid once per worker instead of once per run
+
+Each worker is started with its own jobs folder and follows this protocol:
+    - touches <jobs_dir>/heartbeat once the workflow is loaded, and then periodically while idle
+    - picks the jobs written to <jobs_dir>/inbox/<job_id>.json as {"id": ..., "variables": [[name, value, type], ...]}
+    - runs the workflow with the variables and writes <jobs_dir>/outbox/<job_id>.json as {"status": "done" or "error", "message": ...}
+    - exits when <jobs_dir>/stop exists
+The looping workflow is not part of the docker, so there is no default command: any executable following
+the protocol, for example a KNIME workflow or a stand-in script, is given to the executor
+
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import shutil
+import signal
+import logging
+import tempfile
+import threading
+import subprocess
+
+import procSupervisor
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+#seconds to wait for a worker to load the workflow
+START_TIMEOUT = 300
+#seconds before a worker slot tries to start again after a failed start, doubled at each failure up to START_MAX_BACKOFF
+START_BACKOFF = 60
+START_MAX_BACKOFF = 3600
+#number of consecutive failed starts after which the executor is disabled
+MAX_START_FAILURES = 3
+#seconds without heartbeat after which an idle worker is considered hung
+HEARTBEAT_TIMEOUT = 60
+POLL_INTERVAL = 0.5
+STOP_TIMEOUT = 10
+#size of the end of the worker log returned with the errors
+LOG_TAIL = 64*1024
+
+
+class _Worker(object):
+    """A running worker and its jobs folder
+    """
+    def __init__(self, name, root_dir, command, max_virtual_memory=None):
+        self.name = name
+        self.jobs_dir = tempfile.mkdtemp(dir=root_dir, prefix=name+'-')
+        self.inbox = os.path.join(self.jobs_dir, 'inbox')
+        self.outbox = os.path.join(self.jobs_dir, 'outbox')
+        self.heartbeat = os.path.join(self.jobs_dir, 'heartbeat')
+        self.log_path = os.path.join(self.jobs_dir, 'worker.log')
+        os.makedirs(self.inbox)
+        os.makedirs(self.outbox)
+        self.jobs = 0
+        self.base_rss = None
+        command = [i.replace('{jobs_dir}', self.jobs_dir) for i in command]
+        if max_virtual_memory is not None:
+            command = procSupervisor.limit_virtual_memory(command, max_virtual_memory)
+        with open(self.log_path, 'wb') as log:
+            self.process = subprocess.Popen(command,
+                                            stdout=log,
+                                            stderr=subprocess.STDOUT,
+                                            start_new_session=True)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def heartbeat_age(self):
+        try:
+            return time.time()-os.stat(self.heartbeat).st_mtime
+        except OSError:
+            return None
+
+    def log_tail(self):
+        try:
+            with open(self.log_path, 'rb') as f:
+                f.seek(max(os.path.getsize(self.log_path)-LOG_TAIL, 0))
+                return f.read().decode('utf-8', 'replace')
+        except OSError:
+            return ''
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """Ask the worker to exit and kill its process group if it does not
+        """
+        if self.is_alive():
+            try:
+                open(os.path.join(self.jobs_dir, 'stop'), 'w').close()
+                self.process.wait(timeout=timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        if self.is_alive():
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.process.wait()
+        shutil.rmtree(self.jobs_dir, ignore_errors=True)
+
+
+class RP2Executor(object):
+    """Pool of warm RetroPath2.0 workers
+
+    The workers are started lazily and replaced when they die, stop sending heartbeats, have run
+    max_jobs jobs or when the resident memory of their process tree exceeds max_rss or grows by more
+    than max_rss_growth times the memory measured after their first job. A slot whose worker failed
+    to start returns unavailable at once until its backoff has passed, and the executor is disabled
+    after max_start_failures consecutive failed starts
+
+    :param command: The worker command, where {jobs_dir} is replaced by the jobs folder of the worker
+    :param workers: The number of workers (Default: 1)
+    :param root_dir: The folder of the jobs folders, a temporary folder if None (Default: None)
+    :param max_jobs: The number of jobs after which a worker is recycled (Default: 20)
+    :param max_rss: The resident memory in bytes above which a worker is recycled, no limit if None (Default: None)
+    :param max_rss_growth: The growth of the resident memory after which a worker is recycled (Default: 2.0)
+    :param start_timeout: The seconds to wait for a worker to send its first heartbeat (Default: 300)
+    :param max_virtual_memory: The virtual memory limit in bytes of each worker, no limit if None (Default: None)
+    :param start_backoff: The seconds before a slot tries to start a worker again after a failed start, doubled at each failure (Default: 60)
+    :param max_start_failures: The number of consecutive failed starts after which the executor is disabled, never if None (Default: 3)
+
+    :type command: list
+    :type workers: int
+    :type root_dir: str
+    :type max_jobs: int
+    :type max_rss: int
+    :type max_rss_growth: float
+    :type start_timeout: float
+    :type max_virtual_memory: int
+    :type start_backoff: float
+    :type max_start_failures: int
+    """
+    def __init__(self,
+                 command,
+                 workers=1,
+                 root_dir=None,
+                 max_jobs=20,
+                 max_rss=None,
+                 max_rss_growth=2.0,
+                 start_timeout=START_TIMEOUT,
+                 max_virtual_memory=None,
+                 start_backoff=START_BACKOFF,
+                 max_start_failures=MAX_START_FAILURES):
+        self.command = command
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.max_rss_growth = max_rss_growth
+        self.start_timeout = start_timeout
+        self.max_virtual_memory = max_virtual_memory
+        self.start_backoff = start_backoff
+        self.max_start_failures = max_start_failures
+        self.start_failures = 0
+        self.is_tmp_root = root_dir is None
+        self.root_dir = tempfile.mkdtemp(prefix='rp2executor-') if root_dir is None else root_dir
+        os.makedirs(self.root_dir, exist_ok=True)
+        #the name, the worker, the number of consecutive failed starts and the time of the next start of each slot
+        self.slots = queue.Queue()
+        for i in range(workers):
+            self.slots.put(['worker'+str(i), None, 0, 0.0])
+        self.lock = threading.Lock()
+        self.closed = False
+        self.disabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _start(self, name):
+        """Start a worker and wait for its first heartbeat
+
+        :rtype: _Worker
+        :return: The worker or None if it could not be started
+        """
+        logger.debug('Starting the RetroPath2.0 worker '+str(name))
+        try:
+            worker = _Worker(name, self.root_dir, self.command, self.max_virtual_memory)
+        except (OSError, ValueError) as e:
+            logger.warning('Cannot start the RetroPath2.0 worker: '+str(e))
+            return None
+        start = time.time()
+        while worker.heartbeat_age() is None:
+            if not worker.is_alive() or time.time()-start>self.start_timeout:
+                logger.warning('The RetroPath2.0 worker '+str(name)+' did not start: '+worker.log_tail()[-1000:])
+                worker.stop()
+                return None
+            time.sleep(POLL_INTERVAL)
+        logger.debug('The RetroPath2.0 worker '+str(name)+' started in '+str(round(time.time()-start, 1))+' seconds')
+        return worker
+
+    def _start_slot(self, slot):
+        """Start the worker of a slot, unless the slot is waiting for the backoff of a failed start
+
+        :param slot: The slot
+
+        :type slot: list
+
+        :rtype: _Worker
+        :return: The worker or None if it is not started
+        """
+        if time.time()<slot[3]:
+            return None
+        worker = self._start(slot[0])
+        with self.lock:
+            if worker:
+                slot[2] = 0
+                self.start_failures = 0
+                return worker
+            slot[2] += 1
+            slot[3] = time.time()+min(self.start_backoff*2**(slot[2]-1), START_MAX_BACKOFF)
+            self.start_failures += 1
+            if self.max_start_failures and self.start_failures>=self.max_start_failures and not self.disabled:
+                logger.warning('Disabling the RetroPath2.0 executor after '+str(self.start_failures)+' failed worker starts')
+                self.disabled = True
+        return None
+
+    def is_healthy(self, worker):
+        """Check that an idle worker is alive and still sends heartbeats
+
+        :param worker: The worker
+
+        :type worker: _Worker
+
+        :rtype: bool
+        :return: The health of the worker
+        """
+        if not worker.is_alive():
+            logger.warning('The RetroPath2.0 worker '+str(worker.name)+' has exited')
+            return False
+        age = worker.heartbeat_age()
+        if age is None or age>HEARTBEAT_TIMEOUT:
+            logger.warning('The RetroPath2.0 worker '+str(worker.name)+' has not sent a heartbeat for '+str(age)+' seconds')
+            return False
+        return True
+
+    def _needs_recycling(self, worker):
+        """Check if a worker has run too many jobs or uses too much memory
+
+        :param worker: The worker
+
+        :type worker: _Worker
+
+        :rtype: bool
+        :return: If the worker must be replaced
+        """
+        if self.max_jobs and worker.jobs>=self.max_jobs:
+            logger.debug('Recycling the RetroPath2.0 worker '+str(worker.name)+' after '+str(worker.jobs)+' jobs')
+            return True
+        rss = procSupervisor.tree_stats(worker.process.pid)['rss']
+        if worker.base_rss is None:
+            worker.base_rss = rss
+        if self.max_rss and rss>self.max_rss:
+            logger.debug('Recycling the RetroPath2.0 worker '+str(worker.name)+' using '+str(rss)+' bytes')
+            return True
+        if self.max_rss_growth and worker.base_rss and rss>worker.base_rss*self.max_rss_growth:
+            logger.debug('Recycling the RetroPath2.0 worker '+str(worker.name)+' grown from '+str(worker.base_rss)+' to '+str(rss)+' bytes')
+            return True
+        return False
+
+    def accepts(self, max_virtual_memory=None, cpus=None):
+        """Check that the workers run within the limits of a job
+
+        The limits of the workers are set when they start, so a job is only accepted if their virtual
+        memory limit is no larger than the one of the job, and if it does not set the number of CPUs
+
+        :param max_virtual_memory: The virtual memory limit in bytes of the job, no limit if None (Default: None)
+        :param cpus: The number of CPUs of the job, no limit if None (Default: None)
+
+        :type max_virtual_memory: int
+        :type cpus: int
+
+        :rtype: bool
+        :return: If the job can run on the workers
+        """
+        if cpus:
+            return False
+        if max_virtual_memory is not None:
+            return self.max_virtual_memory is not None and self.max_virtual_memory<=max_virtual_memory
+        return True
+
+    def submit(self, variables, timeout, monitor=None, max_virtual_memory=None, cpus=None):
+        """Run a job on the first idle worker
+
+        :param variables: The workflow variables as (name, value, type)
+        :param timeout: The timeout of the job in seconds
+        :param monitor: Function called every procSupervisor.SAMPLE_INTERVAL seconds, returning the reason to stop the job or None (Default: None)
+        :param max_virtual_memory: The virtual memory limit in bytes of the job, the job is unavailable if the workers do not run within it (Default: None)
+        :param cpus: The number of CPUs of the job, the job is unavailable if it is set (Default: None)
+
+        :type variables: list
+        :type timeout: float
+        :type monitor: function
+        :type max_virtual_memory: int
+        :type cpus: int
+
+        :rtype: tuple
+        :return: The state of the job (done, error, timeout, stopped or unavailable), the message of the worker or the reason of the stop and the metrics of the job
+        """
+        if self.closed or self.disabled:
+            return 'unavailable', '', None
+        if not self.accepts(max_virtual_memory, cpus):
+            logger.warning('The RetroPath2.0 workers do not run within the RAM limit or CPUs of the job')
+            return 'unavailable', '', None
+        slot = self.slots.get()
+        try:
+            if slot[1] and not self.is_healthy(slot[1]):
+                slot[1].stop()
+                slot[1] = None
+            if not slot[1]:
+                slot[1] = None if self.disabled else self._start_slot(slot)
+                if not slot[1]:
+                    return 'unavailable', '', None
+            worker = slot[1]
+            job_id = uuid.uuid4().hex
+            job_path = os.path.join(worker.inbox, job_id+'.json')
+            with open(job_path+'.tmp', 'w') as f:
+                json.dump({'id': job_id, 'variables': [list(i) for i in variables]}, f)
+            os.rename(job_path+'.tmp', job_path)
+            result_path = os.path.join(worker.outbox, job_id+'.json')
+            output_dir = dict([(i[0], i[1]) for i in variables]).get('output.dir')
+            sampler = procSupervisor.TreeSampler(worker.process.pid, output_dir)
+            start = time.time()
+            next_sample = start
+            while not os.path.exists(result_path):
+                if time.time()>=next_sample:
+                    sampler.sample()
+                    next_sample = time.time()+procSupervisor.SAMPLE_INTERVAL
+                    stopped = monitor() if monitor else None
+                    if stopped:
+                        #the workflow cannot be interrupted, the worker is replaced
+                        logger.info('Stopping the job of the RetroPath2.0 worker '+str(worker.name)+': '+str(stopped))
+                        metrics = sampler.metrics()
+                        worker.stop(0)
+                        slot[1] = None
+                        return 'stopped', stopped, metrics
+                if not worker.is_alive():
+                    logger.warning('The RetroPath2.0 worker '+str(worker.name)+' died during the job')
+                    message = worker.log_tail()
+                    worker.stop()
+                    slot[1] = None
+                    return 'error', message, sampler.metrics()
+                if time.time()-start>timeout:
+                    #the workflow cannot be interrupted, the worker is replaced
+                    metrics = sampler.metrics()
+                    worker.stop(0)
+                    slot[1] = None
+                    return 'timeout', '', metrics
+                time.sleep(POLL_INTERVAL)
+            sampler.sample()
+            metrics = sampler.metrics()
+            try:
+                with open(result_path, 'r') as f:
+                    result = json.load(f)
+                os.remove(result_path)
+            except (OSError, ValueError) as e:
+                result = {'status': 'error', 'message': 'Cannot read the job result: '+str(e)}
+            worker.jobs += 1
+            if self._needs_recycling(worker):
+                worker.stop()
+                slot[1] = None
+            if result.get('status')=='done':
+                return 'done', str(result.get('message', '')), metrics
+            return 'error', str(result.get('message', '')), metrics
+        finally:
+            if self.closed and slot[1]:
+                slot[1].stop()
+                slot[1] = None
+            self.slots.put(slot)
+
+    def close(self):
+        """Stop all the workers
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        for i in range(self.slots.qsize()):
+            slot = self.slots.get()
+            if slot[1]:
+                slot[1].stop()
+                slot[1] = None
+            self.slots.put(slot)
+        if self.is_tmp_root:
+            shutil.rmtree(self.root_dir, ignore_errors=True)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Checks of the inputs of RetroPath2.0 run before KNIME is launched: the source InChI is normalised and looked up in an InChIKey index of the sink, and the sink and rules files are parsed, so that bad requests return their status without paying for the JVM startup
+
+"""
+
+import os
+import csv
+import logging
+import tempfile
+import threading
+import collections
+
+from rdkit import Chem
+
+import fileCache
+import rrScreen
+import runRR
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+SINK_INCHI_COLUMN = 'InChI'
+SINK_INDEX = 'inchikeys.txt'
+MEMO_SIZE = 8
+#the validation of the last files is kept in memory as long as their size and modification time are unchanged
+_memo = collections.OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_ino, stat.st_size, stat.st_mtime
+
+
+def _memoised(kind, path, function):
+    """Return the result of a function of a file, computed once per version of the file in the process
+
+    Only the results of the last MEMO_SIZE files are kept
+    """
+    stamp = (kind,)+_file_stamp(path)
+    with _memo_lock:
+        if stamp in _memo:
+            _memo.move_to_end(stamp)
+            return _memo[stamp]
+    result = function()
+    with _memo_lock:
+        _memo[stamp] = result
+        while len(_memo)>MEMO_SIZE:
+            _memo.popitem(last=False)
+    return result
+
+
+def inchi_key(inchi):
+    """Return the InChIKey of an InChI without normalising it
+
+    :param inchi: The InChI
+
+    :type inchi: str
+
+    :rtype: str
+    :return: The InChIKey or None if the InChI is invalid
+    """
+    try:
+        with rrScreen.blockLogs():
+            return Chem.InchiToInchiKey(inchi) or None
+    except Exception:
+        return None
+
+
+def normalize_inchi(inchi):
+    """Return the standard InChI of an InChI and its InChIKey
+
+    :param inchi: The InChI, the spaces are removed
+
+    :type inchi: str
+
+    :rtype: tuple
+    :return: The standard InChI and InChIKey, or (None, None) if the InChI cannot be parsed
+    """
+    inchi = str(inchi).replace(' ', '')
+    if not inchi.startswith('InChI='):
+        return None, None
+    with rrScreen.blockLogs():
+        mol = Chem.MolFromInchi(inchi)
+        if mol is None:
+            return None, None
+        standard_inchi = Chem.MolToInchi(mol)
+    if not standard_inchi:
+        return None, None
+    return standard_inchi, inchi_key(standard_inchi)
+
+
+def _read_sink(sink_path):
+    """Read the InChIKeys of a sink file
+
+    :rtype: tuple
+    :return: The set of InChIKeys and the number of rows with an invalid InChI
+    """
+    keys = set()
+    invalid = 0
+    with open(sink_path, newline='') as f:
+        reader = csv.reader(f, delimiter=',', quotechar='"')
+        header = next(reader, None)
+        if not header or not SINK_INCHI_COLUMN in header:
+            raise ValueError('The sink file must have a '+SINK_INCHI_COLUMN+' column')
+        index = header.index(SINK_INCHI_COLUMN)
+        for row in reader:
+            if not row:
+                continue
+            key = inchi_key(row[index].replace(' ', '')) if len(row)>index else None
+            if key:
+                keys.add(key)
+            else:
+                invalid += 1
+    if not keys:
+        raise ValueError('The sink file has no valid InChI')
+    return keys, invalid
+
+
+def load_sink(sink_path, cache_dir=None):
+    """Return the InChIKeys of the compounds of a sink file
+
+    The index is kept in memory for each version of the file and, with a cache folder, stored in the
+    cache under the hash of the file so that other processes do not parse it again
+
+    :param sink_path: Path to the sink file
+    :param cache_dir: Path to the cache folder (Default: None)
+
+    :type sink_path: str
+    :type cache_dir: str
+
+    :rtype: frozenset
+    :return: The InChIKeys of the sink
+    """
+    def load():
+        key = None
+        if cache_dir:
+            try:
+                key = fileCache.cacheKey('sinkindex', fileCache.fileHash(sink_path, cache_dir))
+                entry = fileCache.getEntry(cache_dir, key)
+                if entry:
+                    with open(os.path.join(entry, SINK_INDEX), 'r') as f:
+                        return frozenset(f.read().split())
+            except OSError as e:
+                logger.debug('Cannot use the cached sink index: '+str(e))
+        keys, invalid = _read_sink(sink_path)
+        if invalid:
+            logger.warning('Skipped '+str(invalid)+' rows of the sink file with an invalid InChI')
+        if key:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                index_path = os.path.join(tmp_dir, SINK_INDEX)
+                with open(index_path, 'w') as f:
+                    f.write('\n'.join(sorted(keys)))
+                fileCache.putEntry(cache_dir, key, {SINK_INDEX: index_path}, {'sink': os.path.realpath(sink_path), 'compounds': len(keys)})
+        return frozenset(keys)
+    return _memoised('sink', sink_path, load)
+
+
+def check_rules(rules_path):
+    """Check that a rules file parses as RetroPath2.0 rules
+
+    :param rules_path: Path to the rules file
+
+    :type rules_path: str
+
+    :rtype: str
+    :return: The error or None if the file is valid
+    """
+    def check():
+        with open(rules_path, newline='') as f:
+            reader = csv.reader(f, delimiter=',', quotechar='"')
+            header = next(reader, None)
+            if not header:
+                return 'The rules file is empty'
+            missing = [i for i in runRR.RULES_HEADER if not i in header]
+            if missing:
+                return 'The rules file misses the columns '+str(missing)
+            count = 0
+            for row in reader:
+                if not row:
+                    continue
+                if not len(row)==len(header):
+                    return 'The line '+str(reader.line_num)+' of the rules file has '+str(len(row))+' columns instead of '+str(len(header))
+                count += 1
+        if not count:
+            return 'The rules file has no rule'
+        return None
+    return _memoised('rules', rules_path, check)
+
+
+def preflight(sink_path, rules_path, source_inchi, cache_dir=None):
+    """Check the inputs of a RetroPath2.0 run
+
+    :param sink_path: Path to the sink file
+    :param rules_path: Path to the rules file, not checked if None
+    :param source_inchi: The InChI of the source
+    :param cache_dir: Path to the cache folder of the sink index (Default: None)
+
+    :type sink_path: str
+    :type rules_path: str
+    :type source_inchi: str
+    :type cache_dir: str
+
+    :rtype: tuple
+    :return: The status of run_rp2 (noresulterror for an invalid source InChI, oserror for an invalid sink or rules file, or sourceinsinkerror) and the message, or (None, '') if the run can go on
+    """
+    standard_inchi, key = normalize_inchi(source_inchi)
+    if not key:
+        return 'noresulterror', 'Cannot parse the source InChI: '+str(source_inchi)
+    try:
+        sink_keys = load_sink(sink_path, cache_dir)
+    except (OSError, ValueError, csv.Error) as e:
+        return 'oserror', 'Cannot read the sink file '+str(sink_path)+': '+str(e)
+    if rules_path:
+        try:
+            error = check_rules(rules_path)
+        except (OSError, csv.Error) as e:
+            error = 'Cannot read the rules file '+str(rules_path)+': '+str(e)
+        if error:
+            return 'oserror', error
+    #the InChI as given is also looked up, in case the sink holds non standard InChIs
+    if key in sink_keys or inchi_key(str(source_inchi).replace(' ', '')) in sink_keys:
+        return 'sourceinsinkerror', 'Source found in sink'
+    return None, ''
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Read the RetroPath2.0 results while the workflow writes them, to hand the new rows to the caller and stop the run early once it has found enough solutions, and summarise and index the results file in a single pass
+
+"""
+
+import os
+import re
+import csv
+import json
+import time
+import logging
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+IN_SINK_COLUMN = 'In Sink'
+ITERATION_COLUMN = 'Iteration'
+TRANSFORMATION_COLUMN = 'Transformation ID'
+SUBSTRATE_COLUMN = 'Substrate InChI'
+PRODUCT_COLUMN = 'Product InChI'
+#sidecar file of the summary and byte offsets of a results file
+INDEX_SUFFIX = '.index.json'
+COPY_BLOCK = 1024*1024
+
+
+def in_sink(row):
+    """Check if all the substrates of a results row are in the sink
+
+    :param row: The row as a dictionnary of the header to the values
+
+    :type row: dict
+
+    :rtype: bool
+    :return: If the row reaches the sink
+    """
+    flags = re.findall(r'\d+', row.get(IN_SINK_COLUMN) or '')
+    return bool(flags) and all([int(i)>0 for i in flags])
+
+
+def split_inchis(value):
+    """Split a list of InChIs of a results cell
+
+    The InChIs hold commas, so the cell is split before each InChI= prefix whatever the separator
+
+    :param value: The cell, such as [InChI=...,InChI=...]
+
+    :type value: str
+
+    :rtype: list
+    :return: The InChIs
+    """
+    return [i.strip(' ,;[]') for i in re.split(r'(?=InChI=)', value or '') if i.strip(' ,;[]')]
+
+
+def has_rows(csv_path):
+    """Check if a CSV file has at least one row after its header, without reading the rest
+
+    :param csv_path: Path to the file
+
+    :type csv_path: str
+
+    :rtype: bool
+    :return: If the file has a row
+    """
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f, delimiter=',', quotechar='"')
+        next(reader, None)
+        return not next(reader, None) is None
+
+
+def scan(results_path):
+    """Summarise and index a results file in one pass
+
+    Only the complete lines are read. The rows of each iteration are indexed by the byte ranges that hold them,
+    so that they can be read back without parsing the rest of the file
+
+    :param results_path: Path to the results file
+
+    :type results_path: str
+
+    :rtype: dict
+    :return: The size of the complete lines, the number of rows and of rows reaching the sink, the number of distinct compounds and transformations, the columns and byte range of the header and the number of rows and byte ranges of each iteration
+    """
+    summary = {'size': 0, 'rows': 0, 'sink_rows': 0, 'compounds': 0, 'transformations': 0, 'columns': [], 'header': None, 'iterations': {}}
+    compounds = set()
+    transformations = set()
+    header = None
+    offset = 0
+    with open(results_path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            start = offset
+            offset += len(line)
+            row = next(csv.reader([line.decode('utf-8', 'replace')], delimiter=',', quotechar='"'), None)
+            if not row:
+                continue
+            if header is None:
+                header = row
+                summary['columns'] = header
+                summary['header'] = [start, offset]
+                continue
+            #the header is written again when the workflow appends the rows of another source
+            if row==header:
+                continue
+            row = dict(zip(header, row))
+            summary['rows'] += 1
+            if in_sink(row):
+                summary['sink_rows'] += 1
+            if row.get(TRANSFORMATION_COLUMN):
+                transformations.add(row[TRANSFORMATION_COLUMN])
+            compounds.update(split_inchis(row.get(SUBSTRATE_COLUMN)))
+            compounds.update(split_inchis(row.get(PRODUCT_COLUMN)))
+            iteration = summary['iterations'].setdefault(str(row.get(ITERATION_COLUMN, '')), {'rows': 0, 'offsets': []})
+            iteration['rows'] += 1
+            #the rows of an iteration are written together, a range is only added if they are not
+            if iteration['offsets'] and iteration['offsets'][-1][1]==start:
+                iteration['offsets'][-1][1] = offset
+            else:
+                iteration['offsets'].append([start, offset])
+    summary['size'] = offset
+    summary['compounds'] = len(compounds)
+    summary['transformations'] = len(transformations)
+    return summary
+
+
+def write_index(results_path, summary):
+    """Write the summary of a results file to its sidecar index
+
+    :param results_path: Path to the results file
+    :param summary: The summary returned by scan, of this file or of the file it has been copied from
+
+    :type results_path: str
+    :type summary: dict
+
+    :rtype: bool
+    :return: If the index has been written, it is not if the summary does not match the size of the file
+    """
+    try:
+        stat = os.stat(results_path)
+        if not stat.st_size==summary['size']:
+            logger.debug('The summary does not match the results file '+str(results_path))
+            return False
+        #the modification time tells a stale index from the one of a rewritten file of the same size
+        with open(results_path+INDEX_SUFFIX, 'w') as f:
+            json.dump(dict(summary, mtime=stat.st_mtime), f)
+    except OSError as e:
+        logger.warning('Cannot write the index of '+str(results_path)+': '+str(e))
+        return False
+    return True
+
+
+def results_index(results_path):
+    """Return the summary of a results file, from its sidecar index or else by scanning it
+
+    :param results_path: Path to the results file
+
+    :type results_path: str
+
+    :rtype: dict
+    :return: The summary, see scan
+    """
+    try:
+        with open(results_path+INDEX_SUFFIX, 'r') as f:
+            summary = json.load(f)
+        stat = os.stat(results_path)
+        if summary['size']==stat.st_size and summary['mtime']==stat.st_mtime:
+            return summary
+    except (OSError, ValueError, KeyError):
+        pass
+    summary = scan(results_path)
+    write_index(results_path, summary)
+    return summary
+
+
+def read_iterations(results_path, iterations, summary=None):
+    """Read the rows of some iterations of a results file through its index
+
+    :param results_path: Path to the results file
+    :param iterations: The iterations to read
+    :param summary: The summary of the file, read from its index if None (Default: None)
+
+    :type results_path: str
+    :type iterations: list
+    :type summary: dict
+
+    :rtype: generator
+    :return: The rows, as dictionnaries of the header to the values
+    """
+    if summary is None:
+        summary = results_index(results_path)
+    if not summary['header']:
+        return
+    ranges = sorted([j for i in iterations for j in summary['iterations'].get(str(i), {}).get('offsets', [])])
+    with open(results_path, 'rb') as f:
+        f.seek(summary['header'][0])
+        header = next(csv.reader([f.read(summary['header'][1]-summary['header'][0]).decode('utf-8', 'replace')], delimiter=',', quotechar='"'))
+        for start, end in ranges:
+            f.seek(start)
+            block = f.read(end-start).decode('utf-8', 'replace')
+            for row in csv.reader(block.splitlines(), delimiter=',', quotechar='"'):
+                if row:
+                    yield dict(zip(header, row))
+
+
+def copy_complete_lines(results_path, output):
+    """Copy a results file up to its last complete line
+
+    A run killed while writing leaves a truncated last line that is dropped
+
+    :param results_path: Path to the results file
+    :param output: Path to the copy
+
+    :type results_path: str
+    :type output: str
+
+    :rtype: int
+    :return: The number of bytes copied
+    """
+    with open(results_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        #look for the last line feed from the end of the file
+        while end>0:
+            start = max(end-COPY_BLOCK, 0)
+            f.seek(start)
+            block = f.read(end-start)
+            index = block.rfind(b'\n')
+            if index>=0:
+                end = start+index+1
+                break
+            end = start
+        f.seek(0)
+        with open(output, 'wb') as o:
+            left = end
+            while left>0:
+                block = f.read(min(left, COPY_BLOCK))
+                if not block:
+                    break
+                o.write(block)
+                left -= len(block)
+    return end
+
+
+class ResultsTail(object):
+    """Follow the results file of a running RetroPath2.0 workflow
+
+    The object is called periodically by the supervisor of the run: it reads the complete lines written
+    since the last call, passes the new rows to on_rows and returns the reason to stop the run once
+    stop_sink_rows rows reach the sink or when no row has been written for stop_idle minutes after the first one
+
+    :param results_path: Path to the results file
+    :param on_rows: Function called with the list of the new rows, as dictionnaries of the header to the values (Default: None)
+    :param stop_sink_rows: The number of rows reaching the sink after which the run is stopped, never stopped if None (Default: None)
+    :param stop_idle: The minutes without new rows after which the run is stopped, never stopped if None (Default: None)
+
+    :type results_path: str
+    :type on_rows: function
+    :type stop_sink_rows: int
+    :type stop_idle: float
+    """
+    def __init__(self, results_path, on_rows=None, stop_sink_rows=None, stop_idle=None):
+        self.results_path = results_path
+        self.on_rows = on_rows
+        self.stop_sink_rows = stop_sink_rows
+        self.stop_idle = stop_idle
+        self.offset = 0
+        self.inode = None
+        self.header = None
+        self.rows = 0
+        self.sink_rows = 0
+        self.last_row_time = None
+        #rows already passed to the caller that are read again after the file is rewritten
+        self.skip = 0
+
+    def read(self):
+        """Read the rows written since the last call
+
+        :rtype: generator
+        :return: The new rows, as dictionnaries of the header to the values
+        """
+        try:
+            stat = os.stat(self.results_path)
+        except OSError:
+            return
+        size = stat.st_size
+        if size<self.offset or (self.inode and not stat.st_ino==self.inode):
+            logger.debug('The results file has been rewritten, reading it again')
+            self.offset = 0
+            self.header = None
+            self.skip = self.rows
+        self.inode = stat.st_ino
+        if size==self.offset:
+            return
+        with open(self.results_path, 'rb') as f:
+            f.seek(self.offset)
+            block = f.read(size-self.offset)
+        end = block.rfind(b'\n')
+        if end<0:
+            return
+        self.offset += end+1
+        for row in csv.reader(block[:end+1].decode('utf-8', 'replace').splitlines(), delimiter=',', quotechar='"'):
+            if not row:
+                continue
+            if self.header is None:
+                self.header = row
+                continue
+            if row==self.header:
+                continue
+            if self.skip:
+                self.skip -= 1
+                continue
+            row = dict(zip(self.header, row))
+            self.rows += 1
+            if in_sink(row):
+                self.sink_rows += 1
+            self.last_row_time = time.time()
+            yield row
+
+    def __call__(self):
+        """Read the new rows and check the stop rules
+
+        :rtype: str
+        :return: The reason to stop the run, or None to let it continue
+        """
+        rows = list(self.read())
+        if rows and self.on_rows:
+            try:
+                self.on_rows(rows)
+            except Exception as e:
+                logger.warning('The results callback has failed: '+str(e))
+        if self.stop_sink_rows and self.sink_rows>=self.stop_sink_rows:
+            return str(self.sink_rows)+' rows reaching the sink'
+        if self.stop_idle and self.last_row_time and time.time()-self.last_row_time>self.stop_idle*60.0:
+            return 'no new rows for '+str(self.stop_idle)+' minutes'
+        return None
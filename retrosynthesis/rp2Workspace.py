@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Private KNIME workspace and configuration areas for each launch, cloned from a template initialised once, so that concurrent RetroPath2.0 runs do not contend on the workspace lock and the OSGi configuration and do not rebuild the bundle cache
+
+"""
+
+import os
+import shutil
+import logging
+import argparse
+import subprocess
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+KNIME_DIR = '/usr/local/knime/'
+KNIME_TEMPLATE = '/home/rp2/knime_template/'
+PREFERENCES = '/home/retrosynthesis/pref.epf'
+#folder of the OSGi framework in the configuration area, its numbered folders hold the files extracted from the bundles
+OSGI_FOLDER = 'org.eclipse.osgi'
+#the workspace lock of the template is not cloned
+LOCK_FILES = ['.lock']
+TEMPLATE_TIMEOUT = 600
+
+
+def _is_immutable(relative_path):
+    """Check if a file of the configuration area is never written after its extraction
+
+    The files are shared with the template through hardlinks, so that only these files can be linked: the
+    process runs as root and would write through the permissions of any other file
+
+    :param relative_path: Path of the file relative to the configuration area
+
+    :type relative_path: str
+
+    :rtype: bool
+    :return: If the file can be linked
+    """
+    parts = relative_path.split(os.sep)
+    return len(parts)>2 and parts[0]==OSGI_FOLDER and parts[1].isdigit()
+
+
+def _clone_tree(source, target, link_filter=None):
+    """Copy a folder, linking the files accepted by the filter instead of copying them
+
+    :param source: Path to the folder to clone
+    :param target: Path to the new folder
+    :param link_filter: Function of the relative path of a file returning if it can be linked, nothing is linked if None (Default: None)
+
+    :type source: str
+    :type target: str
+    :type link_filter: function
+
+    :rtype: tuple
+    :return: The number of files linked and copied
+    """
+    linked = 0
+    copied = 0
+    for root, dirs, files in os.walk(source):
+        relative_root = os.path.relpath(root, source)
+        target_root = os.path.normpath(os.path.join(target, relative_root))
+        os.makedirs(target_root, exist_ok=True)
+        #the linked folders are not walked
+        for name in dirs:
+            if os.path.islink(os.path.join(root, name)):
+                os.symlink(os.readlink(os.path.join(root, name)), os.path.join(target_root, name))
+        for name in files:
+            if name in LOCK_FILES:
+                continue
+            source_path = os.path.join(root, name)
+            target_path = os.path.join(target_root, name)
+            if os.path.islink(source_path):
+                os.symlink(os.readlink(source_path), target_path)
+                continue
+            if link_filter and link_filter(os.path.normpath(os.path.join(relative_root, name))):
+                try:
+                    os.link(source_path, target_path)
+                    linked += 1
+                    continue
+                except OSError:
+                    #another file system, or hardlinks are not allowed
+                    pass
+            shutil.copy2(source_path, target_path)
+            copied += 1
+    return linked, copied
+
+
+def _link_p2(area_dir, knime_dir=KNIME_DIR):
+    """Point the p2 folder next to a configuration area to the one of the installation
+
+    The config.ini of KNIME locates the p2 data area at @config.dir/../p2
+    """
+    p2_path = os.path.join(knime_dir, 'p2')
+    if os.path.isdir(p2_path) and not os.path.lexists(os.path.join(area_dir, 'p2')):
+        os.symlink(p2_path, os.path.join(area_dir, 'p2'))
+
+
+def is_template(template_dir=KNIME_TEMPLATE):
+    """Check if a folder is an initialised template
+
+    :param template_dir: Path to the template (Default: /home/rp2/knime_template/)
+
+    :type template_dir: str
+
+    :rtype: bool
+    :return: If the template can be cloned
+    """
+    return bool(template_dir) and os.path.isfile(os.path.join(template_dir, 'configuration', 'config.ini'))
+
+
+def build_template(template_dir=KNIME_TEMPLATE, knime_dir=KNIME_DIR, preferences=PREFERENCES, timeout=TEMPLATE_TIMEOUT):
+    """Initialise the template of the KNIME areas
+
+    The configuration area of the installation is copied and KNIME is started once on the template,
+    without workflow, to populate the bundle cache and the workspace metadata
+
+    :param template_dir: Path to the template (Default: /home/rp2/knime_template/)
+    :param knime_dir: Path to the KNIME installation (Default: /usr/local/knime/)
+    :param preferences: Path to the preferences imported by KNIME (Default: /home/retrosynthesis/pref.epf)
+    :param timeout: The timeout of the start of KNIME in seconds (Default: 600)
+
+    :type template_dir: str
+    :type knime_dir: str
+    :type preferences: str
+    :type timeout: int
+
+    :rtype: bool
+    :return: If the template has been built
+    """
+    if os.path.exists(template_dir):
+        shutil.rmtree(template_dir)
+    try:
+        shutil.copytree(os.path.join(knime_dir, 'configuration'), os.path.join(template_dir, 'configuration'), symlinks=True)
+        os.makedirs(os.path.join(template_dir, 'workspace'))
+        _link_p2(template_dir, knime_dir)
+    except OSError as e:
+        logger.error('Cannot create the KNIME template: '+str(e))
+        return False
+    knime_command = [os.path.join(knime_dir, 'knime'),
+                     '-nosplash',
+                     '-nosave',
+                     '--launcher.suppressErrors',
+                     '-data', os.path.join(template_dir, 'workspace'),
+                     '-configuration', os.path.join(template_dir, 'configuration'),
+                     '-application', 'org.knime.product.KNIME_BATCH_APPLICATION',
+                     '-preferences='+preferences]
+    logger.debug(' '.join(knime_command))
+    try:
+        #without workflow KNIME exits with an error once it has started
+        subprocess.run(knime_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.error('Cannot start KNIME on the template: '+str(e))
+        return False
+    linked = 0
+    for root, dirs, files in os.walk(os.path.join(template_dir, 'configuration')):
+        linked += len([i for i in files if _is_immutable(os.path.relpath(os.path.join(root, i), os.path.join(template_dir, 'configuration')))])
+    logger.info('Built the KNIME template '+str(template_dir)+' with '+str(linked)+' bundle files shared by the runs')
+    return True
+
+
+def area_args(area_dir):
+    """Return the arguments of the private KNIME areas of a launch, without creating them
+
+    :param area_dir: Path to the folder of the areas of the launch
+
+    :type area_dir: str
+
+    :rtype: list
+    :return: The -data and -configuration arguments of KNIME
+    """
+    return ['-data', os.path.join(area_dir, 'workspace'), '-configuration', os.path.join(area_dir, 'configuration')]
+
+
+def knime_args(area_dir, template_dir=KNIME_TEMPLATE, knime_dir=KNIME_DIR):
+    """Create the private KNIME areas of a launch and return their arguments, see area_args
+
+    The workspace and the configuration area are always private. They are cloned from the template when
+    there is one, linking its bundle cache, or else the configuration area of the installation is cloned,
+    and KNIME extracts the bundles again at the launch. An OSError is raised if neither can be cloned
+
+    :param area_dir: Path to an empty folder for the areas of the launch
+    :param template_dir: Path to the template, not used if None (Default: /home/rp2/knime_template/)
+    :param knime_dir: Path to the KNIME installation, cloned without template (Default: /usr/local/knime/)
+
+    :type area_dir: str
+    :type template_dir: str
+    :type knime_dir: str
+
+    :rtype: list
+    :return: The -data and -configuration arguments of KNIME
+    """
+    workspace = os.path.join(area_dir, 'workspace')
+    configuration = os.path.join(area_dir, 'configuration')
+    if is_template(template_dir):
+        _clone_tree(os.path.join(template_dir, 'workspace'), workspace)
+        linked, copied = _clone_tree(os.path.join(template_dir, 'configuration'), configuration, _is_immutable)
+    else:
+        if not os.path.isfile(os.path.join(knime_dir, 'configuration', 'config.ini')):
+            raise OSError('Cannot create the KNIME configuration area, there is no template and '+str(os.path.join(knime_dir, 'configuration'))+' has no config.ini')
+        os.makedirs(workspace, exist_ok=True)
+        linked, copied = _clone_tree(os.path.join(knime_dir, 'configuration'), configuration, _is_immutable)
+    _link_p2(area_dir, knime_dir)
+    logger.debug('Cloned the KNIME configuration with '+str(linked)+' linked and '+str(copied)+' copied files')
+    return area_args(area_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser('Build the template of the KNIME workspace and configuration areas')
+    parser.add_argument('-template_dir', type=str, default=KNIME_TEMPLATE)
+    parser.add_argument('-knime_dir', type=str, default=KNIME_DIR)
+    params = parser.parse_args()
+    if not build_template(params.template_dir, params.knime_dir):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
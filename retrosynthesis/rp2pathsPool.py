@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Pool of warm rp2paths workers that have imported rp2paths and its dependencies once, and fork a child per job that runs the rp2paths entry point in-process, so that small scopes do not pay for the interpreter startup and the imports of RDKit and pandas
+
+Each worker is started in the rp2paths folder and follows this protocol on its standard input and output, one JSON object per line:
+    - writes {"ready": true} once the modules are imported
+    - reads the jobs as {"id": ..., "args": [...], "timeout": ..., "max_virtual_memory": ..., "log_path": ...}
+    - forks a child in its own process group that sets the virtual memory limit, writes its output to log_path and runs python3 -m rp2paths with the args, and writes {"id": ..., "pid": ...}
+    - kills the process group of the child after timeout seconds and writes {"id": ..., "returncode": ..., "time_out": ..., "rusage": [user, system, maxrss]}
+    - exits at the end of its standard input
+
+"""
+
+import io
+import gc
+import os
+import sys
+import json
+import time
+import queue
+import types
+import runpy
+import select
+import signal
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import importlib
+import subprocess
+
+import procSupervisor
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+RP2PATHS_PATH = '/home/rp2paths/'
+PRELOAD_MODULES = ['rdkit.Chem', 'rdkit.Chem.AllChem', 'pandas', 'networkx', 'rp2paths']
+WORKER_COMMAND = [sys.executable, os.path.abspath(__file__), '-worker']
+#seconds to wait for a worker to import the modules
+START_TIMEOUT = 120
+#seconds before a worker slot tries to start again after a failed start, doubled at each failure up to START_MAX_BACKOFF
+START_BACKOFF = 60
+START_MAX_BACKOFF = 3600
+#number of consecutive failed starts after which the pool is disabled
+MAX_START_FAILURES = 3
+#seconds given to a worker to report a job after its timeout
+REPLY_GRACE = 30
+POLL_INTERVAL = 0.1
+#exit code of a child that cannot set its virtual memory limit
+RLIMIT_EXIT = 125
+#size of the end of the job log returned as its output
+LOG_TAIL = 64*1024
+#file of the messages of the worker, its standard output is redirected to its log
+_protocol = sys.stdout
+
+
+######################### worker #########################
+
+
+def _preload(modules=PRELOAD_MODULES):
+    """Import the modules used by rp2paths, and the modules of the rp2paths package, so that the children inherit them
+
+    A worker that cannot import rp2paths itself could not run any job, the error is raised so that it does not start
+    """
+    for name in modules:
+        try:
+            module = importlib.import_module(name)
+        except Exception as e:
+            if name=='rp2paths':
+                raise
+            sys.stderr.write('Cannot preload '+str(name)+': '+str(e)+'\n')
+            continue
+        if name=='rp2paths' and hasattr(module, '__path__'):
+            import pkgutil
+            for info in pkgutil.iter_modules(module.__path__):
+                if info.name=='__main__':
+                    continue
+                try:
+                    importlib.import_module('rp2paths.'+info.name)
+                except Exception as e:
+                    sys.stderr.write('Cannot preload rp2paths.'+str(info.name)+': '+str(e)+'\n')
+
+
+def _run_child(job):
+    """Run rp2paths in the forked child, never returns
+    """
+    code = 1
+    try:
+        os.setsid()
+        os.close(_protocol.fileno())
+        log_fd = os.open(job['log_path'], os.O_WRONLY|os.O_CREAT|os.O_APPEND, 0o644)
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (job['max_virtual_memory'], resource.RLIM_INFINITY))
+        except ValueError as e:
+            sys.stderr.write('Cannot set the RAM usage limit: '+str(e)+'\n')
+            code = RLIMIT_EXIT
+            raise
+        sys.argv = ['rp2paths']+list(job['args'])
+        try:
+            runpy.run_module('rp2paths', run_name='__main__', alter_sys=True)
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                sys.stderr.write(str(e.code)+'\n')
+                code = 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        try:
+            #os._exit does not flush the files rp2paths left open, as the exit of the interpreter would
+            for obj in gc.get_objects():
+                if isinstance(obj, io.IOBase) and not obj.closed:
+                    try:
+                        obj.flush()
+                    except Exception:
+                        pass
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _reply(message):
+    _protocol.write(json.dumps(message)+'\n')
+    _protocol.flush()
+
+
+def serve():
+    """Run the worker loop on the standard input and output
+    """
+    global _protocol
+    #the modules may print, only the messages are written to the standard output
+    _protocol = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    if not os.getcwd() in sys.path:
+        sys.path.insert(0, os.getcwd())
+    _preload()
+    _reply({'ready': True})
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        pid = os.fork()
+        if pid==0:
+            _run_child(job)
+        _reply({'id': job['id'], 'pid': pid})
+        deadline = time.time()+job['timeout']
+        time_out = False
+        while True:
+            wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if wpid:
+                break
+            if not time_out and time.time()>deadline:
+                time_out = True
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            time.sleep(POLL_INTERVAL)
+        if os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+        _reply({'id': job['id'],
+                'returncode': returncode,
+                'time_out': time_out,
+                'rusage': [rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss]})
+
+
+######################### pool #########################
+
+
+class _Worker(object):
+    """A running worker and its pipes
+    """
+    def __init__(self, name, command, cwd):
+        self.name = name
+        self.jobs = 0
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=self.log,
+                                        cwd=cwd,
+                                        start_new_session=True)
+        self.buffer = b''
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def read_line(self, timeout):
+        """Read a message of the worker
+
+        :param timeout: The seconds to wait for the message
+
+        :type timeout: float
+
+        :rtype: dict
+        :return: The message or None if the worker has not written it in time or has exited
+        """
+        end = time.time()+timeout
+        while not b'\n' in self.buffer:
+            left = end-time.time()
+            if left<=0:
+                return None
+            ready, _, _ = select.select([self.process.stdout], [], [], min(left, POLL_INTERVAL))
+            if ready:
+                block = os.read(self.process.stdout.fileno(), 65536)
+                if not block:
+                    return None
+                self.buffer += block
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        try:
+            return json.loads(line.decode('utf-8'))
+        except ValueError:
+            logger.warning('Cannot read the message of the rp2paths worker '+str(self.name)+': '+str(line[:200]))
+            return None
+
+    def send(self, message):
+        self.process.stdin.write((json.dumps(message)+'\n').encode('utf-8'))
+        self.process.stdin.flush()
+
+    def log_tail(self):
+        self.log.seek(0, os.SEEK_END)
+        self.log.seek(max(self.log.tell()-LOG_TAIL, 0))
+        return self.log.read().decode('utf-8', 'replace')
+
+    def stop(self):
+        """Close the input of the worker and kill its process group
+        """
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+        self.log.close()
+
+
+class RP2pathsPool(object):
+    """Pool of warm rp2paths workers
+
+    The workers are started lazily, replaced when they die or after max_jobs jobs. Each job runs in a child
+    forked from a worker, with its own virtual memory limit and timeout, so that a job cannot affect the
+    worker or the other jobs. A slot whose worker failed to start is unavailable until its backoff has
+    passed, and the pool is disabled after max_start_failures consecutive failed starts
+
+    :param workers: The number of workers (Default: 1)
+    :param command: The worker command (Default: WORKER_COMMAND)
+    :param cwd: The folder of rp2paths, where the workers run (Default: /home/rp2paths/)
+    :param max_jobs: The number of jobs after which a worker is replaced (Default: 100)
+    :param start_timeout: The seconds to wait for a worker to import the modules (Default: 120)
+    :param start_backoff: The seconds before a slot tries to start a worker again after a failed start, doubled at each failure (Default: 60)
+    :param max_start_failures: The number of consecutive failed starts after which the pool is disabled, never if None (Default: 3)
+
+    :type workers: int
+    :type command: list
+    :type cwd: str
+    :type max_jobs: int
+    :type start_timeout: float
+    :type start_backoff: float
+    :type max_start_failures: int
+    """
+    def __init__(self,
+                 workers=1,
+                 command=WORKER_COMMAND,
+                 cwd=RP2PATHS_PATH,
+                 max_jobs=100,
+                 start_timeout=START_TIMEOUT,
+                 start_backoff=START_BACKOFF,
+                 max_start_failures=MAX_START_FAILURES):
+        self.command = command
+        self.cwd = cwd
+        self.max_jobs = max_jobs
+        self.start_timeout = start_timeout
+        self.start_backoff = start_backoff
+        self.max_start_failures = max_start_failures
+        self.start_failures = 0
+        #the name, the worker, the number of consecutive failed starts and the time of the next start of each slot
+        self.slots = queue.Queue()
+        for i in range(workers):
+            self.slots.put(['worker'+str(i), None, 0, 0.0])
+        self.lock = threading.Lock()
+        self.closed = False
+        self.disabled = False
+        self.job_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _start(self, name):
+        """Start a worker and wait for it to import the modules
+
+        :rtype: _Worker
+        :return: The worker or None if it could not be started
+        """
+        logger.debug('Starting the rp2paths worker '+str(name))
+        start = time.time()
+        try:
+            worker = _Worker(name, self.command, self.cwd)
+        except (OSError, ValueError) as e:
+            logger.warning('Cannot start the rp2paths worker: '+str(e))
+            return None
+        message = worker.read_line(self.start_timeout)
+        if not message or not message.get('ready'):
+            logger.warning('The rp2paths worker '+str(name)+' did not start: '+worker.log_tail()[-1000:])
+            worker.stop()
+            return None
+        logger.debug('The rp2paths worker '+str(name)+' started in '+str(round(time.time()-start, 1))+' seconds')
+        return worker
+
+    def _start_slot(self, slot):
+        """Start the worker of a slot, unless the slot is waiting for the backoff of a failed start
+
+        :param slot: The slot
+
+        :type slot: list
+
+        :rtype: _Worker
+        :return: The worker or None if it is not started
+        """
+        if time.time()<slot[3]:
+            return None
+        worker = self._start(slot[0])
+        with self.lock:
+            if worker:
+                slot[2] = 0
+                self.start_failures = 0
+                return worker
+            slot[2] += 1
+            slot[3] = time.time()+min(self.start_backoff*2**(slot[2]-1), START_MAX_BACKOFF)
+            self.start_failures += 1
+            if self.max_start_failures and self.start_failures>=self.max_start_failures and not self.disabled:
+                logger.warning('Disabling the rp2paths pool after '+str(self.start_failures)+' failed worker starts')
+                self.disabled = True
+        return None
+
+    def submit(self, args, timeout, max_virtual_memory, log_path, output_dir=None, patterns=[]):
+        """Run rp2paths on the first idle worker
+
+        :param args: The arguments of python3 -m rp2paths
+        :param timeout: The timeout of the job in seconds, after which its process group is killed
+        :param max_virtual_memory: The virtual memory limit of the job in bytes
+        :param log_path: Path to the file receiving the output of the job
+        :param output_dir: Path to the output folder, measured in the metrics (Default: None)
+        :param patterns: The strings looked for in the output of the job (Default: [])
+
+        :type args: list
+        :type timeout: float
+        :type max_virtual_memory: int
+        :type log_path: str
+        :type output_dir: str
+        :type patterns: list
+
+        :rtype: dict
+        :return: The returncode, the tail of the output (stdout), the patterns found (matched), if the job was killed on timeout (time_out) and the metrics, or None if no worker is available
+        """
+        if self.closed or self.disabled:
+            return None
+        slot = self.slots.get()
+        try:
+            if slot[1] and not slot[1].is_alive():
+                logger.warning('The rp2paths worker '+str(slot[0])+' has exited: '+slot[1].log_tail()[-1000:])
+                slot[1].stop()
+                slot[1] = None
+            if not slot[1]:
+                slot[1] = None if self.disabled else self._start_slot(slot)
+                if not slot[1]:
+                    return None
+            worker = slot[1]
+            with self.lock:
+                self.job_count += 1
+                job_id = self.job_count
+            try:
+                worker.send({'id': job_id, 'args': list(args), 'timeout': timeout, 'max_virtual_memory': max_virtual_memory, 'log_path': log_path})
+            except OSError as e:
+                logger.warning('Cannot send the job to the rp2paths worker '+str(worker.name)+': '+str(e))
+                worker.stop()
+                slot[1] = None
+                return None
+            started = worker.read_line(self.start_timeout)
+            if not started or not started.get('id')==job_id:
+                logger.warning('The rp2paths worker '+str(worker.name)+' did not start the job')
+                worker.stop()
+                slot[1] = None
+                return None
+            sampler = procSupervisor.TreeSampler(started['pid'], output_dir)
+            end = time.time()+timeout+REPLY_GRACE
+            result = None
+            while result is None:
+                sampler.sample()
+                result = worker.read_line(procSupervisor.SAMPLE_INTERVAL)
+                if result is None and (not worker.is_alive() or time.time()>end):
+                    logger.warning('The rp2paths worker '+str(worker.name)+' has not reported the job')
+                    metrics = sampler.metrics()
+                    worker.stop()
+                    slot[1] = None
+                    return {'returncode': None, 'stdout': '', 'matched': [], 'time_out': True, 'metrics': metrics}
+            rusage = types.SimpleNamespace(ru_utime=result['rusage'][0], ru_stime=result['rusage'][1], ru_maxrss=result['rusage'][2])
+            metrics = sampler.metrics(rusage)
+            worker.jobs += 1
+            if self.max_jobs and worker.jobs>=self.max_jobs:
+                logger.debug('Recycling the rp2paths worker '+str(worker.name)+' after '+str(worker.jobs)+' jobs')
+                worker.stop()
+                slot[1] = None
+            try:
+                with open(log_path, 'rb') as f:
+                    log = f.read().decode('utf-8', 'replace')
+            except OSError:
+                log = ''
+            return {'returncode': result['returncode'],
+                    'stdout': log[-LOG_TAIL:],
+                    'matched': [i for i in patterns if i in log],
+                    'time_out': result['time_out'],
+                    'metrics': metrics}
+        finally:
+            if self.closed and slot[1]:
+                slot[1].stop()
+                slot[1] = None
+            self.slots.put(slot)
+
+    def close(self):
+        """Stop all the workers
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        for i in range(self.slots.qsize()):
+            slot = self.slots.get()
+            if slot[1]:
+                slot[1].stop()
+                slot[1] = None
+            self.slots.put(slot)
+
+
+def main():
+    parser = argparse.ArgumentParser('Warm rp2paths worker, see the protocol of rp2pathsPool')
+    parser.add_argument('-worker', action='store_true')
+    params = parser.parse_args()
+    if params.worker:
+        serve()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Score the pathways of rp2paths with the scores of their RetroPath2.0 transformations and keep the best ones
+
+The steps of out_paths.csv are joined to the scores of the results of RetroPath2.0 on their transformation ID and
+aggregated by Path ID with pandas, so that no row is handled in Python. The best pathways are written with the
+columns and quoting of rp2paths, in the order of their rank and with their Path ID
+
+"""
+
+import os
+import csv
+import time
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import rp2pathsShards
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+PATH_ID_COLUMN = 'Path ID'
+STEP_COLUMN = 'Unique ID'
+LEFT_COLUMN = 'Left'
+RIGHT_COLUMN = 'Right'
+TRANSFORMATION_COLUMN = 'Transformation ID'
+SCORE_COLUMN = 'Score'
+#the order of each aggregate when it ranks the pathways, True if the lowest value is the best
+RANK_KEYS = {'score_min': False,
+             'score_sum': False,
+             'score_mean': False,
+             'length': True,
+             'sink_precursors': False}
+RANK_BY = 'score_min'
+#the aggregates that break the ties of the main one, in this order
+TIE_BREAKERS = ['length', 'score_sum']
+SCORES_COLUMNS = [PATH_ID_COLUMN, 'rank', 'score_min', 'score_sum', 'score_mean', 'length', 'sink_precursors']
+
+
+def transformation_scores(results_path):
+    """Read the score of each transformation of the results of RetroPath2.0
+
+    :param results_path: Path to the results of RetroPath2.0
+
+    :type results_path: str
+
+    :rtype: pandas.Series
+    :return: The score of each transformation ID, NaN if it is not a number
+    """
+    results = pd.read_csv(results_path, usecols=[TRANSFORMATION_COLUMN, SCORE_COLUMN], dtype=str)
+    #the header rows repeated in the results are not numbers and are dropped with the others
+    scores = pd.to_numeric(results[SCORE_COLUMN], errors='coerce')
+    return scores.groupby(results[TRANSFORMATION_COLUMN]).max()
+
+
+def score_pathways(out_paths, results_path):
+    """Compute the aggregates of each pathway of rp2paths
+
+    The sink precursors are the distinct compounds of a pathway named after the sink, rp2paths gives its own
+    IDs to all the others
+
+    :param out_paths: Path to the pathways of rp2paths
+    :param results_path: Path to the results of RetroPath2.0
+
+    :type out_paths: str
+    :type results_path: str
+
+    :rtype: tuple
+    :return: The steps of the pathways with their score, and the minimal, summed and mean score, the number of steps and of sink precursors of each Path ID
+    """
+    paths = pd.read_csv(out_paths, dtype=str, keep_default_na=False)
+    paths['score'] = paths[STEP_COLUMN].map(transformation_scores(results_path)).astype(float)
+    groups = paths.groupby(PATH_ID_COLUMN, sort=False)
+    scores = pd.DataFrame({'score_min': groups['score'].min(),
+                           'score_sum': groups['score'].sum(),
+                           'score_mean': groups['score'].mean(),
+                           'length': groups['score'].size(),
+                           'scored': groups['score'].count()})
+    #a pathway without any known score has no sum
+    scores.loc[scores['scored']==0, 'score_sum'] = np.nan
+    #the sides of the steps repeat across the pathways, only the distinct ones are split into their compounds
+    side_codes, sides = pd.factorize(pd.concat([paths[LEFT_COLUMN], paths[RIGHT_COLUMN]], ignore_index=True))
+    tokens = pd.Series(sides).str.split(':').explode()
+    tokens = pd.DataFrame({'side': tokens.index.values, 'compound': tokens.str.split('.', n=1).str[-1].values})
+    tokens = tokens[(tokens['compound'].str.len()>0) & ~tokens['compound'].str.match(rp2pathsShards.UID_PATTERN.pattern)]
+    path_sides = pd.DataFrame({PATH_ID_COLUMN: np.tile(paths[PATH_ID_COLUMN].values, 2), 'side': side_codes}).drop_duplicates()
+    sinks = path_sides.merge(tokens, on='side')
+    scores['sink_precursors'] = sinks.groupby(PATH_ID_COLUMN)['compound'].nunique().reindex(scores.index).fillna(0).astype(int)
+    return paths, scores.drop(columns=['scored'])
+
+
+def rank_pathways(out_paths, results_path, ranked_paths, top=None, rank_by=RANK_BY, out_scores=None):
+    """Write the best pathways of rp2paths in the order of their rank
+
+    The pathways are sorted on rank_by and then on the tie breakers, the pathways without score last, and keep
+    their order in out_paths.csv on equal aggregates
+
+    :param out_paths: Path to the pathways of rp2paths
+    :param results_path: Path to the results of RetroPath2.0
+    :param ranked_paths: Path to the best pathways, with the columns of out_paths.csv
+    :param top: The number of pathways kept, all if None (Default: None)
+    :param rank_by: The aggregate that ranks the pathways, one of RANK_KEYS (Default: score_min)
+    :param out_scores: Path to the aggregates of the pathways kept, not written if None (Default: None)
+
+    :type out_paths: str
+    :type results_path: str
+    :type ranked_paths: str
+    :type top: int
+    :type rank_by: str
+    :type out_scores: str
+
+    :rtype: dict
+    :return: The number of pathways scored and kept, and the time taken
+    """
+    start = time.time()
+    if not rank_by in RANK_KEYS:
+        raise ValueError('Cannot recognise the ranking aggregate: '+str(rank_by))
+    paths, scores = score_pathways(out_paths, results_path)
+    keys = [rank_by]+[i for i in TIE_BREAKERS if not i==rank_by]
+    #the stable sort keeps the order of rp2paths on ties
+    ranked = scores.sort_values(keys, ascending=[RANK_KEYS[i] for i in keys], kind='mergesort', na_position='last')
+    if top:
+        ranked = ranked.iloc[:top]
+    ranked = ranked.assign(rank=np.arange(1, len(ranked)+1))
+    rows = paths[paths[PATH_ID_COLUMN].isin(ranked.index)]
+    rows = rows.assign(rank=rows[PATH_ID_COLUMN].map(ranked['rank'])).sort_values('rank', kind='mergesort')
+    columns = [i for i in paths.columns if not i=='score']
+    with open(ranked_paths, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+        writer.writerow(columns)
+        writer.writerows(rows[columns].values.tolist())
+    if out_scores:
+        ranked.reset_index()[SCORES_COLUMNS].to_csv(out_scores, index=False)
+    metrics = {'pathways': len(scores), 'kept': len(ranked), 'wall_time': round(time.time()-start, 3)}
+    logger.debug('Kept '+str(metrics['kept'])+' of '+str(metrics['pathways'])+' pathways ranked by '+str(rank_by))
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser('Rank the pathways of rp2paths on the scores of their RetroPath2.0 transformations')
+    parser.add_argument('-out_paths', type=str, required=True)
+    parser.add_argument('-rp2_results', type=str, required=True)
+    parser.add_argument('-ranked_paths', type=str, required=True)
+    parser.add_argument('-top', type=int, default=None)
+    parser.add_argument('-rank_by', type=str, default=RANK_BY, choices=list(RANK_KEYS))
+    parser.add_argument('-out_scores', type=str, default=None)
+    params = parser.parse_args()
+    rank_pathways(params.out_paths, params.rp2_results, params.ranked_paths, params.top, params.rank_by, params.out_scores)
+
+if __name__ == "__main__":
+    main()
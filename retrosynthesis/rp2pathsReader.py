@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Stream the pathways of the rp2paths outputs one at a time, as compact objects, without loading the files in memory
+
+The rows of out_paths.csv hold one reaction step each and the steps of a pathway are written together, so a pathway
+is complete when the next Path ID is read. The compound, rule and transformation IDs are interned: the pathways of a
+file share a single string for each of them
+
+"""
+
+import os
+import sys
+import csv
+import logging
+import argparse
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+PATH_ID_COLUMN = 'Path ID'
+TRANSFORMATION_COLUMN = 'Unique ID'
+RULE_COLUMN = 'Rule ID'
+LEFT_COLUMN = 'Left'
+RIGHT_COLUMN = 'Right'
+#the compounds of a side are joined by colons, each as the stoichiometric coefficient and the compound ID
+COMPOUND_SEPARATOR = ':'
+COEFFICIENT_SEPARATOR = '.'
+RULE_SEPARATOR = ','
+
+
+class Step(object):
+    """A reaction step of a pathway
+
+    :param transformation_id: The transformation ID of RetroPath2.0
+    :param rule_ids: The IDs of the reaction rules of the transformation
+    :param substrates: The substrates, as tuples of the compound ID and the stoichiometric coefficient
+    :param products: The products, as tuples of the compound ID and the stoichiometric coefficient
+
+    :type transformation_id: str
+    :type rule_ids: tuple
+    :type substrates: tuple
+    :type products: tuple
+    """
+    __slots__ = ('transformation_id', 'rule_ids', 'substrates', 'products')
+
+    def __init__(self, transformation_id, rule_ids, substrates, products):
+        self.transformation_id = transformation_id
+        self.rule_ids = rule_ids
+        self.substrates = substrates
+        self.products = products
+
+    def compounds(self):
+        """Return the IDs of the substrates and products
+
+        :rtype: tuple
+        :return: The compound IDs
+        """
+        return tuple([i[0] for i in self.substrates+self.products])
+
+    def __repr__(self):
+        return 'Step('+str(self.transformation_id)+')'
+
+
+class Pathway(object):
+    """A pathway of rp2paths, with its steps in the order of the file
+
+    :param path_id: The Path ID
+    :param steps: The reaction steps
+
+    :type path_id: int
+    :type steps: tuple
+    """
+    __slots__ = ('path_id', 'steps')
+
+    def __init__(self, path_id, steps):
+        self.path_id = path_id
+        self.steps = steps
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def compounds(self):
+        """Return the IDs of the compounds of the pathway, in the order they are first met
+
+        :rtype: list
+        :return: The compound IDs
+        """
+        compounds = []
+        for step in self.steps:
+            compounds += [i for i in step.compounds() if not i in compounds]
+        return compounds
+
+    def has_compound(self, compound_id):
+        """Check if a compound is a substrate or a product of one of the steps
+
+        :param compound_id: The compound ID
+
+        :type compound_id: str
+
+        :rtype: bool
+        :return: If the pathway holds the compound
+        """
+        return any([compound_id in step.compounds() for step in self.steps])
+
+    def rule_ids(self):
+        """Return the IDs of the reaction rules of the pathway, in the order they are first met
+
+        :rtype: list
+        :return: The rule IDs
+        """
+        rule_ids = []
+        for step in self.steps:
+            rule_ids += [i for i in step.rule_ids if not i in rule_ids]
+        return rule_ids
+
+    def __repr__(self):
+        return 'Pathway('+str(self.path_id)+', '+str(len(self.steps))+' steps)'
+
+
+def _coefficient(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def parse_side(side):
+    """Parse a side of a reaction step, such as 1.CMPD_0000000001:1.MNXM2
+
+    :param side: The Left or Right cell
+
+    :type side: str
+
+    :rtype: tuple
+    :return: Tuples of the interned compound ID and the stoichiometric coefficient
+    """
+    compounds = []
+    for token in side.split(COMPOUND_SEPARATOR):
+        if not token:
+            continue
+        coefficient, compound_id = token.split(COEFFICIENT_SEPARATOR, 1)
+        compounds.append((sys.intern(compound_id), _coefficient(coefficient)))
+    return tuple(compounds)
+
+
+def read_pathways(out_paths):
+    """Read the pathways of an out_paths.csv file one at a time
+
+    :param out_paths: Path to the pathways of rp2paths
+
+    :type out_paths: str
+
+    :rtype: generator
+    :return: The pathways, in the order of the file
+    """
+    with open(out_paths, newline='') as f:
+        reader = csv.reader(f, delimiter=',', quotechar='"')
+        header = next(reader, None)
+        if not header:
+            return
+        path_index = header.index(PATH_ID_COLUMN)
+        transformation_index = header.index(TRANSFORMATION_COLUMN)
+        rule_index = header.index(RULE_COLUMN)
+        left_index = header.index(LEFT_COLUMN)
+        right_index = header.index(RIGHT_COLUMN)
+        path_id = None
+        steps = []
+        for row in reader:
+            if not row:
+                continue
+            if not row[path_index]==path_id:
+                if steps:
+                    yield Pathway(int(path_id), tuple(steps))
+                path_id = row[path_index]
+                steps = []
+            steps.append(Step(sys.intern(row[transformation_index]),
+                              tuple([sys.intern(i) for i in row[rule_index].split(RULE_SEPARATOR) if i]),
+                              parse_side(row[left_index]),
+                              parse_side(row[right_index])))
+        if steps:
+            yield Pathway(int(path_id), tuple(steps))
+
+
+def filter_pathways(out_paths, max_steps=None, compounds=None, rule_ids=None, predicate=None):
+    """Read the pathways of an out_paths.csv file that pass all the given filters
+
+    :param out_paths: Path to the pathways of rp2paths
+    :param max_steps: The maximal number of steps, not filtered if None (Default: None)
+    :param compounds: The compound IDs that must all be in the pathway, not filtered if None (Default: None)
+    :param rule_ids: The rule IDs of which at least one must be in the pathway, not filtered if None (Default: None)
+    :param predicate: Function of a pathway returning if it is kept, not filtered if None (Default: None)
+
+    :type out_paths: str
+    :type max_steps: int
+    :type compounds: list
+    :type rule_ids: list
+    :type predicate: function
+
+    :rtype: generator
+    :return: The pathways that pass the filters, in the order of the file
+    """
+    for pathway in read_pathways(out_paths):
+        if max_steps and len(pathway)>max_steps:
+            continue
+        if compounds and not all([pathway.has_compound(i) for i in compounds]):
+            continue
+        if rule_ids and not any([i in pathway.rule_ids() for i in rule_ids]):
+            continue
+        if predicate and not predicate(pathway):
+            continue
+        yield pathway
+
+
+def read_compounds(compounds_path, compound_ids=None):
+    """Read the compounds file of rp2paths one compound at a time
+
+    :param compounds_path: Path to the compounds of rp2paths
+    :param compound_ids: The compound IDs to read, all if None (Default: None)
+
+    :type compounds_path: str
+    :type compound_ids: set
+
+    :rtype: generator
+    :return: Tuples of the interned compound ID and the structure
+    """
+    with open(compounds_path, newline='') as f:
+        reader = csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+        next(reader, None)
+        for row in reader:
+            if len(row)<2:
+                continue
+            if compound_ids is None or row[0] in compound_ids:
+                yield sys.intern(row[0]), row[1]
+
+
+def main():
+    parser = argparse.ArgumentParser('List the pathways of rp2paths that pass the filters')
+    parser.add_argument('-out_paths', type=str, required=True)
+    parser.add_argument('-max_steps', type=int, default=None)
+    parser.add_argument('-compounds', type=str, default=None, help='Comma separated compound IDs that must all be in the pathway')
+    parser.add_argument('-rule_ids', type=str, default=None, help='Comma separated rule IDs of which one must be in the pathway')
+    params = parser.parse_args()
+    for pathway in filter_pathways(params.out_paths,
+                                   max_steps=params.max_steps,
+                                   compounds=params.compounds.split(',') if params.compounds else None,
+                                   rule_ids=params.rule_ids.split(',') if params.rule_ids else None):
+        print(str(pathway.path_id)+'\t'+str(len(pathway))+'\t'+','.join([i.transformation_id for i in pathway]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Enumerate the pathways of a RetroPath2.0 scope with rp2paths in parallel, by splitting the scope into its independent parts and merging their outputs as a single run of rp2paths would write them
+
+The transformations are linked by the compounds they share, except the target and the sink compounds that rp2paths
+treats as external: a pathway never spans two connected components of this graph, so each component can be enumerated
+on its own. The compounds are numbered as rp2paths numbers them on the whole scope, and the pathways are written in
+the canonical order of runRP2paths.write_pathways, so that the merged output is the one of a single run
+
+Which pathways rp2paths keeps under its cap depends on the order in which it enumerates them on the whole scope, so a
+scope is only split when it cannot have more pathways than the cap, which is decided before running rp2paths
+
+"""
+
+import os
+import re
+import csv
+import time
+import logging
+import argparse
+import tempfile
+import concurrent.futures
+
+import rp2Results
+import runRP2paths
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+#value of the first column of the header rows repeated in the results
+HEADER_SOURCE = 'Initial source'
+#iteration of the transformations of the target
+TARGET_ITERATION = '0'
+#the internal compound IDs of rp2paths, used when a compound is not a sink compound, and the IDs of the target
+UID_PREFIX = 'CMPD'
+TARGET_PREFIX = 'TARGET'
+UID_LENGTH = 10
+UID_PATTERN = re.compile(r'(?<![\w])(?:'+UID_PREFIX+'|'+TARGET_PREFIX+r')_\d{'+str(UID_LENGTH)+r'}(?![\w])')
+#the default maximal number of pathways of rp2paths
+RP2PATHS_MAX_PATHS = 150
+#the minimal RAM limit in GB of a part of the scope, the parts running at the same time share the RAM limit of the run
+SHARD_MIN_RAM_LIMIT = 2
+#the minimal number of transformations of a scope to split it, a smaller one is enumerated quickly by a single run
+SHARD_MIN_TRANSFORMATIONS = 100
+
+
+def _rows(results_path):
+    """Read the rows of a results file with their line, skipping the repeated header rows
+
+    :rtype: generator
+    :return: The header, and then each row as a dictionnary with the line it has been read from
+    """
+    header = None
+    with open(results_path, 'rb') as f:
+        for line in f:
+            row = next(csv.reader([line.decode('utf-8', 'replace')], delimiter=',', quotechar='"'), None)
+            if not row:
+                continue
+            if header is None:
+                header = row
+                yield header, line
+                continue
+            if row[0]==HEADER_SOURCE:
+                continue
+            yield dict(zip(header, row)), line
+
+
+def _find(parents, node):
+    while not parents[node]==node:
+        parents[node] = parents[parents[node]]
+        node = parents[node]
+    return node
+
+
+def _add_cid(cids, cid):
+    """Add a sink name to the IDs of a compound as rp2paths does
+    """
+    if not cid in cids:
+        for i in [',', ':', ' ', '[', ']']:
+            cid = cid.replace(i, '_')
+        cids.append(cid)
+
+
+def _sort_cids(cids):
+    """Sort the IDs of a compound as rp2paths does, numerically if they are all MetaNetX IDs
+    """
+    if all([i.startswith('MNXM') and i[4:].isdigit() for i in cids]):
+        return sorted(cids, key=lambda i: int(i[4:]))
+    return sorted(cids)
+
+
+def _count_pathways(smiles, producers, reactions, sinks, cap, counts, visiting):
+    """Count the derivation trees of a compound down to the sink compounds, at most cap+1
+
+    :rtype: int
+    :return: The number of trees, or None if the compound is on a cycle of transformations
+    """
+    if smiles in sinks:
+        return 1
+    if smiles in counts:
+        return counts[smiles]
+    if smiles in visiting:
+        return None
+    visiting.add(smiles)
+    count = 0
+    for tid in producers.get(smiles, []):
+        trees = 1
+        for precursor in reactions[tid][1]:
+            precursor_trees = _count_pathways(precursor, producers, reactions, sinks, cap, counts, visiting)
+            if precursor_trees is None:
+                visiting.discard(smiles)
+                return None
+            trees = min(trees*precursor_trees, cap+1)
+        count = min(count+trees, cap+1)
+    visiting.discard(smiles)
+    counts[smiles] = count
+    return count
+
+
+def max_pathways(reactions, sinks, targets, cap=RP2PATHS_MAX_PATHS):
+    """Bound the number of pathways rp2paths can find in a scope
+
+    A pathway picks one transformation for each compound it needs, from the targets down to the sink compounds,
+    so a scope without cycle has at most as many pathways as derivation trees of its targets
+
+    :param reactions: The substrates and products of each transformation ID
+    :param sinks: The SMILES of the sink compounds
+    :param targets: The SMILES of the targets
+    :param cap: The bound above which the pathways are not counted (Default: 150)
+
+    :type reactions: dict
+    :type sinks: dict
+    :type targets: list
+    :type cap: int
+
+    :rtype: int
+    :return: The bound, at most cap+1, or None if the scope has a cycle
+    """
+    producers = {}
+    for tid in sorted(reactions):
+        for smiles in reactions[tid][0]:
+            producers.setdefault(smiles, []).append(tid)
+    counts = {}
+    count = 0
+    for smiles in targets:
+        trees = _count_pathways(smiles, producers, reactions, sinks, cap, counts, set())
+        if trees is None:
+            return None
+        count = min(count+trees, cap+1)
+    return count
+
+
+def read_scope(results_path):
+    """Read the transformations and compounds of a scope and group the transformations by connected components
+
+    The compounds are identified as rp2paths identifies them on the whole scope: by their sink names, TARGET IDs
+    for the substrates of the first iteration and else CMPD IDs in the order of the sorted transformation IDs
+    and of their sorted SMILES
+
+    :param results_path: Path to the results of RetroPath2.0
+
+    :type results_path: str
+
+    :rtype: dict
+    :return: The component of each transformation ID (components), the number of rows of each component (rows), the CMPD ID of each SMILES (uids), the IDs of each SMILES (compounds) and the bound on the number of pathways (max_paths), see max_pathways
+    """
+    reactions = {}
+    sinks = {}
+    targets = []
+    rows = {}
+    first = True
+    for row, line in _rows(results_path):
+        if first:
+            first = False
+            continue
+        tid = row['Transformation ID']
+        rows[tid] = rows.get(tid, 0)+1
+        if not tid in reactions:
+            left, right = row['Reaction SMILES'].split('>>')
+            reactions[tid] = (sorted(left.split('.')), sorted(right.split('.')))
+            if row['Iteration']==TARGET_ITERATION:
+                targets += [i for i in reactions[tid][0] if not i in targets]
+        if row['In Sink']=='1':
+            cids = sinks.setdefault(row['Product SMILES'], [])
+            for cid in row['Sink name'].lstrip('[').rstrip(']').split(', '):
+                _add_cid(cids, cid)
+    uids = {}
+    for tid in sorted(reactions):
+        for smiles in sorted(set(reactions[tid][0]+reactions[tid][1])):
+            if not smiles in uids:
+                uids[smiles] = UID_PREFIX+'_'+str(len(uids)+1).zfill(UID_LENGTH)
+    compounds = {}
+    for smiles in uids:
+        if smiles in sinks and sinks[smiles]:
+            compounds[smiles] = _sort_cids(sinks[smiles])
+        elif smiles in targets:
+            compounds[smiles] = [TARGET_PREFIX+'_'+str(targets.index(smiles)+1).zfill(UID_LENGTH)]
+        else:
+            compounds[smiles] = [uids[smiles]]
+    #the target and the sink compounds are external to the pathways and do not link them
+    parents = {}
+    for tid in reactions:
+        parents.setdefault(('t', tid), ('t', tid))
+        for smiles in reactions[tid][0]+reactions[tid][1]:
+            if smiles in targets or smiles in sinks:
+                continue
+            parents.setdefault(('c', smiles), ('c', smiles))
+            parents[_find(parents, ('c', smiles))] = _find(parents, ('t', tid))
+    index = {}
+    components = {}
+    component_rows = []
+    for tid in reactions:
+        root = _find(parents, ('t', tid))
+        if not root in index:
+            index[root] = len(index)
+            component_rows.append(0)
+        components[tid] = index[root]
+        component_rows[index[root]] += rows[tid]
+    return {'components': components,
+            'rows': component_rows,
+            'uids': uids,
+            'compounds': compounds,
+            'max_paths': max_pathways(reactions, sinks, targets, RP2PATHS_MAX_PATHS)}
+
+
+def split_scope(results_path, output_dir, shards, scope=None):
+    """Write the rows of a scope to shards holding whole components
+
+    The components are dealt from the largest to the least loaded shard, and the rows keep their order
+
+    :param results_path: Path to the results of RetroPath2.0
+    :param output_dir: Path to the folder of the shards
+    :param shards: The maximal number of shards
+    :param scope: The scope read from the results, read again if None (Default: None)
+
+    :type results_path: str
+    :type output_dir: str
+    :type shards: int
+    :type scope: dict
+
+    :rtype: tuple
+    :return: The paths to the shards, in the order of their first row, and the scope, see read_scope
+    """
+    if scope is None:
+        scope = read_scope(results_path)
+    components = scope['components']
+    component_rows = scope['rows']
+    loads = [0]*min(shards, len(component_rows))
+    component_shard = {}
+    for component in sorted(range(len(component_rows)), key=lambda i: -component_rows[i]):
+        shard = loads.index(min(loads))
+        component_shard[component] = shard
+        loads[shard] += component_rows[component]
+    paths = [os.path.join(output_dir, 'shard_'+str(i), 'results.csv') for i in range(len(loads))]
+    files = []
+    order = []
+    try:
+        for path in paths:
+            os.makedirs(os.path.dirname(path))
+            files.append(open(path, 'wb'))
+        header = None
+        for row, line in _rows(results_path):
+            if header is None:
+                header = line
+                for f in files:
+                    f.write(header)
+                continue
+            shard = component_shard[components[row['Transformation ID']]]
+            if not shard in order:
+                order.append(shard)
+            files[shard].write(line)
+    finally:
+        for f in files:
+            f.close()
+    return [paths[i] for i in order], scope
+
+
+def _read_compounds(compounds_path):
+    """Read the compound ID and structure of each row of a compounds file of rp2paths
+
+    :rtype: list
+    :return: List of tuples with the compound ID and the structure
+    """
+    with open(compounds_path, 'r', newline='') as f:
+        reader = csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+        next(reader, None)
+        return [(i[0], i[1]) for i in reader if len(i)>1]
+
+
+def merge_outputs(shard_outputs, scope, out_paths, out_compounds, max_paths=RP2PATHS_MAX_PATHS):
+    """Merge the outputs of rp2paths on the shards of a scope
+
+    The compounds file is written from the whole scope, as rp2paths writes it, and the internal IDs of the
+    pathways are replaced by the ones of the whole scope. The pathways of all the shards are written in the
+    canonical order of runRP2paths.write_pathways, as the ones of a single run
+
+    :param shard_outputs: The paths to the pathways and compounds files of each shard with pathways
+    :param scope: The compounds of the whole scope, see read_scope
+    :param out_paths: Path to the merged pathways
+    :param out_compounds: Path to the merged compounds
+    :param max_paths: The maximal number of pathways, as rp2paths stops at its --maxpaths (Default: 150)
+
+    :type shard_outputs: list
+    :type scope: dict
+    :type out_paths: str
+    :type out_compounds: str
+    :type max_paths: int
+
+    :rtype: int
+    :return: The number of pathways
+    """
+    compounds = scope['compounds']
+    header = None
+    pathways = []
+    for shard_paths, shard_compounds in shard_outputs:
+        mapping = {}
+        for cid, smiles in _read_compounds(shard_compounds):
+            if UID_PATTERN.fullmatch(cid) and smiles in compounds:
+                mapping[cid] = compounds[smiles][0]
+        shard_header, shard_pathways = runRP2paths.read_pathway_rows(shard_paths)
+        if not shard_header:
+            continue
+        if header is None:
+            header = shard_header
+        for rows in shard_pathways:
+            pathways.append([[UID_PATTERN.sub(lambda m: mapping.get(m.group(0), m.group(0)), i) for i in row] for row in rows])
+    path_count = 0
+    if header is None:
+        with open(out_paths, 'w'):
+            pass
+    else:
+        path_count = runRP2paths.write_pathways(out_paths, header, pathways, max_paths)
+    with open(out_compounds, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+        writer.writerow(['Compound ID', 'Structure'])
+        for smiles in sorted(compounds, key=lambda i: compounds[i]):
+            for cid in compounds[smiles]:
+                writer.writerow([cid, smiles])
+    return path_count
+
+
+def _merge_metrics(shard_metrics, start):
+    """Add up the metrics of the shards, that ran at the same time
+    """
+    metrics = {'wall_time': round(time.time()-start, 3), 'shards': len(shard_metrics)}
+    for name in ['user_time', 'sys_time', 'peak_rss', 'peak_threads', 'output_size']:
+        values = [i[name] for i in shard_metrics if i and i.get(name) is not None]
+        metrics[name] = round(sum(values), 3) if values else None
+    return metrics
+
+
+def run_rp2paths_sharded(rp2_pathways, out_paths='', out_compounds='', timeout=None, ram_limit=None, pool=None, workers=None):
+    """Run rp2paths on the independent parts of a scope in parallel
+
+    rp2paths runs once on the whole scope if it has less than SHARD_MIN_TRANSFORMATIONS transformations, a single
+    part, or may have more pathways than rp2paths keeps, see max_pathways. Otherwise the output is the one of a
+    single run. The parts are given what is left of the timeout when they start, and share the RAM limit: at most
+    ram_limit/SHARD_MIN_RAM_LIMIT parts run at the same time, each with its share of the limit. A part without
+    pathway does not stop the others, and the first other error is returned
+
+    :param rp2_pathways: Path to the results of RetroPath2.0
+    :param out_paths: Path to the output pathways (Default: out_paths.csv in the working directory)
+    :param out_compounds: Path to the output compounds (Default: compounds.txt in the working directory)
+    :param timeout: The timeout of the run in minutes, 30 minutes if None (Default: None)
+    :param ram_limit: The RAM limit of the run in GB, shared by the parts running at the same time (Default: None)
+    :param pool: Pool of warm workers running rp2paths in-process (Default: None)
+    :param workers: The number of parts running at the same time, the number of CPUs if None (Default: None)
+
+    :type rp2_pathways: str
+    :type out_paths: str
+    :type out_compounds: str
+    :type timeout: float
+    :type ram_limit: int
+    :type pool: rp2pathsPool.RP2pathsPool
+    :type workers: int
+
+    :rtype: tuple
+    :return: tuple with the status, the message as bytes and the metrics of the run, as run_rp2paths
+    """
+    start = time.time()
+    if timeout is None:
+        timeout = runRP2paths.DEFAULT_TIMEOUT
+    deadline = start+timeout*60.0
+    if not workers:
+        workers = os.cpu_count() or 1
+    total_ram_limit = ram_limit or runRP2paths.MAX_VIRTUAL_MEMORY/(1000*1024*1024)
+    workers = min(workers, max(int(total_ram_limit//SHARD_MIN_RAM_LIMIT), 1))
+    if not out_paths:
+        out_paths = os.path.join(os.getcwd(), 'out_paths.csv')
+    if not out_compounds:
+        out_compounds = os.path.join(os.getcwd(), 'compounds.txt')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shards = None
+        if workers>1:
+            try:
+                if rp2Results.results_index(rp2_pathways)['transformations']<SHARD_MIN_TRANSFORMATIONS:
+                    logger.debug('The scope is small, running rp2paths once')
+                else:
+                    scope = read_scope(rp2_pathways)
+                    if scope['max_paths'] is None or scope['max_paths']>RP2PATHS_MAX_PATHS:
+                        #the pathways kept under the cap depend on the order of rp2paths on the whole scope
+                        logger.info('The scope may have more than '+str(RP2PATHS_MAX_PATHS)+' pathways, running rp2paths once')
+                    else:
+                        shards = split_scope(rp2_pathways, tmp_dir, workers, scope)[0]
+            except (OSError, KeyError, ValueError, csv.Error) as e:
+                logger.warning('Cannot split the scope, running rp2paths once: '+str(e))
+        if not shards or len(shards)==1:
+            return runRP2paths.run_rp2paths(rp2_pathways, out_paths, out_compounds, timeout, ram_limit, pool)
+        shard_ram_limit = total_ram_limit/len(shards)
+        logger.info('Running rp2paths on '+str(len(shards))+' parts of the scope with '+str(round(shard_ram_limit, 2))+' GB each')
+        outputs = [(os.path.join(os.path.dirname(i), 'out_paths.csv'), os.path.join(os.path.dirname(i), 'compounds.txt')) for i in shards]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            #the parts run at the same time, until the end of the timeout of the run
+            results = list(executor.map(lambda i: runRP2paths.run_rp2paths(shards[i], outputs[i][0], outputs[i][1], (deadline-time.time())/60.0, shard_ram_limit, pool), range(len(shards))))
+        metrics = _merge_metrics([i[2] for i in results], start)
+        shard_outputs = []
+        for result, output in zip(results, outputs):
+            if result[0]=='noerror':
+                shard_outputs.append(output)
+            elif not result[0]=='filenotfounderror':
+                return result[0], result[1], metrics
+        if not shard_outputs:
+            return 'filenotfounderror', b'No part of the scope has pathways', metrics
+        if len(shard_outputs)<len(shards):
+            logger.warning(str(len(shards)-len(shard_outputs))+' parts of the scope have no pathway')
+        try:
+            path_count = merge_outputs(shard_outputs, scope, out_paths, out_compounds)
+        except (OSError, ValueError, csv.Error) as e:
+            logger.error('Cannot merge the outputs of rp2paths: '+str(e))
+            return 'oserror', str.encode('Error: '+str(e)), metrics
+        logger.debug('Merged '+str(path_count)+' pathways of '+str(len(shard_outputs))+' parts of the scope')
+        return 'noerror', '', metrics
+
+
+def main():
+    parser = argparse.ArgumentParser('Run RP2paths on the independent parts of the scope in parallel')
+    parser.add_argument('-rp2_pathways', type=str, required=True)
+    parser.add_argument('-out_paths', type=str, default='')
+    parser.add_argument('-out_compounds', type=str, default='')
+    parser.add_argument('-timeout', type=int, default=60)
+    parser.add_argument('-ram_limit', type=int, default=10)
+    parser.add_argument('-workers', type=int, default=None)
+    params = parser.parse_args()
+    run_rp2paths_sharded(rp2_pathways=params.rp2_pathways,
+                         out_paths=params.out_paths,
+                         out_compounds=params.out_compounds,
+                         timeout=params.timeout,
+                         ram_limit=params.ram_limit,
+                         workers=params.workers)
+
+if __name__ == "__main__":
+    main()
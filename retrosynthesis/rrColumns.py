@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Columnar representation of the RetroRules table. The numerical columns are stored as typed NumPy arrays and the rows and SMARTS in offset-indexed blobs, all memory mapped, so that the rules are filtered with vectorized masks
+
+"""
+
+import io
+import os
+import csv
+import json
+import logging
+
+import numpy as np
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+COLUMNS_META = 'meta.json'
+COLUMNS_VERSION = 1
+USAGE_CODES = {'both': 0, 'retro': 1, 'forward': 2}
+#number of columns of the RetroRules CSV rows
+ROW_LENGTH = 11
+ARRAYS = ['diameter', 'usage', 'direction', 'relative_direction', 'score', 'score_normalized', 'ec', 'rows', 'row_offsets', 'smarts', 'smarts_offsets']
+
+
+def csvLine(row):
+    """Return the row as written by the rule writers of runRR
+
+    :param row: The row to write
+
+    :type row: list
+
+    :rtype: bytes
+    :return: The CSV line encoded in utf-8
+    """
+    line = io.StringIO()
+    csv.writer(line, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL).writerow(row)
+    return line.getvalue().encode('utf-8')
+
+
+def _toInt(value, default=0):
+    """Convert a value to int, returning the default if it cannot be converted
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def _toFloat(value):
+    """Convert a value to float, returning NaN if it cannot be converted
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def _blob(values):
+    """Return the concatenation of the values and their offsets
+
+    :param values: The values to concatenate
+
+    :type values: list
+
+    :rtype: tuple
+    :return: The blob as an uint8 array and the int64 offsets of the values (one more than the number of values)
+    """
+    offsets = np.zeros(len(values)+1, dtype=np.int64)
+    np.cumsum([len(i) for i in values], out=offsets[1:])
+    return np.frombuffer(b''.join(values), dtype=np.uint8), offsets
+
+
+def fromRows(header, rows, skip_bad_rows=False):
+    """Build the columns from the rows of a RetroRules CSV file
+
+    As the scan of the CSV rule files and the store build, a row with an invalid diameter or missing columns
+    raises a ValueError, unless skip_bad_rows is set as for the conversion of the TSV files
+
+    :param header: The header of the rules
+    :param rows: The rows of the rules, in the RetroRules CSV column order
+    :param skip_bad_rows: Count and skip the rows with an invalid diameter or missing columns (Default: False)
+
+    :type header: list
+    :type rows: iterable
+    :type skip_bad_rows: bool
+
+    :rtype: dict
+    :return: Dictionnary of the column name to its array
+    """
+    diameter = []
+    usage = []
+    direction = []
+    relative_direction = []
+    score = []
+    score_normalized = []
+    ec = []
+    lines = []
+    smarts = []
+    bad_rows = 0
+    for row in rows:
+        try:
+            row_diameter = int(row[4]) if len(row)>=ROW_LENGTH else None
+        except ValueError:
+            row_diameter = None
+        if row_diameter is None:
+            if not skip_bad_rows:
+                raise ValueError('Invalid diameter or missing columns in the row '+str(row))
+            bad_rows += 1
+            continue
+        diameter.append(row_diameter)
+        usage.append(USAGE_CODES.get(row[9], -1))
+        direction.append(_toInt(row[7]))
+        relative_direction.append(_toInt(row[8]))
+        score.append(_toFloat(row[5]))
+        score_normalized.append(_toFloat(row[10]))
+        #leading separator to match the EC number prefixes of any of the EC numbers of the rule
+        ec.append((';'+row[2].replace(',', ';').replace(' ', '')+';').encode('utf-8'))
+        lines.append(csvLine(row))
+        smarts.append(row[1].encode('utf-8'))
+    if bad_rows:
+        logger.warning('Skipped '+str(bad_rows)+' rows with an invalid diameter or missing columns')
+    columns = {'header': csvLine(header),
+               'diameter': np.array(diameter, dtype=np.int16),
+               'usage': np.array(usage, dtype=np.int8),
+               'direction': np.array(direction, dtype=np.int8),
+               'relative_direction': np.array(relative_direction, dtype=np.int8),
+               'score': np.array(score, dtype=np.float64),
+               'score_normalized': np.array(score_normalized, dtype=np.float64),
+               'ec': np.array(ec, dtype=np.bytes_)}
+    columns['rows'], columns['row_offsets'] = _blob(lines)
+    columns['smarts'], columns['smarts_offsets'] = _blob(smarts)
+    return columns
+
+
+def save(columns, columns_path):
+    """Write the columns as NumPy files that can be memory mapped
+
+    :param columns: The columns
+    :param columns_path: Path to the columns folder
+
+    :type columns: dict
+    :type columns_path: str
+
+    :rtype: None
+    :return: None
+    """
+    os.makedirs(columns_path, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(columns_path, name+'.npy'), columns[name])
+    with open(os.path.join(columns_path, COLUMNS_META), 'w') as f:
+        json.dump({'version': COLUMNS_VERSION, 'header': columns['header'].decode('utf-8'), 'count': len(columns['diameter'])}, f)
+
+
+def load(columns_path):
+    """Memory map the columns
+
+    :param columns_path: Path to the columns folder
+
+    :type columns_path: str
+
+    :rtype: dict
+    :return: Dictionnary of the column name to its array or None if there are no valid columns
+    """
+    try:
+        with open(os.path.join(columns_path, COLUMNS_META), 'r') as f:
+            meta = json.load(f)
+        if not meta.get('version')==COLUMNS_VERSION:
+            logger.warning('Ignoring the rule columns with version '+str(meta.get('version')))
+            return None
+        columns = {'header': meta['header'].encode('utf-8')}
+        for name in ARRAYS:
+            columns[name] = np.load(os.path.join(columns_path, name+'.npy'), mmap_mode='r')
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning('Cannot load the rule columns: '+str(e))
+        return None
+    return columns
+
+
+def smarts(columns, i):
+    """Return the SMARTS of a rule
+
+    :param columns: The columns
+    :param i: The index of the rule
+
+    :type columns: dict
+    :type i: int
+
+    :rtype: str
+    :return: The rule SMARTS
+    """
+    return columns['smarts'][columns['smarts_offsets'][i]:columns['smarts_offsets'][i+1]].tobytes().decode('utf-8')
+
+
+def select(columns, diameters=None, usages=None, min_score=None, ec_prefixes=None, topn=None, mask=None):
+    """Return the indices of the rules passing the filters
+
+    :param columns: The columns
+    :param diameters: The diameters to return, all if None (Default: None)
+    :param usages: The rule usages to return, all if None (Default: None)
+    :param min_score: The minimal normalized score of the rules (Default: None)
+    :param ec_prefixes: The EC number prefixes of the rules, for example 1.1 or 2.7.1 (Default: None)
+    :param topn: The number of rules with the best normalized score to keep per diameter (Default: None)
+    :param mask: Additional boolean mask of the rules, applied before topn (Default: None)
+
+    :type columns: dict
+    :type diameters: list
+    :type usages: list
+    :type min_score: float
+    :type ec_prefixes: list
+    :type topn: int
+    :type mask: numpy.ndarray
+
+    :rtype: numpy.ndarray
+    :return: The sorted indices of the rules
+    """
+    if mask is None:
+        mask = np.ones(len(columns['diameter']), dtype=bool)
+    else:
+        mask = np.array(mask, dtype=bool)
+    if diameters is not None:
+        mask &= np.isin(columns['diameter'], diameters)
+    if usages is not None:
+        mask &= np.isin(columns['usage'], [USAGE_CODES[i] for i in usages if i in USAGE_CODES])
+    if min_score is not None:
+        mask &= columns['score_normalized']>=min_score
+    if ec_prefixes:
+        ec_mask = np.zeros(len(mask), dtype=bool)
+        for prefix in ec_prefixes:
+            prefix = prefix.strip()
+            #match whole EC levels: 1.1 must not match 1.14.1.1
+            if prefix.count('.')==3:
+                prefix += ';'
+            elif not prefix.endswith('.'):
+                prefix += '.'
+            ec_mask |= np.char.find(columns['ec'], (';'+prefix).encode('utf-8'))>=0
+        mask &= ec_mask
+    indices = np.flatnonzero(mask)
+    if topn is not None:
+        diameter = columns['diameter'][indices]
+        score = np.nan_to_num(columns['score_normalized'][indices], nan=-np.inf)
+        #sort by diameter, then decreasing score, then input order
+        order = np.lexsort((indices, -score, diameter))
+        sorted_diameter = diameter[order]
+        group_start = np.searchsorted(sorted_diameter, sorted_diameter, side='left')
+        rank = np.arange(len(order))-group_start
+        indices = np.sort(indices[order[rank<topn]])
+    return indices
+
+
+def writeRows(out_f, columns, indices, header=True):
+    """Write the header and the selected rows in the order of the source file
+
+    :param out_f: Binary file object to write to
+    :param columns: The columns
+    :param indices: The sorted indices of the rules to write
+    :param header: Write the header before the rows (Default: True)
+
+    :type out_f: file
+    :type columns: dict
+    :type indices: numpy.ndarray
+    :type header: bool
+
+    :rtype: bool
+    :return: Success or failure of the function
+    """
+    if header:
+        out_f.write(columns['header'])
+    if not len(indices):
+        return True
+    rows = columns['rows']
+    offsets = columns['row_offsets']
+    #coalesce the consecutive rows into single slices of the blob
+    breaks = np.flatnonzero(np.diff(indices)!=1)+1
+    starts = indices[np.concatenate(([0], breaks))]
+    ends = indices[np.concatenate((breaks-1, [len(indices)-1]))]+1
+    for start, end in zip(starts, ends):
+        out_f.write(rows[offsets[start]:offsets[end]].tobytes())
+    return True
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Canonicalize the reaction rules SMARTS with RDKit and merge the exact duplicates before passing them to RetroPath2.0
+
+"""
+
+import csv
+import os
+import logging
+
+from rdkit import Chem
+from rdkit.Chem import AllChem
+
+import rrScreen
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+MAPPING_HEADER = ['Rule ID', 'Duplicate rule ID', 'Duplicate legacy ID', 'Duplicate diameter', 'Duplicate score normalized']
+
+
+def _canonicalTemplate(mol):
+    """Return the template with its atoms in canonical order
+
+    The atoms are ranked on their query (the SMARTS of the atom without the atom map) and the bonds, ignoring the atom maps
+
+    :param mol: The query molecule of the template
+
+    :type mol: rdkit.Chem.Mol
+
+    :rtype: tuple
+    :return: The renumbered template, its atom maps in the new order and its SMARTS without atom maps
+    """
+    ranking_mol = Chem.Mol(mol)
+    for atom in ranking_mol.GetAtoms():
+        atom.SetAtomMapNum(0)
+    #encode the atom queries as isotopes so that they are used as invariants of the ranking
+    queries = sorted(set([atom.GetSmarts() for atom in ranking_mol.GetAtoms()]))
+    for atom in ranking_mol.GetAtoms():
+        atom.SetIsotope(queries.index(atom.GetSmarts())+1)
+    ranking_mol.UpdatePropertyCache(strict=False)
+    ranks = list(Chem.CanonicalRankAtoms(ranking_mol, breakTies=True))
+    order = sorted(range(mol.GetNumAtoms()), key=lambda i: ranks[i])
+    mol = Chem.RenumberAtoms(mol, order)
+    maps = [atom.GetAtomMapNum() for atom in mol.GetAtoms()]
+    for atom in mol.GetAtoms():
+        atom.SetAtomMapNum(0)
+    return mol, maps, Chem.MolToSmarts(mol)
+
+
+def canonicalSmarts(smarts):
+    """Return a canonical form of a reaction rule SMARTS
+
+    The templates of each side are written with their atoms in canonical order and sorted, and the atom maps
+    are renumbered in order of appearance. Two rules with the same canonical form are the same rule. Rules
+    with symmetrical queries may not reach the same form, in which case they are simply not merged
+
+    :param smarts: The reaction rule SMARTS
+
+    :type smarts: str
+
+    :rtype: str
+    :return: The canonical SMARTS or None if it cannot be parsed
+    """
+    try:
+        with rrScreen.blockLogs():
+            rxn = AllChem.ReactionFromSmarts(smarts)
+    except ValueError:
+        return None
+    if rxn is None:
+        return None
+    new_maps = {}
+    sides = []
+    for templates in [rxn.GetReactants(), rxn.GetProducts()]:
+        try:
+            side = sorted([_canonicalTemplate(i) for i in templates], key=lambda i: i[2])
+        except RuntimeError:
+            return None
+        side_smarts = []
+        for mol, maps, unmapped_smarts in side:
+            for atom, atom_map in zip(mol.GetAtoms(), maps):
+                if atom_map:
+                    atom.SetAtomMapNum(new_maps.setdefault(atom_map, len(new_maps)+1))
+            side_smarts.append('('+Chem.MolToSmarts(mol)+')')
+        sides.append('.'.join(side_smarts))
+    return '>>'.join(sides)
+
+
+def dedupRules(rules_path, output, mapping_path=None):
+    """Merge the reaction rules with the same canonical SMARTS and rule usage
+
+    For each group of duplicates, the rule with the best normalized score is kept (the first one in case
+    of a tie) and the identifiers of the others are written to the mapping file. The rules are written in
+    the order of the input
+
+    :param rules_path: Path to the rules CSV file
+    :param output: Path to the deduplicated rules CSV file
+    :param mapping_path: Path to the file mapping the kept rules to their duplicates (Default: None)
+
+    :type rules_path: str
+    :type output: str
+    :type mapping_path: str
+
+    :rtype: int
+    :return: The number of rules removed or None if the rules cannot be read
+    """
+    canonical = {}
+    best = {}
+    duplicates = {}
+    try:
+        with open(rules_path, 'r', newline='') as rf:
+            rf_csv = csv.reader(rf)
+            header = next(rf_csv)
+            rows = list(rf_csv)
+    except (OSError, StopIteration) as e:
+        logger.error('Cannot read the rules file '+str(rules_path)+': '+str(e))
+        return None
+    for i, row in enumerate(rows):
+        if len(row)<len(header):
+            logger.warning('Keeping the incomplete rule row '+str(i+1)+' as it is')
+            key = (i,)
+            score = float('-inf')
+        else:
+            try:
+                score = float(row[10])
+            except ValueError:
+                score = float('-inf')
+            if not row[1] in canonical:
+                canonical[row[1]] = canonicalSmarts(row[1])
+            if canonical[row[1]] is None:
+                logger.warning('Cannot parse the SMARTS of the rule '+str(row[0]))
+                #keep the unparsable rules as they are
+                key = (i,)
+            else:
+                key = (canonical[row[1]], row[9])
+        if not key in best:
+            best[key] = (score, i)
+            duplicates[key] = []
+        elif score>best[key][0]:
+            duplicates[key].append(best[key][1])
+            best[key] = (score, i)
+        else:
+            duplicates[key].append(i)
+    kept = sorted([best[key][1] for key in best])
+    with open(output, 'w') as o:
+        o_csv = csv.writer(o, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+        o_csv.writerow(header)
+        for i in kept:
+            o_csv.writerow(rows[i])
+    if mapping_path:
+        with open(mapping_path, 'w') as o:
+            o_csv = csv.writer(o, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+            o_csv.writerow(MAPPING_HEADER)
+            for key in best:
+                for i in sorted(duplicates[key]):
+                    o_csv.writerow([rows[best[key][1]][0], rows[i][0], rows[i][6], rows[i][4], rows[i][10]])
+    removed = len(rows)-len(kept)
+    logger.info('Removed '+str(removed)+' duplicate rules out of '+str(len(rows)))
+    return removed
+
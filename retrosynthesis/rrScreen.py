@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Target-aware pre-screening of the reaction rules. The RDKit pattern fingerprints and element sets of the reactant side templates of each rule are indexed alongside the rule columns, so that the rules that cannot fire on the source molecule are dropped before RetroPath2.0
+
+"""
+
+import os
+import json
+import logging
+import contextlib
+
+import numpy as np
+
+from rdkit import Chem
+from rdkit import RDLogger
+from rdkit import DataStructs
+from rdkit.Chem import AllChem
+
+import rrColumns
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+SCREEN_META = 'meta.json'
+SCREEN_VERSION = 1
+SCREEN_MODES = ['target', 'conservative']
+FP_SIZE = 2048
+#number of atomic numbers tracked in the element sets
+ELEMENTS = 128
+ARRAYS = ['fingerprint', 'reactant_elements', 'product_elements', 'parsed']
+
+
+@contextlib.contextmanager
+def blockLogs():
+    """Silence the RDKit logs within a block, leaving them enabled for the rest of the process
+
+    RDLogger.BlockLogs restores the previous state of the logs. Older RDKit versions do not have it,
+    and the errors and warnings are enabled again after the block
+    """
+    if hasattr(RDLogger, 'BlockLogs'):
+        block = RDLogger.BlockLogs()
+        try:
+            yield
+        finally:
+            del block
+        return
+    RDLogger.DisableLog('rdApp.*')
+    try:
+        yield
+    finally:
+        RDLogger.EnableLog('rdApp.error')
+        RDLogger.EnableLog('rdApp.warning')
+
+
+def _templates(smarts):
+    """Return the query molecules of the reactant and product sides of a rule
+
+    :param smarts: The reaction rule SMARTS
+
+    :type smarts: str
+
+    :rtype: tuple
+    :return: The reactant and product templates or None if the SMARTS cannot be parsed
+    """
+    try:
+        with blockLogs():
+            rxn = AllChem.ReactionFromSmarts(smarts)
+    except ValueError:
+        return None
+    if rxn is None:
+        return None
+    reactants = list(rxn.GetReactants())
+    products = list(rxn.GetProducts())
+    for mol in reactants+products:
+        mol.UpdatePropertyCache(strict=False)
+    return reactants, products
+
+
+def _elements(mols):
+    """Return the element set of molecules
+
+    Hydrogens and the atoms without a single atomic number (wildcards and lists) are ignored
+
+    :param mols: The molecules
+
+    :type mols: list
+
+    :rtype: numpy.ndarray
+    :return: The packed bits of the atomic numbers present in the molecules
+    """
+    elements = np.zeros(ELEMENTS, dtype=bool)
+    for mol in mols:
+        for atom in mol.GetAtoms():
+            if 1<atom.GetAtomicNum()<ELEMENTS:
+                elements[atom.GetAtomicNum()] = True
+    return np.packbits(elements)
+
+
+def _fingerprint(mols):
+    """Return the union of the pattern fingerprints of molecules
+
+    :param mols: The molecules
+
+    :type mols: list
+
+    :rtype: numpy.ndarray
+    :return: The packed bits of the fingerprint
+    """
+    bits = np.zeros(FP_SIZE, dtype=np.uint8)
+    for mol in mols:
+        mol_bits = np.zeros((0,), dtype=np.uint8)
+        DataStructs.ConvertToNumpyArray(Chem.PatternFingerprint(mol, fpSize=FP_SIZE), mol_bits)
+        bits |= mol_bits
+    return np.packbits(bits.astype(bool))
+
+
+def fromColumns(columns):
+    """Build the screening index of the rules, in the order of the rule columns
+
+    :param columns: The columns of the rules
+
+    :type columns: dict
+
+    :rtype: dict
+    :return: Dictionnary of the index name to its array
+    """
+    count = len(columns['diameter'])
+    screen = {'fingerprint': np.zeros((count, FP_SIZE//8), dtype=np.uint8),
+              'reactant_elements': np.zeros((count, ELEMENTS//8), dtype=np.uint8),
+              'product_elements': np.zeros((count, ELEMENTS//8), dtype=np.uint8),
+              'parsed': np.zeros(count, dtype=bool)}
+    templates = {}
+    for i in range(count):
+        smarts = rrColumns.smarts(columns, i)
+        #the same SMARTS is shared by the rules of different diameters or legacy IDs
+        if not smarts in templates:
+            rule_templates = _templates(smarts)
+            if rule_templates is None:
+                templates[smarts] = None
+            else:
+                templates[smarts] = (_fingerprint(rule_templates[0]), _elements(rule_templates[0]), _elements(rule_templates[1]))
+        if templates[smarts] is None:
+            continue
+        screen['fingerprint'][i], screen['reactant_elements'][i], screen['product_elements'][i] = templates[smarts]
+        screen['parsed'][i] = True
+    unparsed = count-int(screen['parsed'].sum())
+    if unparsed:
+        logger.warning('Cannot parse the SMARTS of '+str(unparsed)+' rules, they are never screened out')
+    return screen
+
+
+def save(screen, screen_path):
+    """Write the screening index as NumPy files that can be memory mapped
+
+    :param screen: The screening index
+    :param screen_path: Path to the screening index folder
+
+    :type screen: dict
+    :type screen_path: str
+
+    :rtype: None
+    :return: None
+    """
+    os.makedirs(screen_path, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(screen_path, name+'.npy'), screen[name])
+    with open(os.path.join(screen_path, SCREEN_META), 'w') as f:
+        json.dump({'version': SCREEN_VERSION, 'fp_size': FP_SIZE, 'count': len(screen['parsed'])}, f)
+
+
+def load(screen_path, count=None):
+    """Memory map the screening index
+
+    :param screen_path: Path to the screening index folder
+    :param count: The expected number of rules, not checked if None (Default: None)
+
+    :type screen_path: str
+    :type count: int
+
+    :rtype: dict
+    :return: Dictionnary of the index name to its array or None if there is no valid index
+    """
+    try:
+        with open(os.path.join(screen_path, SCREEN_META), 'r') as f:
+            meta = json.load(f)
+        if not meta.get('version')==SCREEN_VERSION or not meta.get('fp_size')==FP_SIZE:
+            logger.warning('Ignoring the rule screening index with version '+str(meta.get('version')))
+            return None
+        if count is not None and not meta['count']==count:
+            logger.warning('The rule screening index does not match the rule columns')
+            return None
+        screen = {}
+        for name in ARRAYS:
+            screen[name] = np.load(os.path.join(screen_path, name+'.npy'), mmap_mode='r')
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning('Cannot load the rule screening index: '+str(e))
+        return None
+    return screen
+
+
+def _targetMask(columns, screen, mol):
+    """Return the mask of the rules whose reactant templates match the molecule
+
+    The rules are first screened on their pattern fingerprint being a subset of the fingerprint
+    of the molecule, and the remaining ones are confirmed by a substructure match
+
+    :param columns: The columns of the rules
+    :param screen: The screening index
+    :param mol: The molecule, with explicit hydrogens
+
+    :type columns: dict
+    :type screen: dict
+    :type mol: rdkit.Chem.Mol
+
+    :rtype: numpy.ndarray
+    :return: The boolean mask of the rules
+    """
+    mol_fp = _fingerprint([mol])
+    mask = np.all((screen['fingerprint'] & ~mol_fp)==0, axis=1)
+    matches = {}
+    for i in np.flatnonzero(mask & screen['parsed']):
+        smarts = rrColumns.smarts(columns, i)
+        if not smarts in matches:
+            matches[smarts] = all([mol.HasSubstructMatch(template) for template in _templates(smarts)[0]])
+        mask[i] = matches[smarts]
+    mask |= ~screen['parsed']
+    return mask
+
+
+def _reachableMask(screen, mol, max_steps):
+    """Return the mask of the rules whose reactant elements can be reached from the molecule
+
+    Starting from the elements of the molecule, the elements of the product side of every rule
+    that can fire are added at each step. A rule is kept if its reactant elements are reached
+    before the last step. No rule that can fire in the search is dropped
+
+    :param screen: The screening index
+    :param mol: The molecule
+    :param max_steps: The maximal number of steps of the search
+
+    :type screen: dict
+    :type mol: rdkit.Chem.Mol
+    :type max_steps: int
+
+    :rtype: numpy.ndarray
+    :return: The boolean mask of the rules
+    """
+    reached = _elements([mol])
+    reactant_elements = np.asarray(screen['reactant_elements'])
+    product_elements = np.asarray(screen['product_elements'])
+    mask = np.all((reactant_elements & ~reached)==0, axis=1)
+    for step in range(1, max(max_steps, 1)):
+        if not mask.any():
+            break
+        new_reached = reached | np.bitwise_or.reduce(product_elements[mask], axis=0)
+        if np.array_equal(new_reached, reached):
+            break
+        reached = new_reached
+        mask = np.all((reactant_elements & ~reached)==0, axis=1)
+    mask |= ~np.asarray(screen['parsed'])
+    return mask
+
+
+def screenMask(columns, screen, source_inchi, mode='target', max_steps=1):
+    """Return the mask of the rules that can fire on the source molecule
+
+    In target mode, only the rules whose reactant templates match the source molecule are kept,
+    which suits single step searches. The conservative mode keeps every rule whose reactant
+    elements can be reached from the source within the maximal number of steps
+
+    :param columns: The columns of the rules
+    :param screen: The screening index
+    :param source_inchi: The InChI of the source molecule
+    :param mode: The screening mode. Valid options: target, conservative. (Default: target)
+    :param max_steps: The maximal number of steps of the search (Default: 1)
+
+    :type columns: dict
+    :type screen: dict
+    :type source_inchi: str
+    :type mode: str
+    :type max_steps: int
+
+    :rtype: numpy.ndarray
+    :return: The boolean mask of the rules or None if the source cannot be parsed
+    """
+    if not mode in SCREEN_MODES:
+        logger.error('Cannot recognise the screening mode: '+str(mode))
+        return None
+    with blockLogs():
+        mol = Chem.MolFromInchi(source_inchi)
+    if mol is None:
+        logger.error('Cannot parse the source InChI: '+str(source_inchi))
+        return None
+    #the RetroRules templates hold explicit hydrogens, which only match the hydrogen atoms of the molecule
+    mol = Chem.AddHs(mol)
+    if mode=='target':
+        mask = _targetMask(columns, screen, mol)
+    else:
+        mask = _reachableMask(screen, mol, max_steps)
+    logger.info('The '+str(mode)+' screening keeps '+str(int(mask.sum()))+' rules out of '+str(len(mask)))
+    return mask
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Created on October 18 2026
+
+@author: agent
+@description: Pre-partitioned RetroRules store. Splits the rule files by diameter into shards and keeps a byte-offset index so that any diameter subset can be assembled by ranged reads, without parsing the rows again. The rows are returned in the order of the source file. The columnar representation and the screening index of each rule file are stored alongside
+
+"""
+
+import csv
+import os
+import json
+import shutil
+import logging
+
+import numpy as np
+
+import rrColumns
+import rrScreen
+
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+RR_STORE_PATH = '/home/retrorules/store/'
+STORE_INDEX = 'index.json'
+#runs of consecutive rows of the source in the same shard, as diameter, usage code, start and end in the shard
+STORE_RUNS = 'runs.npy'
+STORE_VERSION = 3
+#size of the blocks read from the shards when assembling the rules
+READ_BLOCK = 1024*1024
+#parsed indexes of the stores, keyed on the path of the index and reloaded when the file changes
+_INDEXES = {}
+
+
+def _writeShards(columns, type_path):
+    """Write the rows of the columns to one shard per diameter and compute the runs of the source
+
+    A run is a sequence of consecutive rows of the source with the same diameter and rule usage, that are
+    also consecutive in the shard of the diameter
+
+    :param columns: The columns of the rule file
+    :param type_path: Path to the folder of the shards
+
+    :type columns: dict
+    :type type_path: str
+
+    :rtype: tuple
+    :return: The diameter and size of each shard, in the order the diameters first appear in the source, and the runs as an array of diameter, usage code, start and end
+    """
+    diameter = np.asarray(columns['diameter'])
+    usage = np.asarray(columns['usage'])
+    lengths = np.diff(columns['row_offsets'])
+    #offset of each row in the shard of its diameter
+    shard_starts = np.zeros(len(diameter), dtype=np.int64)
+    shards = []
+    for shard_diameter in diameter[np.sort(np.unique(diameter, return_index=True)[1])]:
+        indices = np.flatnonzero(diameter==shard_diameter)
+        ends = np.cumsum(lengths[indices])
+        shard_starts[indices] = ends-lengths[indices]
+        with open(os.path.join(type_path, str(shard_diameter)+'.csv'), 'wb') as f:
+            rrColumns.writeRows(f, columns, indices, header=False)
+        shards.append([int(shard_diameter), int(ends[-1])])
+    if not len(diameter):
+        return shards, np.zeros((0, 4), dtype=np.int64)
+    breaks = np.flatnonzero((diameter[1:]!=diameter[:-1]) | (usage[1:]!=usage[:-1]))+1
+    firsts = np.concatenate(([0], breaks))
+    lasts = np.concatenate((breaks-1, [len(diameter)-1]))
+    runs = np.stack([diameter[firsts], usage[firsts], shard_starts[firsts], shard_starts[lasts]+lengths[lasts]], axis=1).astype(np.int64)
+    return shards, runs
+
+
+def buildStore(rule_files, store_path=RR_STORE_PATH):
+    """Split the RetroRules files into diameter shards and write the byte-offset index
+
+    Each rule file is read once into its columnar representation, from which one shard per diameter, the
+    runs of the source and the screening index are written to its own folder. The rows are normalised to
+    the quoting used by runRR. As for the scan of the source files, the build fails on a row with an
+    invalid diameter
+
+    :param rule_files: Dictionnary of the rules type to the path of the rule file
+    :param store_path: Path to the store folder (Default: /home/retrorules/store/)
+
+    :type rule_files: dict
+    :type store_path: str
+
+    :rtype: bool
+    :return: Success or failure of the function
+    """
+    store_path = os.path.abspath(store_path)
+    tmp_store_path = store_path.rstrip('/')+'.tmp'
+    if os.path.exists(tmp_store_path):
+        shutil.rmtree(tmp_store_path)
+    os.makedirs(tmp_store_path)
+    index = {'version': STORE_VERSION, 'sources': {}}
+    for rules_type in rule_files:
+        rule_file = os.path.abspath(rule_files[rules_type])
+        logger.debug('Building the store of '+str(rule_file))
+        type_path = os.path.join(tmp_store_path, rules_type)
+        os.makedirs(type_path)
+        try:
+            stat = os.stat(rule_file)
+            with open(rule_file, 'r', newline='') as rf:
+                rf_csv = csv.reader(rf)
+                columns = rrColumns.fromRows(next(rf_csv), rf_csv)
+            shards, runs = _writeShards(columns, type_path)
+            np.save(os.path.join(type_path, STORE_RUNS), runs)
+        except (OSError, ValueError, csv.Error, StopIteration) as e:
+            logger.error('Cannot read the rule file '+str(rule_file)+': '+str(e))
+            shutil.rmtree(tmp_store_path)
+            return False
+        rrColumns.save(columns, os.path.join(type_path, 'columns'))
+        logger.debug('Building the screening index of '+str(rule_file))
+        rrScreen.save(rrScreen.fromColumns(columns), os.path.join(type_path, 'screen'))
+        index['sources'][rules_type] = {'source': rule_file,
+                                        'size': stat.st_size,
+                                        'mtime': stat.st_mtime,
+                                        'header': columns['header'].decode('utf-8'),
+                                        'shards': shards}
+    with open(os.path.join(tmp_store_path, STORE_INDEX), 'w') as f:
+        json.dump(index, f)
+    #swap the old store with the new one
+    old_store_path = store_path.rstrip('/')+'.old'
+    if os.path.exists(store_path):
+        os.rename(store_path, old_store_path)
+    os.rename(tmp_store_path, store_path)
+    if os.path.exists(old_store_path):
+        shutil.rmtree(old_store_path)
+    return True
+
+
+def loadIndex(store_path=RR_STORE_PATH):
+    """Return the index of the store
+
+    :param store_path: Path to the store folder (Default: /home/retrorules/store/)
+
+    :type store_path: str
+
+    The index is parsed once and kept until the file changes
+
+    :rtype: dict
+    :return: The store index or None if there is no valid store
+    """
+    index_path = os.path.abspath(os.path.join(store_path, STORE_INDEX))
+    try:
+        stat = os.stat(index_path)
+        key = (stat.st_ino, stat.st_size, stat.st_mtime)
+        if index_path in _INDEXES and _INDEXES[index_path][0]==key:
+            return _INDEXES[index_path][1]
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not index.get('version')==STORE_VERSION:
+        logger.warning('Ignoring the rule store with version '+str(index.get('version')))
+        return None
+    _INDEXES[index_path] = (key, index)
+    return index
+
+
+def _isFresh(source):
+    """Check that the rule file has not changed since the store was built
+
+    :param source: The index entry of the rule file
+
+    :type source: dict
+
+    :rtype: bool
+    :return: If the store entry can be used
+    """
+    try:
+        stat = os.stat(source['source'])
+    except OSError:
+        return False
+    return stat.st_size==source['size'] and stat.st_mtime==source['mtime']
+
+
+def findSource(rules_type=None, rule_file=None, store_path=RR_STORE_PATH):
+    """Return the store entry matching either a rules type or a rule file path
+
+    :param rules_type: The rule type of the bundled file
+    :param rule_file: Path to a rule file
+    :param store_path: Path to the store folder (Default: /home/retrorules/store/)
+
+    :type rules_type: str
+    :type rule_file: str
+    :type store_path: str
+
+    :rtype: str
+    :return: The rule type key of the store entry or None if the store cannot be used
+    """
+    index = loadIndex(store_path)
+    if not index:
+        return None
+    for i in index['sources']:
+        source = index['sources'][i]
+        if (rules_type and i==rules_type) or (rule_file and os.path.realpath(rule_file)==os.path.realpath(source['source'])):
+            if _isFresh(source):
+                return i
+            logger.warning('The rule store is out of date for '+str(source['source']))
+            return None
+    return None
+
+
+def columnsPath(rules_type, store_path=RR_STORE_PATH):
+    """Return the path to the columnar representation of a store entry
+
+    :param rules_type: The rule type key of the store entry
+    :param store_path: Path to the store folder (Default: /home/retrorules/store/)
+
+    :type rules_type: str
+    :type store_path: str
+
+    :rtype: str
+    :return: Path to the columns folder
+    """
+    return os.path.join(store_path, rules_type, 'columns')
+
+
+def screenPath(rules_type, store_path=RR_STORE_PATH):
+    """Return the path to the screening index of a store entry
+
+    :param rules_type: The rule type key of the store entry
+    :param store_path: Path to the store folder (Default: /home/retrorules/store/)
+
+    :type rules_type: str
+    :type store_path: str
+
+    :rtype: str
+    :return: Path to the screen folder
+    """
+    return os.path.join(store_path, rules_type, 'screen')
+
+
+def writeRules(out_f, rules_type, diameters, usages=None, store_path=RR_STORE_PATH):
+    """Assemble the rules of the requested diameters from the shards
+
+    The runs of the source are selected with vectorized masks, the consecutive runs of the same shard are
+    coalesced into contiguous byte ranges and copied as is, so that the rows are written in the order of
+    the source file, as the scan of the rule file writes them
+
+    :param out_f: Binary file object to write to
+    :param rules_type: The rule type key of the store entry
+    :param diameters: The diameters to return
+    :param usages: The rule usages to return, all if None (Default: None)
+    :param store_path: Path to the store folder (Default: /home/retrorules/store/)
+
+    :type out_f: file
+    :type rules_type: str
+    :type diameters: list
+    :type usages: list
+    :type store_path: str
+
+    :rtype: bool
+    :return: Success or failure of the function
+    """
+    index = loadIndex(store_path)
+    if not index or not rules_type in index['sources']:
+        logger.error('Cannot find the rules type '+str(rules_type)+' in the store')
+        return False
+    source = index['sources'][rules_type]
+    try:
+        runs = np.load(os.path.join(store_path, rules_type, STORE_RUNS), mmap_mode='r')
+    except (OSError, ValueError) as e:
+        logger.error('Cannot read the runs of the rule store: '+str(e))
+        return False
+    mask = np.isin(runs[:, 0], list(diameters))
+    if usages is not None:
+        mask &= np.isin(runs[:, 1], [rrColumns.USAGE_CODES[i] for i in usages if i in rrColumns.USAGE_CODES])
+    runs = runs[mask]
+    out_f.write(source['header'].encode('utf-8'))
+    if not len(runs):
+        return True
+    #the runs of a shard separated by rows that are not selected are contiguous in the shard
+    breaks = np.flatnonzero((runs[1:, 0]!=runs[:-1, 0]) | (runs[1:, 2]!=runs[:-1, 3]))+1
+    firsts = np.concatenate(([0], breaks))
+    lasts = np.concatenate((breaks-1, [len(runs)-1]))
+    shards = {}
+    try:
+        for diameter, start, end in zip(runs[firsts, 0].tolist(), runs[firsts, 2].tolist(), runs[lasts, 3].tolist()):
+            if not diameter in shards:
+                shards[diameter] = open(os.path.join(store_path, rules_type, str(diameter)+'.csv'), 'rb', buffering=READ_BLOCK)
+            shard = shards[diameter]
+            #the ranges of each shard are read in increasing order
+            if not shard.tell()==start:
+                shard.seek(start)
+            remaining = end-start
+            while remaining>0:
+                block = shard.read(min(READ_BLOCK, remaining))
+                if not block:
+                    logger.error('The shard '+str(diameter)+' of '+str(rules_type)+' is truncated')
+                    return False
+                out_f.write(block)
+                remaining -= len(block)
+    except OSError as e:
+        logger.error('Cannot read the rule store: '+str(e))
+        return False
+    finally:
+        for diameter in shards:
+            shards[diameter].close()
+    return True
@@ -8,19 +8,28 @@ Created on January 16 2020
 """
 
 
-import subprocess
 import logging
 import csv
 import glob
 import resource
 import os
+import re
 import tempfile
 import argparse
 import shutil
+import functools
+
+import procSupervisor
+import rp2Results
+import rp2Preflight
+import rp2Workspace
+import fileCache
 
 
 KPATH = '/usr/local/knime/knime'
+KNIME_INI = os.path.join(os.path.dirname(KPATH), 'knime.ini')
 RP_WORK_PATH = '/home/rp2/RetroPath2.0.knwf'
+KNIME_MEMORY_ERROR = 'There is insufficient memory for the Java Runtime Environment to continue'
 
 
 logging.basicConfig(
@@ -34,71 +43,382 @@ logging.basicConfig(
 
 #MAX_VIRTUAL_MEMORY = 20000*1024*1024 # 20 GB -- define what is the best
 MAX_VIRTUAL_MEMORY = 30000*1024*1024 # 30 GB -- define what is the best
+#share of the RAM limit given to the java heap, the rest is left to the metaspace, code cache, thread stacks and native memory of the JVM
+JVM_HEAP_FRACTION = 0.75
+#share of the maximal heap allocated at startup
+JVM_INITIAL_HEAP_FRACTION = 0.25
+#the reservations of the JVM outside the heap are bounded, so that they fit in the virtual memory headroom
+JVM_CLASS_SPACE = '256m'
+JVM_CODE_CACHE = '192m'
+#virtual memory left above the heap for the class space, code cache, metaspace, thread stacks and malloc arenas
+JVM_VIRTUAL_HEADROOM = 2048*1024*1024
+#the workflow is a batch job where the throughput matters more than the pauses
+JVM_GC = 'UseParallelGC'
+#JVM option selecting a garbage collector, only one may be given
+GC_OPTION_PATTERN = re.compile(r'^-XX:\+Use\w+GC$')
+GC_LOG = 'gc.log'
+GC_PAUSE_PATTERN = re.compile(r'Pause.* (\d+)([KMG])->(\d+)([KMG])\((\d+)([KMG])\) ([\d.]+)ms')
+GC_UNITS = {'K': 1024, 'M': 1024*1024, 'G': 1024*1024*1024}
+RP2_CACHE_STATUSES = ['noerror']
+#statuses of the runs with partial results, only cached on demand
+RP2_CACHE_PARTIAL_STATUSES = ['timeoutwarning', 'memwarning', 'earlystopwarning']
+#limits of a run stored with its partial results, which are only returned to the runs with limits no larger
+RP2_CACHE_PARTIAL_LIMITS = ['timeout', 'ram_limit', 'stop_sink_rows', 'stop_idle']
+#summary of the results file added to the metrics of a run
+RESULTS_METRICS = ['rows', 'sink_rows', 'compounds', 'transformations']
 
 
-def limit_virtual_memory():
+def limit_virtual_memory(max_virtual_memory=MAX_VIRTUAL_MEMORY):
     """Limit the virtual of the subprocess call
+
+    :param max_virtual_memory: The virtual memory limit in bytes (Default: 30 GB)
+
+    :type max_virtual_memory: int
     """
-    resource.setrlimit(resource.RLIMIT_AS, (MAX_VIRTUAL_MEMORY, resource.RLIM_INFINITY))
+    resource.setrlimit(resource.RLIMIT_AS, (max_virtual_memory, resource.RLIM_INFINITY))
 
 
-def run_rp2(sink_path, 
-            rules_path, 
-            source_inchi, 
-            results_csv, 
-            max_steps, 
-            source_name='target', 
-            topx=100, 
-            dmin=0, 
-            dmax=1000, 
-            mwmax_source=1000, 
-            mwmax_cof=1000, 
-            timeout=30, 
-            ram_limit=None, 
-            partial_retro=False):
-    """Call the KNIME RetroPath2.0 workflow
+def jvm_max_heap(max_virtual_memory=MAX_VIRTUAL_MEMORY):
+    """Return the maximal heap of a KNIME launch
 
-    :param source_bytes: The source file as bytes
-    :param sink_bytes: The sink file as bytes
-    :param rules_bytes: The rules file as bytes
+    :param max_virtual_memory: The RAM limit in bytes of the run (Default: 30 GB)
+
+    :type max_virtual_memory: int
+
+    :rtype: int
+    :return: The maximal heap in MB
+    """
+    return max(int(max_virtual_memory*JVM_HEAP_FRACTION/(1024*1024)), 256)
+
+
+def jvm_virtual_memory(max_virtual_memory=MAX_VIRTUAL_MEMORY):
+    """Return the virtual memory limit of a KNIME launch
+
+    The JVM reserves virtual memory well beyond its heap, so the limit of the process is the maximal heap
+    with a fixed headroom, and the heap is the bound of the memory used by the run
+
+    :param max_virtual_memory: The RAM limit in bytes of the run (Default: 30 GB)
+
+    :type max_virtual_memory: int
+
+    :rtype: int
+    :return: The virtual memory limit in bytes
+    """
+    return jvm_max_heap(max_virtual_memory)*1024*1024+JVM_VIRTUAL_HEADROOM
+
+
+def knime_ini_gc(knime_ini=KNIME_INI):
+    """Return the garbage collector selected in knime.ini
+
+    :param knime_ini: Path to knime.ini (Default: /usr/local/knime/knime.ini)
+
+    :type knime_ini: str
+
+    :rtype: str
+    :return: The JVM option of the collector or None if there is none or the file cannot be read
+    """
+    try:
+        with open(knime_ini, 'r', errors='replace') as f:
+            for line in f:
+                if GC_OPTION_PATTERN.match(line.strip()):
+                    return line.strip()
+    except OSError:
+        return None
+    return None
+
+
+def jvm_options(max_virtual_memory=MAX_VIRTUAL_MEMORY, cpus=None, gc_log=None, knime_ini=KNIME_INI):
+    """Return the JVM options of a KNIME launch
+
+    The heap is bounded by the RAM limit and the class space and code cache are capped, so that the
+    reservations of the JVM fit in the virtual memory limit of the process (see jvm_virtual_memory). The
+    processors seen by the JVM are sized on the CPU budget of the run. The parallel garbage collector is
+    only selected when knime.ini does not select one, since the JVM refuses to start with two
+
+    :param max_virtual_memory: The RAM limit in bytes of the run (Default: 30 GB)
+    :param cpus: The number of CPUs of the run, the JVM uses all the CPUs of the host if None (Default: None)
+    :param gc_log: Path to the garbage collection log, no log if None (Default: None)
+    :param knime_ini: Path to knime.ini (Default: /usr/local/knime/knime.ini)
+
+    :type max_virtual_memory: int
+    :type cpus: int
+    :type gc_log: str
+    :type knime_ini: str
+
+    :rtype: list
+    :return: The JVM options
+    """
+    max_heap = jvm_max_heap(max_virtual_memory)
+    vmargs = ['-Xmx'+str(max_heap)+'m',
+              '-Xms'+str(max(int(max_heap*JVM_INITIAL_HEAP_FRACTION), 64))+'m',
+              '-XX:CompressedClassSpaceSize='+JVM_CLASS_SPACE,
+              '-XX:ReservedCodeCacheSize='+JVM_CODE_CACHE]
+    knime_gc = knime_ini_gc(knime_ini)
+    if knime_gc:
+        logging.debug('Keeping the garbage collector of knime.ini: '+str(knime_gc))
+    else:
+        vmargs.append('-XX:+'+JVM_GC)
+    if cpus:
+        vmargs += ['-XX:ActiveProcessorCount='+str(int(cpus)),
+                   '-XX:ParallelGCThreads='+str(int(cpus))]
+    if gc_log:
+        vmargs.append('-Xlog:gc:file='+str(gc_log)+':uptime')
+    return vmargs
+
+
+def parse_gc_log(gc_log):
+    """Return the heap high-water mark and the pauses of a garbage collection log
+
+    :param gc_log: Path to the log written with -Xlog:gc
+
+    :type gc_log: str
+
+    :rtype: dict
+    :return: The heap used before the largest collection and the largest committed heap in bytes, the number and total time in seconds of the pauses, or None if the log cannot be read
+    """
+    metrics = {'heap_peak': 0, 'heap_committed': 0, 'gc_pauses': 0, 'gc_pause_time': 0.0}
+    try:
+        with open(gc_log, 'r', errors='replace') as f:
+            for line in f:
+                match = GC_PAUSE_PATTERN.search(line)
+                if not match:
+                    continue
+                before, before_unit, after, after_unit, committed, committed_unit, pause = match.groups()
+                metrics['heap_peak'] = max(metrics['heap_peak'], int(before)*GC_UNITS[before_unit])
+                metrics['heap_committed'] = max(metrics['heap_committed'], int(committed)*GC_UNITS[committed_unit])
+                metrics['gc_pauses'] += 1
+                metrics['gc_pause_time'] += float(pause)/1000.0
+    except OSError:
+        return None
+    metrics['gc_pause_time'] = round(metrics['gc_pause_time'], 3)
+    return metrics
+
+
+def workflow_variables(source_path, sink_path, rules_path, output_dir, max_steps, topx=100, dmin=0, dmax=1000, mwmax_source=1000, mwmax_cof=1000):
+    """Return the variables of the RetroPath2.0 workflow
+
+    :param source_path: Path to the source file
+    :param sink_path: Path to the sink file
+    :param rules_path: Path to the rules file
+    :param output_dir: Path to the output folder of the workflow
     :param max_steps: The maximal number of steps
     :param topx: The top number of reaction rules to keep at each iteraction (Default: 100)
     :param dmin: The minimum diameter of the reaction rules (Default: 0)
     :param dmax: The miximum diameter of the reaction rules (Default: 1000)
     :param mwmax_source: The maximal molecular weight of the intermediate compound (Default: 1000)
     :param mwmax_cof: The coefficient of the molecular weight of the intermediate compound (Default: 1000)
-    :param timeout: The timeout of the function in minutes (Default: 30)
-    :param partial_retro: Return partial results if the execution is interrupted for any reason (Default: False)
-    :param logger: Logger object (Default: None)
 
-    :type source_bytes: bytes
-    :type sink_bytes: bytes
-    :type rules_bytes: bytes
+    :type source_path: str
+    :type sink_path: str
+    :type rules_path: str
+    :type output_dir: str
     :type max_steps: int
     :type topx: int
     :type dmin: int
     :type dmax: int
     :type mwmax_source: int
     :type mwmax_cof: int
-    :type timeout: int
-    :type partial_retro: bool
-    :type logger: logging
+
+    :rtype: list
+    :return: The workflow variables as (name, value, type)
+    """
+    return [('input.dmin', str(dmin), 'int'),
+            ('input.dmax', str(dmax), 'int'),
+            ('input.max-steps', str(max_steps), 'int'),
+            ('input.sourcefile', str(source_path), 'String'),
+            ('input.sinkfile', str(sink_path), 'String'),
+            ('input.rulesfile', str(rules_path), 'String'),
+            ('input.topx', str(topx), 'int'),
+            ('input.mwmax-source', str(mwmax_source), 'int'),
+            ('input.mwmax-cof', str(mwmax_cof), 'int'),
+            ('output.dir', str(output_dir)+'/', 'String'),
+            ('output.solutionfile', 'results.csv', 'String'),
+            ('output.sourceinsinkfile', 'source-in-sink.csv', 'String')]
+
+
+def build_knime_command(variables, workflow=RP_WORK_PATH, vmargs=None, knime_areas=None):
+    """Return the KNIME batch command running the workflow once
+
+    :param variables: The workflow variables as (name, value, type)
+    :param workflow: Path to the workflow (Default: /home/rp2/RetroPath2.0.knwf)
+    :param vmargs: The JVM options, appended to the ones of knime.ini so that they override them (Default: None)
+    :param knime_areas: The -data and -configuration arguments of the launch, the default areas if None (Default: None)
+
+    :type variables: list
+    :type workflow: str
+    :type vmargs: list
+    :type knime_areas: list
+
+    :rtype: str
+    :return: The KNIME command
+    """
+    knime_command = KPATH+' -nosplash -nosave -reset --launcher.suppressErrors'
+    if knime_areas:
+        knime_command += ' '+' '.join(knime_areas)
+    knime_command += ' -application org.knime.product.KNIME_BATCH_APPLICATION -workflowFile='+workflow
+    for name, value, variable_type in variables:
+        knime_command += ' -workflow.variable='+name+',"'+value+'",'+variable_type
+    knime_command += ' -preferences=/home/retrosynthesis/pref.epf'
+    if vmargs:
+        #-vmargs must be the last argument, everything after it is passed to the JVM
+        knime_command += ' --launcher.appendVmargs -vmargs '+' '.join(vmargs)
+    return knime_command
+
+
+def _run_workflow(variables, knime_command, area_dir, timeout, executor=None, log_path=None, max_virtual_memory=None, cpus=None, monitor=None):
+    """Run the RetroPath2.0 workflow, on the executor if there is one or else with a single supervised KNIME launch
+
+    :param variables: The workflow variables as (name, value, type)
+    :param knime_command: The command of the KNIME launch, see build_knime_command
+    :param area_dir: Path to the empty folder of the private KNIME areas of the command, see rp2Workspace.area_args
+    :param timeout: The timeout in minutes
+    :param executor: Pool of warm workers running the workflow (Default: None)
+    :param log_path: Path to the log file of the KNIME output (Default: None)
+    :param max_virtual_memory: The RAM limit in bytes of the run, 30 GB for a KNIME launch and the limit of the workers on the executor if None (Default: None)
+    :param cpus: The number of CPUs of the run, always run with a KNIME launch if set (Default: None)
+    :param monitor: Function called periodically during the run, returning the reason to stop it or None (Default: None)
+
+    :type variables: list
+    :type knime_command: str
+    :type area_dir: str
+    :type timeout: float
+    :type executor: rp2Executor.RP2Executor
+    :type log_path: str
+    :type max_virtual_memory: int
+    :type cpus: int
+    :type monitor: function
 
     :rtype: tuple
-    :return: tuple of bytes with the results, the status message, the KNIME command used
+    :return: The output and error messages, if the workflow has timed out, if java ran out of memory, the reason it was stopped by the monitor and the metrics of the run, with the heap and garbage collection metrics of a KNIME launch
+    """
+    if executor:
+        #the workers must run within the limits of the call, or the workflow is run once with them
+        executor_state, result, metrics = executor.submit(variables, timeout*60.0, monitor, jvm_virtual_memory(max_virtual_memory) if max_virtual_memory else None, cpus)
+        if executor_state=='stopped':
+            return '', '', False, False, result, metrics
+        if not executor_state=='unavailable':
+            return result, '', executor_state=='timeout', KNIME_MEMORY_ERROR in result, None, metrics
+        logging.warning('The RetroPath2.0 executor is unavailable, running the workflow once')
+    if not max_virtual_memory:
+        max_virtual_memory = MAX_VIRTUAL_MEMORY
+    output_dir = dict([(i[0], i[1]) for i in variables])['output.dir']
+    #private workspace and configuration so that concurrent launches do not share their locks
+    rp2Workspace.knime_args(area_dir)
+    logging.debug(knime_command)
+    #subprocess timeout is in seconds while we input minutes
+    supervised = procSupervisor.run(knime_command.split(' '),
+                                    timeout=timeout*60.0,
+                                    log_path=log_path,
+                                    fatal_patterns=[KNIME_MEMORY_ERROR],
+                                    max_virtual_memory=jvm_virtual_memory(max_virtual_memory),
+                                    output_dir=output_dir,
+                                    monitor=monitor)
+    metrics = supervised['metrics']
+    gc_metrics = parse_gc_log(os.path.join(output_dir, GC_LOG))
+    if gc_metrics:
+        metrics.update(gc_metrics)
+    return supervised['stdout'], supervised['stderr'], supervised['time_out'], KNIME_MEMORY_ERROR in supervised['matched'], supervised['stopped'], metrics
+
+
+def rp2_cache_key(cache_dir, sink_path, rules_path, source_inchi, max_steps, source_name='target', topx=100, dmin=0, dmax=1000, mwmax_source=1000, mwmax_cof=1000):
+    """Return the cache key of a RetroPath2.0 run
+
+    The key is built from the hash of the sink, rules and workflow files, the source and all the workflow variables
+
+    :param cache_dir: Path to the cache folder
+    :param sink_path: Path to the sink file
+    :param rules_path: Path to the rules file
+    :param source_inchi: The InChI of the source
+    :param max_steps: The maximal number of steps
+    :param source_name: The name of the source (Default: target)
+    :param topx: The top number of reaction rules to keep at each iteraction (Default: 100)
+    :param dmin: The minimum diameter of the reaction rules (Default: 0)
+    :param dmax: The miximum diameter of the reaction rules (Default: 1000)
+    :param mwmax_source: The maximal molecular weight of the intermediate compound (Default: 1000)
+    :param mwmax_cof: The coefficient of the molecular weight of the intermediate compound (Default: 1000)
+
+    :type cache_dir: str
+    :type sink_path: str
+    :type rules_path: str
+    :type source_inchi: str
+    :type max_steps: int
+    :type source_name: str
+    :type topx: int
+    :type dmin: int
+    :type dmax: int
+    :type mwmax_source: int
+    :type mwmax_cof: int
+
+    :rtype: str
+    :return: The cache key or None if the files cannot be read
+    """
+    try:
+        sink_hash = fileCache.fileHash(sink_path, cache_dir)
+        rules_hash = fileCache.fileHash(rules_path, cache_dir)
+        workflow_hash = fileCache.fileHash(RP_WORK_PATH, cache_dir) if os.path.exists(RP_WORK_PATH) else RP_WORK_PATH
+    except OSError as e:
+        logging.warning('Cannot build the RetroPath2.0 cache key: '+str(e))
+        return None
+    #the paths of the run are replaced by the hashes of their content
+    variables = [list(i) for i in workflow_variables('source', 'sink', 'rules', 'output', max_steps, topx, dmin, dmax, mwmax_source, mwmax_cof)]
+    return fileCache.cacheKey('rp2', sink_hash, rules_hash, workflow_hash, source_inchi.replace(' ', ''), str(source_name), variables)
+
+
+def _copy_results(results_path, results_csv, summary=None):
+    """Copy the complete lines of the results file of a run to the output, with its index
+
+    :param results_path: Path to the results file of the run
+    :param results_csv: Path to the output
+    :param summary: The summary of the results file, see rp2Results.scan (Default: None)
+
+    :type results_path: str
+    :type results_csv: str
+    :type summary: dict
+
+    :rtype: None
+    :return: None
+    """
+    rp2Results.copy_complete_lines(results_path, results_csv)
+    if summary:
+        rp2Results.write_index(results_csv, summary)
+
+
+def _run_rp2(sink_path, 
+             rules_path, 
+             source_inchi, 
+             results_csv, 
+             max_steps, 
+             source_name='target', 
+             topx=100, 
+             dmin=0, 
+             dmax=1000, 
+             mwmax_source=1000, 
+             mwmax_cof=1000, 
+             timeout=30, 
+             ram_limit=None, 
+             partial_retro=False,
+             executor=None,
+             cpus=None,
+             on_rows=None,
+             stop_sink_rows=None,
+             stop_idle=None):
+    """Call the KNIME RetroPath2.0 workflow, see run_rp2
     """
     logger = logging.getLogger(__name__)
     logger.debug('Timeout: '+str(timeout*60.0)+' seconds')
+    max_virtual_memory = MAX_VIRTUAL_MEMORY
     if ram_limit:
-        global MAX_VIRTUAL_MEMORY
-        MAX_VIRTUAL_MEMORY = ram_limit*1000*1024*1024
+        max_virtual_memory = ram_limit*1000*1024*1024
         logger.debug('RAM limit: '+str(ram_limit)+' GB')
     else:
         logger.debug('RAM limit: 30 GB')
     is_time_out = False
     is_results_empty = True
+    summary = None
+    metrics = None
     ### run the KNIME RETROPATH2.0 workflow
-    with tempfile.TemporaryDirectory() as tmp_output_folder:
+    #the private KNIME areas are kept out of the output folder, they are only created if KNIME is launched
+    with tempfile.TemporaryDirectory() as tmp_output_folder, tempfile.TemporaryDirectory(prefix='knime-') as area_dir:
         source_path = os.path.join(tmp_output_folder, 'source.csv')
         with open(source_path, 'w') as fi:
             csv_writer = csv.writer(fi, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
@@ -108,33 +428,26 @@ def run_rp2(sink_path,
         source_in_sink_path = os.path.join(tmp_output_folder, 'source-in-sink.csv')
         ### run the KNIME RETROPATH2.0 workflow
         try:
-            knime_command = KPATH+' -nosplash -nosave -reset --launcher.suppressErrors -application org.knime.product.KNIME_BATCH_APPLICATION -workflowFile='+RP_WORK_PATH+' -workflow.variable=input.dmin,"'+str(dmin)+'",int -workflow.variable=input.dmax,"'+str(dmax)+'",int -workflow.variable=input.max-steps,"'+str(max_steps)+'",int -workflow.variable=input.sourcefile,"'+str(source_path)+'",String -workflow.variable=input.sinkfile,"'+str(sink_path)+'",String -workflow.variable=input.rulesfile,"'+str(rules_path)+'",String -workflow.variable=input.topx,"'+str(topx)+'",int -workflow.variable=input.mwmax-source,"'+str(mwmax_source)+'",int -workflow.variable=input.mwmax-cof,"'+str(mwmax_cof)+'",int -workflow.variable=output.dir,"'+str(tmp_output_folder)+'/",String -workflow.variable=output.solutionfile,"results.csv",String -workflow.variable=output.sourceinsinkfile,"source-in-sink.csv",String -preferences=/home/retrosynthesis/pref.epf'
-            logging.debug(knime_command)
-            commandObj = subprocess.Popen(knime_command.split(' '), stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=limit_virtual_memory)
-            result = ''
-            error = ''
-            try:
-                #commandObj.wait(timeout=timeout) #subprocess timeout is in seconds while we input minutes
-                result, error = commandObj.communicate(timeout=timeout*60.0) #subprocess timeout is in seconds while we input minutes
-            except subprocess.TimeoutExpired as e:
-                commandObj.kill()
-                is_time_out = True
-            #(result, error) = commandObj.communicate()
-            result = result.decode('utf-8')
-            error = error.decode('utf-8')
+            variables = workflow_variables(source_path, sink_path, rules_path, tmp_output_folder, max_steps, topx, dmin, dmax, mwmax_source, mwmax_cof)
+            knime_command = build_knime_command(variables, vmargs=jvm_options(max_virtual_memory, cpus, os.path.join(tmp_output_folder, GC_LOG)), knime_areas=rp2Workspace.area_args(area_dir))
+            tail = None
+            if on_rows or stop_sink_rows or stop_idle:
+                tail = rp2Results.ResultsTail(results_path, on_rows, stop_sink_rows, stop_idle)
+            result, error, is_time_out, is_mem_error, stopped, metrics = _run_workflow(variables, knime_command, area_dir, timeout, executor, os.path.join(tmp_output_folder, 'knime.log'), max_virtual_memory if ram_limit else None, cpus, tail)
+            if tail:
+                #pass the rows written since the last check
+                tail()
             logger.debug('RetroPath2.0 results message: '+str(result))
             logger.debug('RetroPath2.0 error message: '+str(error))
             logger.debug('Output folder: '+str(glob.glob(tmp_output_folder+'/*')))
-            #check to see if the results.csv is empty
+            #summarise the results.csv in one pass, it is empty without any row after the header
             try:
-                count = 0
-                with open(results_path) as f:
-                    reader = csv.reader(f, delimiter=',', quotechar='"')
-                    for i in reader:
-                        count += 1
-                if count>1:
-                    is_results_empty = False
-            except (IndexError, FileNotFoundError) as e:
+                summary = rp2Results.scan(results_path)
+                is_results_empty = not summary['rows']
+                if metrics is not None:
+                    metrics['results'] = {i: summary[i] for i in RESULTS_METRICS}
+                    metrics['results']['iterations'] = {i: summary['iterations'][i]['rows'] for i in summary['iterations']}
+            except FileNotFoundError as e:
                 logger.debug('No results.csv file')
                 #is_results_empty is already set to True
                 pass
@@ -143,74 +456,469 @@ def run_rp2(sink_path,
             ########################################################################
             ### if source is in sink. Note making sure that it contains more than the default first line
             try:
-                count = 0
-                with open(source_in_sink_path) as f:
-                    reader = csv.reader(f, delimiter=',', quotechar='"')
-                    for i in reader:
-                        count += 1
-                if count>1:
+                if rp2Results.has_rows(source_in_sink_path):
                     logger.error('Source has been found in the sink')
-                    return 'sourceinsinkerror', str('Command: '+str(knime_command)+'\n Error: Source found in sink\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                    return 'sourceinsinkerror', str('Command: '+str(knime_command)+'\n Error: Source found in sink\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
             except FileNotFoundError as e:
-                logger.error('Cannot find source-in-sink.csv file')
-                logger.error(e)
-                return 'sourceinsinknotfounderror', str('Command: '+str(knime_command)+'\n Error: '+str(e)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                #a workflow stopped early may not have written it, but has found results from the source
+                if not stopped or is_results_empty:
+                    logger.error('Cannot find source-in-sink.csv file')
+                    logger.error(e)
+                    return 'sourceinsinknotfounderror', str('Command: '+str(knime_command)+'\n Error: '+str(e)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
+            ### handle the early stop
+            if stopped:
+                if not is_results_empty:
+                    logger.info('RetroPath2.0 stopped early: '+str(stopped))
+                    _copy_results(results_path, results_csv, summary)
+                    return 'earlystopwarning', str('Command: '+str(knime_command)+'\n Stopped: '+str(stopped)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
+                else:
+                    logger.error('RetroPath2.0 stopped early without results: '+str(stopped))
+                    return 'noresulterror', str('Command: '+str(knime_command)+'\n Stopped: '+str(stopped)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
             ### handle timeout
             if is_time_out:
                 if not is_results_empty and partial_retro:
                     logger.warning('Timeout from retropath2.0 ('+str(timeout)+' minutes)')
-                    shutil.copy(results_path, results_csv)
-                    return 'timeoutwarning', str('Command: '+str(knime_command)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                    _copy_results(results_path, results_csv, summary)
+                    return 'timeoutwarning', str('Command: '+str(knime_command)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
                 else:
                     logger.error('Timeout from retropath2.0 ('+str(timeout)+' minutes)')
-                    return 'timeouterror', str('Command: '+str(knime_command)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                    return 'timeouterror', str('Command: '+str(knime_command)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
             ### if java has an memory issue
-            if 'There is insufficient memory for the Java Runtime Environment to continue' in result:
+            if is_mem_error:
                 if not is_results_empty and partial_retro:
                     logger.warning('RetroPath2.0 does not have sufficient memory to continue')
-                    shutil.copy(results_path, results_csv)
+                    _copy_results(results_path, results_csv, summary)
                     logger.warning('Passing the results file instead')
-                    return 'memwarning', str('Command: '+str(knime_command)+'\n Error: Memory error \n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                    return 'memwarning', str('Command: '+str(knime_command)+'\n Error: Memory error \n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
                 else:
                     logger.error('RetroPath2.0 does not have sufficient memory to continue')
-                    return 'memerror', str('Command: '+str(knime_command)+'\n Error: Memory error \n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                    return 'memerror', str('Command: '+str(knime_command)+'\n Error: Memory error \n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
             ############## IF ALL IS GOOD ##############
             ### csv scope copy to the .dat location
             try:
                 csv_scope = glob.glob(tmp_output_folder+'/*_scope.csv')
-                shutil.copy(results_path, results_csv)
-                return 'noerror', str('').encode('utf-8')
+                _copy_results(results_path, results_csv, summary)
+                return 'noerror', str('').encode('utf-8'), metrics
             except IndexError as e:
                 if not is_results_empty and partial_retro:
                     logger.warning('No scope file generated')
-                    shutil.copy(results_path, results_csv)
+                    _copy_results(results_path, results_csv, summary)
                     logger.warning('Passing the results file instead')
-                    return 'noresultwarning', str('Command: '+str(knime_command)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                    return 'noresultwarning', str('Command: '+str(knime_command)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
                 else:
                     logger.error('RetroPath2.0 has not found any results')
-                    return 'noresulterror', str('Command: '+str(knime_command)+'\n Error: '+str(e)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                    return 'noresulterror', str('Command: '+str(knime_command)+'\n Error: '+str(e)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
         except OSError as e:
             if not is_results_empty and partial_retro:
                 logger.warning('Running the RetroPath2.0 Knime program produced an OSError')
                 logger.warning(e) 
                 shutil.copy(results_path, results_csv)
                 logger.warning('Passing the results file instead')
-                return 'oswarning', str('Command: '+str(knime_command)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                return 'oswarning', str('Command: '+str(knime_command)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
             else:
                 logger.error('Running the RetroPath2.0 Knime program produced an OSError')
                 logger.error(e)
-                return 'oserror', str('Command: '+str(knime_command)+'\n Error: '+str(e)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                return 'oserror', str('Command: '+str(knime_command)+'\n Error: '+str(e)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
         except ValueError as e:
             if not is_results_empty and partial_retro:
                 logger.warning('Cannot set the RAM usage limit')
                 logger.warning(e)
                 shutil.copy(results_path, results_csv)
                 logger.warning('Passing the results file instead')
-                return 'ramwarning', str('Command: '+str(knime_command)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                return 'ramwarning', str('Command: '+str(knime_command)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
             else:
                 logger.error('Cannot set the RAM usage limit')
                 logger.error(e)
-                return 'ramerror', str('Command: '+str(knime_command)+'\n Error: '+str(e)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8')
+                return 'ramerror', str('Command: '+str(knime_command)+'\n Error: '+str(e)+'\n tmp_output_folder: '+str(glob.glob(tmp_output_folder+'/*'))).encode('utf-8'), metrics
+
+
+def run_rp2(sink_path, 
+            rules_path, 
+            source_inchi, 
+            results_csv, 
+            max_steps, 
+            source_name='target', 
+            topx=100, 
+            dmin=0, 
+            dmax=1000, 
+            mwmax_source=1000, 
+            mwmax_cof=1000, 
+            timeout=30, 
+            ram_limit=None, 
+            partial_retro=False,
+            executor=None,
+            cpus=None,
+            on_rows=None,
+            stop_sink_rows=None,
+            stop_idle=None,
+            cache_dir=None,
+            cache_size=fileCache.CACHE_MAX_SIZE,
+            cache_partial=False,
+            preflight=True):
+    """Call the KNIME RetroPath2.0 workflow
+
+    :param source_bytes: The source file as bytes
+    :param sink_bytes: The sink file as bytes
+    :param rules_bytes: The rules file as bytes
+    :param max_steps: The maximal number of steps
+    :param topx: The top number of reaction rules to keep at each iteraction (Default: 100)
+    :param dmin: The minimum diameter of the reaction rules (Default: 0)
+    :param dmax: The miximum diameter of the reaction rules (Default: 1000)
+    :param mwmax_source: The maximal molecular weight of the intermediate compound (Default: 1000)
+    :param mwmax_cof: The coefficient of the molecular weight of the intermediate compound (Default: 1000)
+    :param timeout: The timeout of the function in minutes (Default: 30)
+    :param partial_retro: Return partial results if the execution is interrupted for any reason (Default: False)
+    :param executor: Pool of warm workers running the workflow, one KNIME launch per call if None (Default: None)
+    :param cpus: The number of CPUs given to the JVM of the KNIME launch, all the CPUs of the host if None (Default: None)
+    :param on_rows: Function called during the run with the list of the new rows of the results, as dictionnaries of the header to the values (Default: None)
+    :param stop_sink_rows: Stop the run once this number of rows reach the sink (Default: None)
+    :param stop_idle: Stop the run when no new row has been found for this number of minutes after the first one (Default: None)
+    :param cache_dir: Path to the cache folder of the results, no cache if None (Default: None)
+    :param cache_size: Maximal size of the cache in bytes (Default: 10 GB)
+    :param cache_partial: Store the partial results of the timed out, out of memory and early stopped runs, and return them on a hit when the timeout, ram_limit, stop_sink_rows and stop_idle of the run are no larger than the ones of the stored run (Default: False)
+    :param preflight: Check the source InChI, the sink and rules files and if the source is in the sink before launching KNIME (Default: True)
+    :param logger: Logger object (Default: None)
+
+    :type source_bytes: bytes
+    :type sink_bytes: bytes
+    :type rules_bytes: bytes
+    :type max_steps: int
+    :type topx: int
+    :type dmin: int
+    :type dmax: int
+    :type mwmax_source: int
+    :type mwmax_cof: int
+    :type timeout: int
+    :type partial_retro: bool
+    :type executor: rp2Executor.RP2Executor
+    :type cpus: int
+    :type on_rows: function
+    :type stop_sink_rows: int
+    :type stop_idle: float
+    :type cache_dir: str
+    :type cache_size: int
+    :type cache_partial: bool
+    :type preflight: bool
+    :type logger: logging
+
+    :rtype: tuple
+    :return: tuple with the status, the message as bytes and the metrics of the run (wall, user and system times, peak RSS, threads and output size, and for a KNIME launch the heap high-water mark and garbage collection pauses)
+    """
+    logger = logging.getLogger(__name__)
+    if preflight:
+        status, message = rp2Preflight.preflight(sink_path, rules_path, source_inchi, cache_dir)
+        if status:
+            logger.error(message)
+            return status, message.encode('utf-8'), None
+    run = functools.partial(_run_rp2,
+                            sink_path,
+                            rules_path,
+                            source_inchi,
+                            results_csv,
+                            max_steps,
+                            source_name,
+                            topx,
+                            dmin,
+                            dmax,
+                            mwmax_source,
+                            mwmax_cof,
+                            timeout,
+                            ram_limit,
+                            partial_retro,
+                            executor,
+                            cpus,
+                            on_rows,
+                            stop_sink_rows,
+                            stop_idle)
+    if not cache_dir:
+        return run()
+    key = rp2_cache_key(cache_dir, sink_path, rules_path, source_inchi, max_steps, source_name, topx, dmin, dmax, mwmax_source, mwmax_cof)
+    if not key:
+        return run()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError as e:
+        logger.warning('Cannot create the RetroPath2.0 cache folder: '+str(e))
+        return run()
+    limits = {'timeout': timeout, 'ram_limit': ram_limit, 'stop_sink_rows': stop_sink_rows, 'stop_idle': stop_idle}
+    #the runs of the same inputs wait for the first one instead of running again
+    with fileCache.lockEntry(cache_dir, key):
+        entry = fileCache.getEntry(cache_dir, key)
+        if entry:
+            try:
+                meta = fileCache.getMeta(entry)
+                #partial results stopped earlier than this run would stop are not returned
+                if not meta['status'] in RP2_CACHE_PARTIAL_STATUSES or (cache_partial and _within_limits(limits, meta.get('limits'))):
+                    shutil.copy(os.path.join(entry, 'results.csv'), results_csv)
+                    logger.debug('Using the cached RetroPath2.0 results '+str(key))
+                    if on_rows:
+                        rp2Results.ResultsTail(results_csv, on_rows)()
+                    metrics = meta['metrics'] or {}
+                    metrics['cached'] = True
+                    return meta['status'], meta['message'].encode('utf-8'), metrics
+            except (OSError, ValueError, KeyError) as e:
+                #the entry has been evicted in the meantime
+                logger.debug('Cannot use the cached RetroPath2.0 results: '+str(e))
+        status, message, metrics = run()
+        if status in RP2_CACHE_STATUSES or (cache_partial and status in RP2_CACHE_PARTIAL_STATUSES):
+            if entry:
+                #replace the partial results of a previous run
+                fileCache.removeEntry(cache_dir, key)
+            fileCache.putEntry(cache_dir,
+                               key,
+                               {'results.csv': results_csv},
+                               {'status': status, 'message': message.decode('utf-8', 'replace'), 'metrics': metrics, 'limits': limits},
+                               max_size=cache_size)
+    return status, message, metrics
+
+
+def _within_limits(limits, cached_limits):
+    """Check that the limits of a run are no larger than the ones of the run of a partial cache entry
+
+    A limit of None is no limit
+
+    :param limits: The limits of the run
+    :param cached_limits: The limits of the run of the cache entry, None if they were not stored
+
+    :type limits: dict
+    :type cached_limits: dict
+
+    :rtype: bool
+    :return: If the partial results of the entry can be returned to the run
+    """
+    if cached_limits is None:
+        return False
+    for name in RP2_CACHE_PARTIAL_LIMITS:
+        if cached_limits.get(name) is None:
+            continue
+        if limits.get(name) is None or limits[name]>cached_limits[name]:
+            return False
+    return True
+
+
+def _target_file_name(name):
+    """Return a file name safe version of a target name
+    """
+    return re.sub(r'[^A-Za-z0-9._-]', '_', name)
+
+
+def _split_results(results_path, names, inchis):
+    """Return the rows of the RetroPath2.0 results for each target
+
+    The rows are assigned on the Initial source column, which holds the name of the source
+
+    :param results_path: Path to the results file
+    :param names: The names of the targets
+    :param inchis: The InChIs of the targets
+
+    :type results_path: str
+    :type names: list
+    :type inchis: list
+
+    :rtype: tuple
+    :return: The header and the dictionnary of the target name to its rows
+    """
+    rows = {i: [] for i in names}
+    inchi_names = {inchi: name for name, inchi in zip(names, inchis)}
+    try:
+        with open(results_path, newline='') as f:
+            reader = csv.reader(f, delimiter=',', quotechar='"')
+            header = next(reader)
+            source_index = header.index('Initial source') if 'Initial source' in header else 0
+            for row in reader:
+                try:
+                    source = row[source_index]
+                except IndexError:
+                    continue
+                if source in rows:
+                    rows[source].append(row)
+                elif source in inchi_names:
+                    rows[inchi_names[source]].append(row)
+    except (OSError, StopIteration):
+        return None, rows
+    return header, rows
+
+
+def _sources_in_sink(source_in_sink_path, names, inchis):
+    """Return the names of the targets found in the sink
+
+    :param source_in_sink_path: Path to the source-in-sink file
+    :param names: The names of the targets
+    :param inchis: The InChIs of the targets
+
+    :type source_in_sink_path: str
+    :type names: list
+    :type inchis: list
+
+    :rtype: set
+    :return: The names of the targets in the sink
+    """
+    in_sink = set()
+    inchi_names = {inchi: name for name, inchi in zip(names, inchis)}
+    names = set(names)
+    with open(source_in_sink_path, newline='') as f:
+        reader = csv.reader(f, delimiter=',', quotechar='"')
+        next(reader, None)
+        for row in reader:
+            for cell in row:
+                if cell in names:
+                    in_sink.add(cell)
+                elif cell in inchi_names:
+                    in_sink.add(inchi_names[cell])
+    return in_sink
+
+
+def run_rp2_batch(sink_path,
+                  rules_path,
+                  targets,
+                  results_dir,
+                  max_steps,
+                  group_size=50,
+                  topx=100,
+                  dmin=0,
+                  dmax=1000,
+                  mwmax_source=1000,
+                  mwmax_cof=1000,
+                  timeout=30,
+                  ram_limit=None,
+                  partial_retro=False,
+                  executor=None,
+                  cpus=None,
+                  preflight=True):
+    """Call the KNIME RetroPath2.0 workflow on many targets, in groups of targets per launch
+
+    Each group is written as a single source file, and the results and source-in-sink files of the group
+    are split back per target on the name of the source. The results of each target are written to
+    <results_dir>/<name>_results.csv
+
+    :param sink_path: Path to the sink file
+    :param rules_path: Path to the rules file
+    :param targets: The targets as (name, InChI)
+    :param results_dir: Path to the folder of the results of the targets
+    :param max_steps: The maximal number of steps
+    :param group_size: The number of targets passed to each KNIME launch (Default: 50)
+    :param topx: The top number of reaction rules to keep at each iteraction (Default: 100)
+    :param dmin: The minimum diameter of the reaction rules (Default: 0)
+    :param dmax: The miximum diameter of the reaction rules (Default: 1000)
+    :param mwmax_source: The maximal molecular weight of the intermediate compound (Default: 1000)
+    :param mwmax_cof: The coefficient of the molecular weight of the intermediate compound (Default: 1000)
+    :param timeout: The timeout of each group in minutes (Default: 30)
+    :param ram_limit: The RAM limit in GB (Default: None)
+    :param partial_retro: Return partial results if the execution is interrupted for any reason (Default: False)
+    :param executor: Pool of warm workers running the workflow, one KNIME launch per group if None (Default: None)
+    :param cpus: The number of CPUs given to the JVM of each KNIME launch, all the CPUs of the host if None (Default: None)
+    :param preflight: Check the targets and files before launching KNIME, the targets that fail are not run (Default: True)
+
+    :type sink_path: str
+    :type rules_path: str
+    :type targets: list
+    :type results_dir: str
+    :type max_steps: int
+    :type group_size: int
+    :type topx: int
+    :type dmin: int
+    :type dmax: int
+    :type mwmax_source: int
+    :type mwmax_cof: int
+    :type timeout: int
+    :type ram_limit: int
+    :type partial_retro: bool
+    :type executor: rp2Executor.RP2Executor
+    :type cpus: int
+    :type preflight: bool
+
+    :rtype: dict
+    :return: Dictionnary of the target name to its status, message and the metrics of its group, or None if the targets are invalid
+    """
+    logger = logging.getLogger(__name__)
+    max_virtual_memory = MAX_VIRTUAL_MEMORY
+    if ram_limit:
+        max_virtual_memory = ram_limit*1000*1024*1024
+        logger.debug('RAM limit: '+str(ram_limit)+' GB')
+    names = [str(i[0]) for i in targets]
+    if len(set(names))<len(names):
+        logger.error('The names of the targets must be unique')
+        return None
+    if len(set([_target_file_name(i) for i in names]))<len(names):
+        logger.error('The names of the targets must be unique once converted to file names')
+        return None
+    os.makedirs(results_dir, exist_ok=True)
+    group_size = max(int(group_size), 1)
+    statuses = {}
+    if preflight:
+        checked = []
+        for name, inchi in targets:
+            status, message = rp2Preflight.preflight(sink_path, rules_path, inchi)
+            if status:
+                logger.warning('Not running the target '+str(name)+': '+str(message))
+                statuses[str(name)] = (status, message.encode('utf-8'), None)
+            else:
+                checked.append((name, inchi))
+        targets = checked
+    for group_start in range(0, len(targets), group_size):
+        group = [(str(name), inchi.replace(' ', '')) for name, inchi in targets[group_start:group_start+group_size]]
+        group_names = [i[0] for i in group]
+        group_inchis = [i[1] for i in group]
+        logger.debug('Running the targets '+str(group_start)+' to '+str(group_start+len(group)-1))
+        with tempfile.TemporaryDirectory() as tmp_output_folder, tempfile.TemporaryDirectory(prefix='knime-') as area_dir:
+            source_path = os.path.join(tmp_output_folder, 'source.csv')
+            with open(source_path, 'w') as fi:
+                csv_writer = csv.writer(fi, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                csv_writer.writerow(['Name', 'InChI'])
+                for name, inchi in group:
+                    csv_writer.writerow([name, inchi])
+            results_path = os.path.join(tmp_output_folder, 'results.csv')
+            source_in_sink_path = os.path.join(tmp_output_folder, 'source-in-sink.csv')
+            variables = workflow_variables(source_path, sink_path, rules_path, tmp_output_folder, max_steps, topx, dmin, dmax, mwmax_source, mwmax_cof)
+            knime_command = build_knime_command(variables, vmargs=jvm_options(max_virtual_memory, cpus, os.path.join(tmp_output_folder, GC_LOG)), knime_areas=rp2Workspace.area_args(area_dir))
+            metrics = None
+            try:
+                result, error, is_time_out, is_mem_error, stopped, metrics = _run_workflow(variables, knime_command, area_dir, timeout, executor, os.path.join(tmp_output_folder, 'knime.log'), max_virtual_memory if ram_limit else None, cpus)
+            except OSError as e:
+                logger.error('Running the RetroPath2.0 Knime program produced an OSError: '+str(e))
+                for name in group_names:
+                    statuses[name] = ('oserror', str('Command: '+str(knime_command)+'\n Error: '+str(e)).encode('utf-8'), metrics)
+                continue
+            except ValueError as e:
+                logger.error('Cannot set the RAM usage limit: '+str(e))
+                for name in group_names:
+                    statuses[name] = ('ramerror', str('Command: '+str(knime_command)+'\n Error: '+str(e)).encode('utf-8'), metrics)
+                continue
+            logger.debug('RetroPath2.0 results message: '+str(result))
+            logger.debug('RetroPath2.0 error message: '+str(error))
+            try:
+                in_sink = _sources_in_sink(source_in_sink_path, group_names, group_inchis)
+            except OSError as e:
+                logger.error('Cannot find source-in-sink.csv file')
+                for name in group_names:
+                    statuses[name] = ('sourceinsinknotfounderror', str('Command: '+str(knime_command)+'\n Error: '+str(e)).encode('utf-8'), metrics)
+                continue
+            header, rows = _split_results(results_path, group_names, group_inchis)
+            if is_time_out:
+                logger.warning('Timeout from retropath2.0 ('+str(timeout)+' minutes) for the targets '+str(group_names))
+            for name in group_names:
+                target_results = os.path.join(results_dir, _target_file_name(name)+'_results.csv')
+                if name in in_sink:
+                    statuses[name] = ('sourceinsinkerror', b'Error: Source found in sink', metrics)
+                    continue
+                if is_time_out or is_mem_error:
+                    error_type = 'timeout' if is_time_out else 'mem'
+                    if rows[name] and partial_retro:
+                        statuses[name] = (error_type+'warning', str('Command: '+str(knime_command)).encode('utf-8'), metrics)
+                    else:
+                        statuses[name] = (error_type+'error', str('Command: '+str(knime_command)).encode('utf-8'), metrics)
+                        continue
+                elif not rows[name]:
+                    statuses[name] = ('noresulterror', str('Command: '+str(knime_command)).encode('utf-8'), metrics)
+                    continue
+                else:
+                    statuses[name] = ('noerror', b'', metrics)
+                with open(target_results, 'w', newline='') as o:
+                    csv_writer = csv.writer(o, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                    csv_writer.writerow(header)
+                    csv_writer.writerows(rows[name])
+    return statuses
+
 
 def main():
     parser = argparse.ArgumentParser('Run RP2')
@@ -228,6 +936,12 @@ def main():
     parser.add_argument('-timeout', type=int, default=30)
     parser.add_argument('-ram_limit', type=int, default=30)
     parser.add_argument('-partial_retro', type=bool, default=False)
+    parser.add_argument('-cpus', type=int, default=None, help='Number of CPUs given to the JVM')
+    parser.add_argument('-stop_sink_rows', type=int, default=None, help='Stop once this number of results rows reach the sink')
+    parser.add_argument('-stop_idle', type=float, default=None, help='Stop when no new results row has been found for this number of minutes')
+    parser.add_argument('-cache_dir', type=str, default=None, help='Cache folder of the results')
+    parser.add_argument('-cache_partial', action='store_true', help='Cache and reuse the partial results')
+    parser.add_argument('-no_preflight', action='store_true', help='Do not check the inputs before launching KNIME')
     params = parser.parse_args()
     run_rp2(sink_path=params.sink_path,
             rules_path=params.rules_path, 
@@ -242,7 +956,59 @@ def main():
             mwmax_cof=params.mwmax_cof,
             timeout=params.timeout,
             ram_limit=params.ram_limit, 
-            partial_retro=params.partial_retro)
+            partial_retro=params.partial_retro,
+            cpus=params.cpus,
+            stop_sink_rows=params.stop_sink_rows,
+            stop_idle=params.stop_idle,
+            cache_dir=params.cache_dir,
+            cache_partial=params.cache_partial,
+            preflight=not params.no_preflight)
+
+
+def main_batch():
+    parser = argparse.ArgumentParser('Run RP2 on many targets')
+    parser.add_argument('-sink_path', type=str, required=True)
+    parser.add_argument('-rules_path', type=str, required=True)
+    parser.add_argument('-targets', type=str, required=True, help='CSV file of the targets with the Name and InChI columns')
+    parser.add_argument('-results_dir', type=str, required=True)
+    parser.add_argument('-max_steps', type=int, default=5)
+    parser.add_argument('-group_size', type=int, default=50, help='Number of targets passed to each KNIME launch')
+    parser.add_argument('-topx', type=int, default=100)
+    parser.add_argument('-dmin', type=int, default=0)
+    parser.add_argument('-dmax', type=int, default=1000)
+    parser.add_argument('-mwmax_source', type=int, default=1000)
+    parser.add_argument('-mwmax_cof', type=int, default=1000)
+    parser.add_argument('-timeout', type=int, default=30)
+    parser.add_argument('-ram_limit', type=int, default=30)
+    parser.add_argument('-partial_retro', type=bool, default=False)
+    parser.add_argument('-cpus', type=int, default=None, help='Number of CPUs given to the JVM of each KNIME launch')
+    params = parser.parse_args()
+    with open(params.targets, newline='') as f:
+        reader = csv.reader(f, delimiter=',', quotechar='"')
+        next(reader)
+        targets = [(row[0], row[1]) for row in reader if len(row)>1]
+    statuses = run_rp2_batch(sink_path=params.sink_path,
+                             rules_path=params.rules_path,
+                             targets=targets,
+                             results_dir=params.results_dir,
+                             max_steps=params.max_steps,
+                             group_size=params.group_size,
+                             topx=params.topx,
+                             dmin=params.dmin,
+                             dmax=params.dmax,
+                             mwmax_source=params.mwmax_source,
+                             mwmax_cof=params.mwmax_cof,
+                             timeout=params.timeout,
+                             ram_limit=params.ram_limit,
+                             partial_retro=params.partial_retro,
+                             cpus=params.cpus)
+    if statuses is None:
+        return
+    with open(os.path.join(params.results_dir, 'status.csv'), 'w', newline='') as o:
+        csv_writer = csv.writer(o, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        csv_writer.writerow(['Name', 'InChI', 'Status'])
+        for name, inchi in targets:
+            csv_writer.writerow([name, inchi, statuses[name][0]])
 
 if __name__ == "__main__":
     main()
@@ -5,85 +5,194 @@ Created on March 7 2019
 @description: Standalone version of RP2paths. Returns bytes to be able to use the same file in REST application
 
 """
-import subprocess
 import resource
 import tempfile
 import glob
+import csv
 import io
 import shutil
 import logging
 import os
 import argparse
 
+import procSupervisor
+import rp2pathsPool
+
 
 MAX_VIRTUAL_MEMORY = 20000 * 1024 * 1024 # 20GB -- define what is the best
 #MAX_VIRTUAL_MEMORY = 20 * 1024 * 1024 # 20GB -- define what is the best
+RP2PATHS_PATH = '/home/rp2paths/'
+RP2PATHS_TIMEOUT = 'TIMEOUT'
+RP2PATHS_MEMORY_ERROR = 'failed to map segment from shared object'
+#raised by the allocations refused by the virtual memory limit once the libraries are loaded
+RP2PATHS_PYTHON_MEMORY_ERROR = 'MemoryError'
+#seconds given to rp2paths to stop by itself after its timeout
+TIMEOUT_GRACE = 60
+#minutes given to rp2paths when no timeout is given
+DEFAULT_TIMEOUT = 30.0
+PATH_ID_COLUMN = 'Path ID'
+TRANSFORMATION_COLUMN = 'Unique ID'
+
+
+def limit_virtual_memory(max_virtual_memory=MAX_VIRTUAL_MEMORY):
+    resource.setrlimit(resource.RLIMIT_AS, (max_virtual_memory, resource.RLIM_INFINITY))
+
+
+def read_pathway_rows(paths_path):
+    """Read the rows of each pathway of a pathways file of rp2paths
+
+    :param paths_path: Path to the pathways
+
+    :type paths_path: str
+
+    :rtype: tuple
+    :return: The header, or None if the file is empty, and the rows of each pathway in the order of the file
+    """
+    with open(paths_path, 'r', newline='') as f:
+        reader = csv.reader(f, delimiter=',', quotechar='"')
+        header = next(reader, None)
+        if not header:
+            return None, []
+        path_index = header.index(PATH_ID_COLUMN)
+        pathways = {}
+        for row in reader:
+            if row:
+                pathways.setdefault(row[path_index], []).append(row)
+    return header, list(pathways.values())
+
+
+def write_pathways(out_paths, header, pathways, max_paths=None):
+    """Write pathways of rp2paths in a canonical order and number them from 1
+
+    The pathways are sorted on their number of steps and then on their sorted transformation IDs, which tell
+    two pathways apart, and the steps of each pathway keep their order. The output does not depend on the
+    order in which rp2paths has enumerated the pathways
+
+    :param out_paths: Path to the output pathways
+    :param header: The header of the pathways file
+    :param pathways: The rows of each pathway
+    :param max_paths: The number of pathways to write, all if None (Default: None)
 
+    :type out_paths: str
+    :type header: list
+    :type pathways: list
+    :type max_paths: int
 
-def limit_virtual_memory():
-    resource.setrlimit(resource.RLIMIT_AS, (MAX_VIRTUAL_MEMORY, resource.RLIM_INFINITY))
+    :rtype: int
+    :return: The number of pathways written
+    """
+    path_index = header.index(PATH_ID_COLUMN)
+    transformation_index = header.index(TRANSFORMATION_COLUMN)
+    pathways = sorted(pathways, key=lambda i: (len(i), sorted([j[transformation_index] for j in i])))
+    if max_paths is not None:
+        pathways = pathways[:max_paths]
+    with open(out_paths, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+        writer.writerow(header)
+        for path_id, rows in enumerate(pathways, 1):
+            for row in rows:
+                writer.writerow(row[:path_index]+[str(path_id)]+row[path_index+1:])
+    return len(pathways)
+
+
+def _copy_pathways(paths_path, out_paths):
+    """Copy the pathways of rp2paths in their canonical order, see write_pathways, or as they are if they cannot be parsed
+    """
+    try:
+        header, pathways = read_pathway_rows(paths_path)
+        if header:
+            write_pathways(out_paths, header, pathways)
+            return
+    except (ValueError, csv.Error) as e:
+        logging.warning('Cannot sort the pathways of rp2paths, copying them as they are: '+str(e))
+    shutil.copy(paths_path, out_paths)
 
 
-def run_rp2paths(rp2_pathways, out_paths='', out_compounds='', timeout=None, ram_limit=None):
+def run_rp2paths(rp2_pathways, out_paths='', out_compounds='', timeout=None, ram_limit=None, pool=None):
     """Make a subprocess call of rp2paths
 
     :param rp2_pathways_bytes: The rp2 pathways file as bytes
-    :param timeout: The timeout of the function in minutes
+    :param timeout: The timeout of the function in minutes, 30 minutes if None and the timeout status at once if not positive
     :param logging: The logging object
+    :param pool: Pool of warm workers running rp2paths in-process, one subprocess per call if None (Default: None)
 
     :type rp2_pathways_bytes: bytes
-    :type timeout: int
+    :type timeout: float
     :type logging: logging
+    :type pool: rp2pathsPool.RP2pathsPool
 
     :rtype: tuple
-    :return: tuple of bytes with the out_paths, the compunds, the status message, the command used
+    :return: tuple with the status, the message as bytes and the metrics of the run (wall, user and system times, peak RSS, threads and output size). The pathways are written in their canonical order, see write_pathways
     """
+    metrics = None
+    max_virtual_memory = MAX_VIRTUAL_MEMORY
     if ram_limit:
-        global MAX_VIRTUAL_MEMORY
-        MAX_VIRTUAL_MEMORY = ram_limit*1000*1024*1024
+        max_virtual_memory = int(ram_limit*1000*1024*1024)
         logging.debug('RAM limit: '+str(ram_limit)+' GB')
     else:
         logging.debug('RAM limit: 20 GB')
-    if not timeout:
-        logging.debug('Setting timeout to 30 min')
-        timeout = 30.0
+    if timeout is None:
+        logging.debug('Setting timeout to '+str(DEFAULT_TIMEOUT)+' min')
+        timeout = DEFAULT_TIMEOUT
+    if timeout<=0:
+        logging.error('No time left to run rp2paths ('+str(timeout)+' minutes)')
+        return 'timeout', str.encode('Error: No time left to run rp2paths'), metrics
+    #the outputs are resolved against the working directory of the caller, rp2paths runs in its own folder
+    if not out_paths:
+        out_paths = os.path.join(os.getcwd(), 'out_paths.csv')
+    if not out_compounds:
+        out_compounds = os.path.join(os.getcwd(), 'compounds.txt')
     with tempfile.TemporaryDirectory() as tmpOutputFolder:
-        os.chdir('/home/rp2paths/')
-        rp2paths_command = 'python3 -m rp2paths all '+str(rp2_pathways)+' --outdir '+str(tmpOutputFolder)+'/ --timeout '+str(int(timeout*60.0))
+        rp2paths_args = ['all', str(os.path.abspath(rp2_pathways)), '--outdir', str(tmpOutputFolder)+'/', '--timeout', str(max(int(timeout*60.0), 1))]
+        rp2paths_command = 'python3 -m rp2paths '+' '.join(rp2paths_args)
         try:
-            commandObj = subprocess.Popen(rp2paths_command.split(' '), stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=limit_virtual_memory)
-            result = ''
-            error = ''
-            result, error = commandObj.communicate()
-            result = result.decode('utf-8')
-            error = error.decode('utf-8')
+            supervised = None
+            if pool:
+                #rp2paths enforces its own timeout, the worker only kills it if it does not stop
+                supervised = pool.submit(rp2paths_args,
+                                         timeout*60.0+TIMEOUT_GRACE,
+                                         max_virtual_memory,
+                                         os.path.join(tmpOutputFolder, 'rp2paths.log'),
+                                         output_dir=tmpOutputFolder,
+                                         patterns=[RP2PATHS_TIMEOUT, RP2PATHS_MEMORY_ERROR, RP2PATHS_PYTHON_MEMORY_ERROR])
+                if supervised is None:
+                    logging.warning('The rp2paths pool is unavailable, running rp2paths once')
+                elif supervised['returncode']==rp2pathsPool.RLIMIT_EXIT:
+                    raise ValueError(supervised['stdout'])
+            if supervised is None:
+                #rp2paths enforces its own timeout, the supervisor only kills it if it does not stop
+                supervised = procSupervisor.run(rp2paths_command.split(' '),
+                                                timeout=timeout*60.0+TIMEOUT_GRACE,
+                                                log_path=os.path.join(tmpOutputFolder, 'rp2paths.log'),
+                                                fatal_patterns=[RP2PATHS_MEMORY_ERROR],
+                                                watch_patterns=[RP2PATHS_TIMEOUT, RP2PATHS_PYTHON_MEMORY_ERROR],
+                                                max_virtual_memory=max_virtual_memory,
+                                                cwd=RP2PATHS_PATH,
+                                                output_dir=tmpOutputFolder)
+            metrics = supervised['metrics']
+            result = supervised['stdout']
+            error = supervised.get('stderr', '')
             #TODO test to see what is the correct phrase
-            if 'TIMEOUT' in result:
+            if RP2PATHS_TIMEOUT in supervised['matched'] or supervised['time_out']:
                 logging.error('Timeout from of ('+str(timeout)+' minutes)')
-                return 'timeout', str.encode('Command: '+str(rp2paths_command)+'\n Error: '+str(error)+'\n tmpOutputFolder: '+str(glob.glob(tmpOutputFolder+'/*')))
-            if 'failed to map segment from shared object' in error:
+                return 'timeout', str.encode('Command: '+str(rp2paths_command)+'\n Error: '+str(error)+'\n tmpOutputFolder: '+str(glob.glob(tmpOutputFolder+'/*'))), metrics
+            if RP2PATHS_MEMORY_ERROR in supervised['matched'] or RP2PATHS_PYTHON_MEMORY_ERROR in supervised['matched']:
                 logging.error('RP2paths does not have sufficient memory to continue')
-                return 'memoryerror', str.encode('Command: '+str(rp2paths_command)+'\n Error: '+str(error)+'\n tmpOutputFolder: '+str(glob.glob(tmpOutputFolder+'/*')))
+                return 'memoryerror', str.encode('Command: '+str(rp2paths_command)+'\n Error: '+str(error)+'\n tmpOutputFolder: '+str(glob.glob(tmpOutputFolder+'/*'))), metrics
             ### convert the result to binary and return ###
             try: 
-                if out_paths:
-                    shutil.copy(os.path.join(tmpOutputFolder, 'out_paths.csv'), out_paths)
-                else:
-                    shutil.copy(os.path.join(tmpOutputFolder, 'out_paths.csv'), os.path.join(os.getcwd(), 'out_paths.csv'))
-                if out_compounds:
-                    shutil.copy(os.path.join(tmpOutputFolder, 'compounds.txt'), out_compounds)
-                else:
-                    shutil.copy(os.path.join(tmpOutputFolder, 'compounds.txt'), os.path.join(os.getcwd(), 'compounds.txt'))
-                return 'noerror', ''
+                _copy_pathways(os.path.join(tmpOutputFolder, 'out_paths.csv'), out_paths)
+                shutil.copy(os.path.join(tmpOutputFolder, 'compounds.txt'), out_compounds)
+                return 'noerror', '', metrics
             except FileNotFoundError as e:
                 logging.error('Cannot find the output files out_paths.csv or compounds.txt')
-                return 'filenotfounderror', str.encode('Command: '+str(rp2paths_command)+'\n Error: '+str(e)+'\n tmpOutputFolder: '+str(glob.glob(tmpOutputFolder+'/*')))
+                return 'filenotfounderror', str.encode('Command: '+str(rp2paths_command)+'\n Error: '+str(e)+'\n tmpOutputFolder: '+str(glob.glob(tmpOutputFolder+'/*'))), metrics
         except OSError as e:
             logging.error('Subprocess detected an error when calling the rp2paths command')
-            return 'oserror', str.encode('Command: '+str(rp2paths_command)+'\n Error: '+str(e)+'\n tmpOutputFolder: '+str(glob.glob(tmpOutputFolder+'/*')))
+            return 'oserror', str.encode('Command: '+str(rp2paths_command)+'\n Error: '+str(e)+'\n tmpOutputFolder: '+str(glob.glob(tmpOutputFolder+'/*'))), metrics
         except ValueError as e:
             logging.error('Cannot set the RAM usage limit')
-            return 'ramerror', str.encode('Command: '+str(rp2paths_command)+'\n Error: '+str(e)+'\n tmpOutputFolder: '+str(glob.glob(tmpOutputFolder+'/*')))
+            return 'ramerror', str.encode('Command: '+str(rp2paths_command)+'\n Error: '+str(e)+'\n tmpOutputFolder: '+str(glob.glob(tmpOutputFolder+'/*'))), metrics
 
 
 def main():
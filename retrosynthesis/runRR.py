@@ -10,103 +10,535 @@ Created on September 21 2019
 import csv
 import io
 import os
-import shutil
+import bz2
+import gzip
+import lzma
+import zlib
 import argparse
 import tarfile
 import tempfile
+import itertools
+import contextlib
+import collections
+import multiprocessing
 
 import logging
 #import logging.config
 #from logsetup import LOGGING_CONFIG
 
+import rrStore
+import rrColumns
+import rrDedup
+import rrScreen
+
 
 #logging.config.dictConfig(LOGGING_CONFIG)
 #logger = logging.getLogger(__name__)
 logger = logging.getLogger(os.path.basename(__file__))
 
-def passRules(output, rules_type='all', diameters=[2,4,6,8,10,12,14,16], output_format='csv'):
+#errors raised when reading a corrupt, truncated or malformed rule file
+RULES_ERRORS = (OSError, EOFError, zlib.error, csv.Error, lzma.LZMAError, tarfile.TarError)
+
+RR_PATH = '/home/retrorules/'
+RULE_FILES = {'all': os.path.join(RR_PATH, 'rules_rall_rp2.csv'),
+              'forward': os.path.join(RR_PATH, 'rules_rall_rp2_forward.csv'),
+              'retro': os.path.join(RR_PATH, 'rules_rall_rp2_retro.csv')}
+RULE_USAGES = {'all': None,
+               'forward': ['both', 'forward'],
+               'retro': ['both', 'retro']}
+RULES_HEADER = ["Rule ID",
+                "Rule",
+                "EC number",
+                "Reaction order",
+                "Diameter",
+                "Score",
+                "Legacy ID",
+                "Reaction direction",
+                "Rule relative direction",
+                "Rule usage",
+                "Score normalized"]
+#columns of the RetroRules TSV files in the order of the CSV columns
+TSV_COLUMNS = ['# Rule_ID',
+               'Rule_SMARTS',
+               'Reaction_EC_number',
+               'Rule_order',
+               'Diameter',
+               'Score',
+               'Legacy_ID',
+               'Reaction_direction',
+               'Rule_relative_direction',
+               'Rule_usage',
+               'Score_normalized']
+#number of lines of the TSV files converted by each task of the process pool
+TSV_CHUNK_LINES = 20000
+OUTPUT_FORMATS = ['csv', 'tar', 'gz', 'xz', 'bz2']
+#default compression level of each codec
+COMPRESSION_LEVELS = {'tar': 9, 'gz': 6, 'xz': 6, 'bz2': 9}
+#number of rule files outside of the store whose columns are kept in memory between calls
+COLUMNS_CACHE_SIZE = 1
+#columns built from the rule files outside of the store, keyed on the file and its version
+_COLUMNS = collections.OrderedDict()
+
+
+def buildRuleStore(store_path=rrStore.RR_STORE_PATH):
+    """One-time build of the diameter shards and byte-offset index of the bundled RetroRules files
+
+    :param store_path: Path to the store folder (Default: /home/retrorules/store/)
+
+    :type store_path: str
+
+    :rtype: bool
+    :return: Success or failure of the function
+    """
+    return rrStore.buildStore(RULE_FILES, store_path)
+
+
+def _validDiameters(diameters):
+    """Return the valid diameters of the input
+
+    :param diameters: The diameters as a list or a comma separated string
+
+    :type diameters: list
+
+    :rtype: list
+    :return: The valid diameters or None if an entry cannot be converted to int
+    """
+    try:
+        valid_diameters = []
+        if isinstance(diameters, str):
+            diameters = [int(i) for i in diameters.split(',')]
+        for i in diameters:
+            if i not in [2,4,6,8,10,12,14,16]:
+                logger.warning('Diameters must be either 2,4,6,8,10,12,14,16. Ignoring entry: '+str(i))
+            else:
+                valid_diameters.append(i) 
+    except ValueError:
+        logger.error('Invalid diamter entry. Must be int of either 2,4,6,8,10,12,14,16')
+        return None
+    return valid_diameters
+
+
+@contextlib.contextmanager
+def _openRules(rule_file):
+    """Open a rule file as a text stream, decompressing it on the fly
+
+    gzip, xz and bz2 files are detected from their magic number. For tar archives (compressed or not),
+    the first CSV or TSV member is streamed out of the archive
+
+    :param rule_file: Path to the rule file
+
+    :type rule_file: str
+
+    :rtype: file
+    :return: Text stream of the rules
+    """
+    with open(rule_file, 'rb') as f:
+        magic = f.read(6)
+    if tarfile.is_tarfile(rule_file):
+        with tarfile.open(rule_file, mode='r:*') as tf:
+            for member in tf:
+                if member.isfile() and (member.name.endswith('.csv') or member.name.endswith('.tsv')):
+                    logger.debug('Reading the rules from the archive member '+str(member.name))
+                    with io.TextIOWrapper(tf.extractfile(member), encoding='utf-8', newline='') as rf:
+                        yield rf
+                    return
+        raise FileNotFoundError('Cannot find a CSV or TSV file in the archive '+str(rule_file))
+    if magic.startswith(b'\x1f\x8b'):
+        rf = gzip.open(rule_file, 'rt', newline='')
+    elif magic.startswith(b'\xfd7zXZ\x00'):
+        rf = lzma.open(rule_file, 'rt', newline='')
+    elif magic.startswith(b'BZh'):
+        rf = bz2.open(rule_file, 'rt', newline='')
+    else:
+        rf = open(rule_file, 'r', newline='')
+    with rf:
+        yield rf
+
+
+@contextlib.contextmanager
+def _openOutput(output, output_format, compression_level=None):
+    """Open the output file as a binary stream compressed with the requested codec
+
+    The csv, gz, xz and bz2 outputs are written directly. Since the members of a tar archive
+    need their size in advance, the tar output is first written to an anonymous temporary file
+
+    :param output: Path to the output file
+    :param output_format: The output format. Valid options: csv, tar, gz, xz, bz2
+    :param compression_level: The compression level of the codec, its default if None (Default: None)
+
+    :type output: str
+    :type output_format: str
+    :type compression_level: int
+
+    :rtype: file
+    :return: Binary file object to write the rules to
+    """
+    if compression_level is None and output_format in COMPRESSION_LEVELS:
+        compression_level = COMPRESSION_LEVELS[output_format]
+    if output_format=='tar':
+        with tempfile.TemporaryFile() as tmp_f:
+            yield tmp_f
+            info = tarfile.TarInfo('Rules.csv')
+            info.size = tmp_f.tell()
+            tmp_f.seek(0)
+            with tarfile.open(output, mode='w:gz', compresslevel=compression_level) as ot:
+                ot.addfile(tarinfo=info, fileobj=tmp_f)
+        return
+    elif output_format=='gz':
+        o = gzip.open(output, 'wb', compresslevel=compression_level)
+    elif output_format=='xz':
+        o = lzma.open(output, 'wb', preset=compression_level)
+    elif output_format=='bz2':
+        o = bz2.open(output, 'wb', compresslevel=compression_level)
+    else:
+        o = open(output, 'wb')
+    with o:
+        yield o
+
+
+def _writeOutput(output, output_format, write_rules, compression_level=None):
+    """Stream the rules into the output file with the requested codec
+
+    :param output: Path to the output file
+    :param output_format: The output format. Valid options: csv, tar, gz, xz, bz2
+    :param write_rules: Function writing the rules to a binary file object and returning its success
+    :param compression_level: The compression level of the codec, its default if None (Default: None)
+
+    :type output: str
+    :type output_format: str
+    :type write_rules: function
+    :type compression_level: int
+
+    :rtype: bool
+    :return: Success or failure of the function
+    """
+    if not output_format in OUTPUT_FORMATS:
+        logger.error('Cannot detect the output_format: '+str(output_format))
+        return False
+    status = False
+    try:
+        with _openOutput(output, output_format, compression_level) as o:
+            status = write_rules(o)
+    except RULES_ERRORS as e:
+        logger.error('Cannot write the rules to '+str(output)+': '+str(e))
+        status = False
+    if not status and os.path.exists(output):
+        os.remove(output)
+    return status
+
+
+def _tsvRows(in_f):
+    """Return the rows of a RetroRules TSV file in the order of the CSV columns
+
+    :param in_f: Text stream of the TSV rules
+
+    :type in_f: file
+
+    :rtype: generator
+    :return: The rows as lists
+    """
+    for row in csv.DictReader(in_f, delimiter='\t'):
+        yield [row[i] for i in TSV_COLUMNS]
+
+
+def _convertTSVChunk(lines, tsv_indices, diameters, usages):
+    """Convert a chunk of lines of a RetroRules TSV file to CSV rows
+
+    :param lines: The lines of the chunk
+    :param tsv_indices: The indices of the TSV columns in the order of the CSV columns
+    :param diameters: The diameters to return
+    :param usages: The rule usages to return, all if None
+
+    :type lines: list
+    :type tsv_indices: list
+    :type diameters: list
+    :type usages: list
+
+    :rtype: tuple
+    :return: The CSV rows encoded in utf-8, the number of rows written and the number of bad rows
+    """
+    out = io.StringIO()
+    out_csv = csv.writer(out, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+    count = 0
+    bad_rows = 0
+    for row in csv.reader(lines, delimiter='\t'):
+        if not row:
+            continue
+        try:
+            row = [row[i] for i in tsv_indices]
+            diameter = int(row[4])
+        except (ValueError, IndexError):
+            bad_rows += 1
+            continue
+        if diameter in diameters and (usages is None or row[9] in usages):
+            out_csv.writerow(row)
+            count += 1
+    return out.getvalue().encode('utf-8'), count, bad_rows
+
+
+def _writeTSV(o, in_f, diameters, usages=None, processes=None, chunk_lines=TSV_CHUNK_LINES):
+    """Convert a RetroRules TSV file to CSV in a pool of processes
+
+    The file is split on line boundaries into chunks that are converted in parallel and written
+    back in the order of the input. Rows with an invalid diameter are counted and skipped
+
+    :param o: Binary file object to write to
+    :param in_f: Text stream of the TSV rules
+    :param diameters: The diameters to return
+    :param usages: The rule usages to return, all if None (Default: None)
+    :param processes: The number of processes, the number of CPUs if None (Default: None)
+    :param chunk_lines: The number of lines per chunk (Default: 20000)
+
+    :type o: file
+    :type in_f: file
+    :type diameters: list
+    :type usages: list
+    :type processes: int
+    :type chunk_lines: int
+
+    :rtype: bool
+    :return: Success or failure of the function
+    """
+    header = next(csv.reader([in_f.readline()], delimiter='\t'), [])
+    try:
+        tsv_indices = [header.index(i) for i in TSV_COLUMNS]
+    except ValueError as e:
+        logger.error('Missing column in the TSV header: '+str(e))
+        return False
+    o.write(rrColumns.csvLine(RULES_HEADER))
+    count = 0
+    bad_rows = 0
+    def _chunks():
+        while True:
+            lines = list(itertools.islice(in_f, chunk_lines))
+            if not lines:
+                return
+            yield lines
+    if processes==1:
+        for lines in _chunks():
+            chunk, chunk_count, chunk_bad_rows = _convertTSVChunk(lines, tsv_indices, diameters, usages)
+            o.write(chunk)
+            count += chunk_count
+            bad_rows += chunk_bad_rows
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            #bound the number of chunks in memory
+            max_pending = 2*(processes or os.cpu_count() or 1)
+            pending = collections.deque()
+            for lines in _chunks():
+                pending.append(pool.apply_async(_convertTSVChunk, (lines, tsv_indices, diameters, usages)))
+                while len(pending)>=max_pending or (pending and pending[0].ready()):
+                    chunk, chunk_count, chunk_bad_rows = pending.popleft().get()
+                    o.write(chunk)
+                    count += chunk_count
+                    bad_rows += chunk_bad_rows
+            while pending:
+                chunk, chunk_count, chunk_bad_rows = pending.popleft().get()
+                o.write(chunk)
+                count += chunk_count
+                bad_rows += chunk_bad_rows
+    if bad_rows:
+        logger.warning('Skipped '+str(bad_rows)+' rows with an invalid diameter or missing columns')
+    logger.debug('Converted '+str(count)+' rules')
+    return True
+
+
+def _loadColumns(store_type, rule_file=None, input_format='csv'):
+    """Return the columnar representation of the rules
+
+    The columns are memory mapped from the store when possible, or else built in memory from the rule file and
+    kept for the next calls until the file changes. As the scan of the rule files, the CSV rules fail on a row
+    with an invalid diameter and the TSV rules skip it
+
+    :param store_type: The rule type key of the store entry, or None
+    :param rule_file: Path to the rule file (Default: None)
+    :param input_format: The input file format. Valid options: csv, tsv. (Default: csv)
+
+    :type store_type: str
+    :type rule_file: str
+    :type input_format: str
+
+    :rtype: dict
+    :return: The columns or None if the rule file cannot be read
+    """
+    if store_type:
+        columns = rrColumns.load(rrStore.columnsPath(store_type))
+        if columns:
+            return columns
+    try:
+        stat = os.stat(rule_file)
+        key = (os.path.realpath(rule_file), stat.st_ino, stat.st_size, stat.st_mtime, input_format)
+        if key in _COLUMNS:
+            _COLUMNS.move_to_end(key)
+            return _COLUMNS[key]
+        logger.debug('Building the rule columns from '+str(rule_file))
+        with _openRules(rule_file) as in_f:
+            if input_format=='tsv':
+                columns = rrColumns.fromRows(RULES_HEADER, _tsvRows(in_f), skip_bad_rows=True)
+            else:
+                rf_csv = csv.reader(in_f)
+                columns = rrColumns.fromRows(next(rf_csv), rf_csv)
+    except RULES_ERRORS+(ValueError, KeyError, StopIteration) as e:
+        logger.error('Cannot read the rules of '+str(rule_file)+': '+str(e))
+        return None
+    _COLUMNS[key] = columns
+    while len(_COLUMNS)>COLUMNS_CACHE_SIZE:
+        _COLUMNS.popitem(last=False)
+    return columns
+
+
+def _screenMask(columns, store_type, screen_inchi, screen_mode='target', screen_steps=1):
+    """Return the mask of the rules that can fire on the source molecule
+
+    The screening index is memory mapped from the store when possible, or else built in memory from the columns
+
+    :param columns: The columns of the rules
+    :param store_type: The rule type key of the store entry, or None
+    :param screen_inchi: The InChI of the source molecule
+    :param screen_mode: The screening mode. Valid options: target, conservative. (Default: target)
+    :param screen_steps: The maximal number of steps of the search (Default: 1)
+
+    :type columns: dict
+    :type store_type: str
+    :type screen_inchi: str
+    :type screen_mode: str
+    :type screen_steps: int
+
+    :rtype: numpy.ndarray
+    :return: The boolean mask of the rules or None if the screening failed
+    """
+    screen = None
+    if store_type:
+        screen = rrScreen.load(rrStore.screenPath(store_type), len(columns['diameter']))
+    if not screen:
+        logger.debug('Building the rule screening index')
+        screen = rrScreen.fromColumns(columns)
+    return rrScreen.screenMask(columns, screen, screen_inchi, screen_mode, screen_steps)
+
+
+def _writeColumns(o, columns, diameters, usages=None, min_score=None, ec_prefixes=None, topn=None, mask=None):
+    """Filter the rules with vectorized masks over the columns and write them
+
+    :param o: Binary file object to write to
+    :param columns: The columns of the rules
+    :param diameters: The diameters to return
+    :param usages: The rule usages to return, all if None (Default: None)
+    :param min_score: The minimal normalized score of the rules (Default: None)
+    :param ec_prefixes: The EC number prefixes of the rules (Default: None)
+    :param topn: The number of rules with the best normalized score to keep per diameter (Default: None)
+    :param mask: Boolean mask of the rules to consider, all if None (Default: None)
+
+    :type o: file
+    :type columns: dict
+    :type diameters: list
+    :type usages: list
+    :type min_score: float
+    :type ec_prefixes: list
+    :type topn: int
+    :type mask: numpy.ndarray
+
+    :rtype: bool
+    :return: Success or failure of the function
+    """
+    if isinstance(ec_prefixes, str):
+        ec_prefixes = ec_prefixes.split(',')
+    indices = rrColumns.select(columns, diameters, usages, min_score, ec_prefixes, topn, mask)
+    logger.debug('Selected '+str(len(indices))+' rules out of '+str(len(columns['diameter'])))
+    return rrColumns.writeRows(o, columns, indices)
+
+
+def passRules(output, rules_type='all', diameters=[2,4,6,8,10,12,14,16], output_format='csv', compression_level=None, min_score=None, ec_prefixes=None, topn=None, screen_inchi=None, screen_mode='target', screen_steps=1):
     """Parse the input file and return the reactions rules at the appropriate diameters
 
     :param output: Path to the output file
     :param rules_type: The rule type to return. Valid options: all, forward, retro. (Default: all)
     :param diameters: The diameters to return. Valid options: 2,4,6,8,10,12,14,16. (Default: [2,4,6,8,10,12,14,16])
-    :param output_format: The output format. Valid options: csv, tar. (Default: csv)
+    :param output_format: The output format. Valid options: csv, tar, gz, xz, bz2. (Default: csv)
+    :param compression_level: The compression level of the output, the default of the codec if None (Default: None)
+    :param min_score: The minimal normalized score of the rules (Default: None)
+    :param ec_prefixes: The EC number prefixes of the rules, for example 1.1 or 2.7.1 (Default: None)
+    :param topn: The number of rules with the best normalized score to keep per diameter (Default: None)
+    :param screen_inchi: The InChI of the source molecule to screen the rules against, no screening if None (Default: None)
+    :param screen_mode: The screening mode. Valid options: target, conservative. (Default: target)
+    :param screen_steps: The maximal number of steps of the search, used by the conservative screening (Default: 1)
 
     :type output: str 
     :type rules_type: str
     :type diameters: list
     :type output_format: str
+    :type compression_level: int
+    :type min_score: float
+    :type ec_prefixes: list
+    :type topn: int
+    :type screen_inchi: str
+    :type screen_mode: str
+    :type screen_steps: int
 
     :rtype: bool
     :return: Success or failure of the function
     """
     logger.debug('Parsing the rules diamters '+str(diameters)+' for type '+str(rules_type)+' with output '+str(output_format)) 
-    rule_file = None
-    if rules_type=='all':
-        rule_file = '/home/retrorules/rules_rall_rp2.csv' 
-    elif rules_type=='forward':
-        rule_file = '/home/retrorules/rules_rall_rp2_forward.csv'
-    elif rules_type=='retro':
-        rule_file = '/home/retrorules/rules_rall_rp2_retro.csv'
-    else:
+    if not rules_type in RULE_FILES:
         logger.error('Cannot detect input: '+str(rules_type))
         return False
+    rule_file = RULE_FILES[rules_type]
     #check the input diameters are valid #
-    try:
-        valid_diameters = []
-        if isinstance(diameters, str):
-            s_diameters = [int(i) for i in diameters.split(',')]
-            for i in s_diameters:
-                if i not in [2,4,6,8,10,12,14,16]:
-                    logger.warning('Diameters must be either 2,4,6,8,10,12,14,16. Ignoring entry: '+str(i))
-                else:
-                    valid_diameters.append(i)
-        else:
-            for i in diameters:
-                if i not in [2,4,6,8,10,12,14,16]:
-                    logger.warning('Diameters must be either 2,4,6,8,10,12,14,16. Ignoring entry: '+str(i))
-                else:
-                    valid_diameters.append(i) 
-    except ValueError:
-        logger.error('Invalid diamter entry. Must be int of either 2,4,6,8,10,12,14,16')
+    valid_diameters = _validDiameters(diameters)
+    if valid_diameters is None:
         return False
-    ##### create temp file to write ####
-    with tempfile.TemporaryDirectory() as tmp_output_folder:
-        outfile_path = os.path.join(tmp_output_folder, 'tmp_rules.csv')
+    store_type = rrStore.findSource(rules_type=rules_type)
+    def _write(o):
+        if not (min_score is None and ec_prefixes is None and topn is None and screen_inchi is None):
+            columns = _loadColumns(store_type, rule_file)
+            if columns is None:
+                return False
+            mask = None
+            if screen_inchi:
+                mask = _screenMask(columns, store_type, screen_inchi, screen_mode, screen_steps)
+                if mask is None:
+                    return False
+            return _writeColumns(o, columns, valid_diameters, None, min_score, ec_prefixes, topn, mask)
+        if store_type:
+            logger.debug('Assembling the rules from the store')
+            return rrStore.writeRules(o, store_type, valid_diameters)
         with open(rule_file, 'r') as rf:
-            with open(outfile_path, 'w') as o:
-                rf_csv = csv.reader(rf)
-                o_csv = csv.writer(o, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
-                o_csv.writerow(next(rf_csv))
-                for row in rf_csv:
-                    try:
-                        if int(row[4]) in valid_diameters:
-                            o_csv.writerow(row)
-                    except ValueError:
-                        logger.error('Cannot convert diameter to integer: '+str(row[4]))
-                        return False
-        if output_format=='tar':
-            with tarfile.open(output, mode='w:gz') as ot:
-                info = tarfile.TarInfo('Rules.csv')
-                info.size = os.path.getsize(outfile_path)
-                ot.addfile(tarinfo=info, fileobj=open(outfile_path, 'rb'))
-        elif output_format=='csv':
-            shutil.copy(outfile_path, output)
-        else:
-            logger.error('Cannot detect the output_format: '+str(output_format))
-            return False
-    return True
+            o_text = io.TextIOWrapper(o, encoding='utf-8', newline='')
+            rf_csv = csv.reader(rf)
+            o_csv = csv.writer(o_text, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+            o_csv.writerow(next(rf_csv))
+            for row in rf_csv:
+                try:
+                    if int(row[4]) in valid_diameters:
+                        o_csv.writerow(row)
+                except (ValueError, IndexError):
+                    logger.error('Cannot convert diameter to integer: '+str(row[4:5]))
+                    return False
+            o_text.flush()
+            o_text.detach()
+        return True
+    return _writeOutput(output, output_format, _write, compression_level)
 
 
-def parseRules(rule_file, output, rules_type='all', diameters=[2,4,6,8,10,12,14,16], input_format='csv', output_format='csv'):
+def parseRules(rule_file, output, rules_type='all', diameters=[2,4,6,8,10,12,14,16], input_format='csv', output_format='csv', compression_level=None, min_score=None, ec_prefixes=None, topn=None, processes=None, screen_inchi=None, screen_mode='target', screen_steps=1):
     """Parse the rules if a user inputs it as a file
 
+    The rule file may be plain, compressed (gz, xz, bz2) or a tar archive containing the rules. TSV files
+    are converted in chunks by a pool of processes, skipping the rows with an invalid diameter
+
     :param rule_file: Path to the rule file
     :param output: Path to the output file
     :param rules_type: The rule type to return. Valid options: all, forward, retro. (Default: all)
     :param diameters: The diameters to return. Valid options: 2,4,6,8,10,12,14,16. (Default: [2,4,6,8,10,12,14,16])
-    :param intput_format: The input file format. Valid options: csv, tar. (Default: csv)
-    :param output_format: The output format. Valid options: csv, tar. (Default: csv)
+    :param intput_format: The input file format. Valid options: csv, tsv, tar. (Default: csv)
+    :param output_format: The output format. Valid options: csv, tar, gz, xz, bz2. (Default: csv)
+    :param compression_level: The compression level of the output, the default of the codec if None (Default: None)
+    :param min_score: The minimal normalized score of the rules (Default: None)
+    :param ec_prefixes: The EC number prefixes of the rules, for example 1.1 or 2.7.1 (Default: None)
+    :param topn: The number of rules with the best normalized score to keep per diameter (Default: None)
+    :param processes: The number of processes converting the TSV files, the number of CPUs if None (Default: None)
+    :param screen_inchi: The InChI of the source molecule to screen the rules against, no screening if None (Default: None)
+    :param screen_mode: The screening mode. Valid options: target, conservative. (Default: target)
+    :param screen_steps: The maximal number of steps of the search, used by the conservative screening (Default: 1)
 
     :type rule_file: str 
     :type output: str 
@@ -114,98 +546,158 @@ def parseRules(rule_file, output, rules_type='all', diameters=[2,4,6,8,10,12,14,
     :type diameters: list
     :type input_format: str
     :type output_format: str
+    :type compression_level: int
+    :type min_score: float
+    :type ec_prefixes: list
+    :type topn: int
+    :type processes: int
+    :type screen_inchi: str
+    :type screen_mode: str
+    :type screen_steps: int
 
     :rtype: bool
     :return: Success or failure of the function
     """
     #check the input diameters are valid #
-    try:
-        valid_diameters = []
-        if isinstance(diameters, str):
-            s_diameters = [int(i) for i in diameters.split(',')]
-            for i in s_diameters:
-                if i not in [2,4,6,8,10,12,14,16]:
-                    logger.warning('Diameters must be either 2,4,6,8,10,12,14,16. Ignoring entry: '+str(i))
-                else:
-                    valid_diameters.append(i)
-        else:
-            for i in diameters:
-                if i not in [2,4,6,8,10,12,14,16]:
-                    logger.warning('Diameters must be either 2,4,6,8,10,12,14,16. Ignoring entry: '+str(i))
-                else:
-                    valid_diameters.append(i) 
-    except ValueError:
-        logger.error('Invalid diamter entry. Must be int of either 2,4,6,8,10,12,14,16')
+    valid_diameters = _validDiameters(diameters)
+    if valid_diameters is None:
+        return False
+    #a tar input contains CSV rules
+    if input_format=='tar':
+        input_format = 'csv'
+    store_type = None
+    if input_format=='csv':
+        store_type = rrStore.findSource(rule_file=rule_file)
+    elif not input_format=='tsv':
+        logger.error('Can only have input formats of TSV or CSV')
         return False
-    ##### create temp file to write ####
-    with tempfile.TemporaryDirectory() as tmp_output_folder:
-        ##### parse the input ######
-        outfile_path = os.path.join(tmp_output_folder, 'tmp_rules.csv')
+    ##### parse the input ######
+    def _write(o):
+        if not (min_score is None and ec_prefixes is None and topn is None and screen_inchi is None):
+            columns = _loadColumns(store_type, rule_file, input_format)
+            if columns is None:
+                return False
+            mask = None
+            if screen_inchi:
+                mask = _screenMask(columns, store_type, screen_inchi, screen_mode, screen_steps)
+                if mask is None:
+                    return False
+            return _writeColumns(o, columns, valid_diameters, RULE_USAGES.get(rules_type), min_score, ec_prefixes, topn, mask)
+        if store_type:
+            logger.debug('Assembling the rules from the store')
+            return rrStore.writeRules(o, store_type, valid_diameters, RULE_USAGES.get(rules_type))
         if input_format=='tsv':
-            with open(rule_file, 'r') as in_f:
-                with open(outfile_path, 'w') as out_f:
-                    out_csv = csv.writer(out_f, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
-                    out_csv.writerow([
-                        "Rule ID",
-                        "Rule",
-                        "EC number",
-                        "Reaction order",
-                        "Diameter",
-                        "Score",
-                        "Legacy ID",
-                        "Reaction direction",
-                        "Rule relative direction",
-                        "Rule usage",
-                        "Score normalized"])
-                    for row in csv.DictReader(in_f, delimiter='\t'):
-                        try:
-                            if int(row['Diameter']) in valid_diameters:
-                                if rules_type=='all' or (rules_type=='retro' and (row['Rule_usage']=='both' or row['Rule_usage']=='retro')) or (rules_type=='forward' and (row['Rule_usage']=='both' or row['Rule_usage']=='forward')):
-                                    out_csv.writerow([
-                                        row['# Rule_ID'],
-                                        row['Rule_SMARTS'],
-                                        row['Reaction_EC_number'],
-                                        row['Rule_order'],
-                                        row['Diameter'],
-                                        row['Score'],
-                                        row['Legacy_ID'],
-                                        row['Reaction_direction'],
-                                        row['Rule_relative_direction'],
-                                        row['Rule_usage'],
-                                        row['Score_normalized']])
-                        except ValueError:
-                            #TODO: consider changing this to warning and passing to the next row
-                            logger.error('Cannot convert diameter to integer: '+str(row['Diameter']))
-                            return False
-        elif input_format=='csv':
-            with open(rule_file, 'r') as rf:
-                with open(outfile_path, 'w') as o:
-                    rf_csv = csv.reader(rf)
-                    o_csv = csv.writer(o, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
-                    o_csv.writerow(next(rf_csv))
-                    for row in rf_csv:
-                        try:
-                            if int(row[4]) in valid_diameters:
-                                if rules_type=='all' or (rules_type=='retro' and (row[9]=='both' or row[9]=='retro')) or (rules_type=='forward' and (row[9]=='both' or row[9]=='forward')):
-                                    o_csv.writerow(row)
-                        except ValueError:
-                            logger.error('Cannot convert diameter to integer: '+str(row[4]))
-                            return False
-        else:
-            logger.error('Can only have input formats of TSV or CSV')
+            with _openRules(rule_file) as in_f:
+                return _writeTSV(o, in_f, valid_diameters, RULE_USAGES.get(rules_type), processes)
+        o_text = io.TextIOWrapper(o, encoding='utf-8', newline='')
+        out_csv = csv.writer(o_text, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+        with _openRules(rule_file) as in_f:
+            rf_csv = csv.reader(in_f)
+            out_csv.writerow(next(rf_csv))
+            for row in rf_csv:
+                try:
+                    if int(row[4]) in valid_diameters:
+                        if rules_type=='all' or (rules_type=='retro' and (row[9]=='both' or row[9]=='retro')) or (rules_type=='forward' and (row[9]=='both' or row[9]=='forward')):
+                            out_csv.writerow(row)
+                except (ValueError, IndexError):
+                    logger.error('Cannot convert diameter to integer: '+str(row[4:5]))
+                    return False
+        o_text.flush()
+        o_text.detach()
+        return True
+    return _writeOutput(output, output_format, _write, compression_level)
+
+
+def exportRules(specs, rule_file=None, input_format='csv'):
+    """Write several rule subsets reading the source rules once
+
+    Each row of the source file is routed to every output whose rule type and diameters it matches.
+    The rule type is selected using the rule usage of the rows, as for parseRules. If the source is
+    in the rule store, the subsets are assembled from the shards instead. As for parseRules, the
+    export fails on a CSV row with an invalid diameter, and skips it in a TSV file
+
+    :param specs: List of dictionnaries with the keys rules_type, diameters, output, output_format and optionally compression_level
+    :param rule_file: Path to the rule file, the bundled rules of all types if None (Default: None)
+    :param input_format: The input file format. Valid options: csv, tsv, tar. (Default: csv)
+
+    :type specs: list
+    :type rule_file: str
+    :type input_format: str
+
+    :rtype: bool
+    :return: Success or failure of the function
+    """
+    if not rule_file:
+        rule_file = RULE_FILES['all']
+    if input_format=='tar':
+        input_format = 'csv'
+    if not input_format in ['csv', 'tsv']:
+        logger.error('Can only have input formats of TSV or CSV')
+        return False
+    filters = []
+    for spec in specs:
+        if not spec.get('rules_type', 'all') in RULE_USAGES:
+            logger.error('Cannot detect input: '+str(spec.get('rules_type')))
             return False
-        ##### build the output #####
-        if output_format=='tar':
-            with tarfile.open(output, mode='w:gz') as ot:
-                info = tarfile.TarInfo('Rules.csv')
-                info.size = os.path.getsize(outfile_path)
-                ot.addfile(tarinfo=info, fileobj=open(outfile_path, 'rb'))
-        elif output_format=='csv':
-            shutil.copy(outfile_path, output)
-        else:
-            logger.error('Cannot detect the output_format: '+str(output_format))
+        if not spec.get('output_format', 'csv') in OUTPUT_FORMATS:
+            logger.error('Cannot detect the output_format: '+str(spec.get('output_format')))
             return False
-    return True
+        valid_diameters = _validDiameters(spec.get('diameters', [2,4,6,8,10,12,14,16]))
+        if valid_diameters is None:
+            return False
+        filters.append((valid_diameters, RULE_USAGES[spec.get('rules_type', 'all')]))
+    store_type = None
+    if input_format=='csv':
+        store_type = rrStore.findSource(rule_file=rule_file)
+    status = False
+    try:
+        with contextlib.ExitStack() as stack:
+            outputs = [stack.enter_context(_openOutput(spec['output'], spec.get('output_format', 'csv'), spec.get('compression_level'))) for spec in specs]
+            if store_type:
+                logger.debug('Assembling the rules from the store')
+                status = all([rrStore.writeRules(o, store_type, diameters, usages) for o, (diameters, usages) in zip(outputs, filters)])
+            else:
+                line = io.StringIO()
+                line_csv = csv.writer(line, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+                bad_rows = 0
+                with _openRules(rule_file) as in_f:
+                    if input_format=='tsv':
+                        header = RULES_HEADER
+                        rows = _tsvRows(in_f)
+                    else:
+                        rows = csv.reader(in_f)
+                        header = next(rows)
+                    header = rrColumns.csvLine(header)
+                    for o in outputs:
+                        o.write(header)
+                    for row in rows:
+                        try:
+                            diameter = int(row[4])
+                            usage = row[9]
+                        except (ValueError, IndexError):
+                            if not input_format=='tsv':
+                                raise ValueError('Invalid diameter or missing columns in the row '+str(row))
+                            bad_rows += 1
+                            continue
+                        line.seek(0)
+                        line.truncate()
+                        for o, (diameters, usages) in zip(outputs, filters):
+                            if diameter in diameters and (usages is None or usage in usages):
+                                if not line.tell():
+                                    line_csv.writerow(row)
+                                    row_bytes = line.getvalue().encode('utf-8')
+                                o.write(row_bytes)
+                if bad_rows:
+                    logger.warning('Skipped '+str(bad_rows)+' rows with an invalid diameter or missing columns')
+                status = True
+    except RULES_ERRORS+(KeyError, ValueError, StopIteration) as e:
+        logger.error('Cannot export the rules: '+str(e))
+        status = False
+    if not status:
+        for spec in specs:
+            if os.path.exists(spec['output']):
+                os.remove(spec['output'])
+    return status
 
 
 def main():
@@ -214,21 +706,68 @@ def main():
     parser.add_argument('-rules_file', type=str, default='None')
     parser.add_argument('-output', type=str)
     parser.add_argument('-diameters', type=str, default='2,4,6,8,10,12,14,16')
-    parser.add_argument('-output_format', type=str, default='csv', choices=['csv', 'tar'])
-    parser.add_argument('-input_format', type=str, default='csv', choices=['csv', 'tsv'])
+    parser.add_argument('-output_format', type=str, default='csv', choices=OUTPUT_FORMATS)
+    parser.add_argument('-compression_level', type=int, default=None)
+    parser.add_argument('-input_format', type=str, default='csv', choices=['csv', 'tsv', 'tar'])
+    parser.add_argument('-min_score', type=float, default=None, help='Minimal normalized score of the rules')
+    parser.add_argument('-ec_prefixes', type=str, default=None, help='Comma separated EC number prefixes of the rules')
+    parser.add_argument('-topn', type=int, default=None, help='Number of rules with the best normalized score to keep per diameter')
+    parser.add_argument('-processes', type=int, default=None, help='Number of processes converting the TSV rules')
+    parser.add_argument('-export', type=str, action='append', default=None, help='Write a rule subset reading the rules once, as rules_type:diameters:output[:output_format]. Can be repeated')
+    parser.add_argument('-screen_inchi', type=str, default=None, help='Only keep the rules that can fire on the source molecule with this InChI')
+    parser.add_argument('-screen_mode', type=str, default='target', choices=rrScreen.SCREEN_MODES)
+    parser.add_argument('-screen_steps', type=int, default=1, help='Maximal number of steps of the search, for the conservative screening')
+    parser.add_argument('-dedup', action='store_true', help='Merge the rules with the same canonical SMARTS and rule usage (csv output only)')
+    parser.add_argument('-dedup_mapping', type=str, default=None, help='Output file mapping the kept rules to their merged duplicates')
+    parser.add_argument('-build_store', action='store_true', help='Build the diameter shards of the bundled rules and exit')
+    parser.add_argument('-store_path', type=str, default=rrStore.RR_STORE_PATH)
     params = parser.parse_args()
-    if params.rules_file=='None' or params.rules_file==None:
-        passRules(params.output, 
-                  params.rules_type, 
-                  [int(i) for i in params.diameters.split(',')], 
-                  params.output_format)
+    if params.build_store:
+        buildRuleStore(params.store_path)
+    elif params.export:
+        specs = []
+        for export in params.export:
+            spec = export.split(':')
+            specs.append({'rules_type': spec[0],
+                          'diameters': spec[1],
+                          'output': spec[2],
+                          'output_format': spec[3] if len(spec)>3 else 'csv',
+                          'compression_level': params.compression_level})
+        exportRules(specs,
+                    None if params.rules_file=='None' else params.rules_file,
+                    params.input_format)
+    elif params.rules_file=='None' or params.rules_file==None:
+        rr_status = passRules(params.output,
+                              params.rules_type,
+                              [int(i) for i in params.diameters.split(',')],
+                              params.output_format,
+                              compression_level=params.compression_level,
+                              min_score=params.min_score,
+                              ec_prefixes=params.ec_prefixes,
+                              topn=params.topn,
+                              screen_inchi=params.screen_inchi,
+                              screen_mode=params.screen_mode,
+                              screen_steps=params.screen_steps)
     else:
-        parseRules(params.rules_file,
-                   params.output, 
-                   params.rules_type, 
-                   [int(i) for i in params.diameters.split(',')], 
-                   params.input_format, 
-                   params.output_format)
+        rr_status = parseRules(params.rules_file,
+                               params.output,
+                               params.rules_type,
+                               [int(i) for i in params.diameters.split(',')],
+                               params.input_format,
+                               params.output_format,
+                               compression_level=params.compression_level,
+                               min_score=params.min_score,
+                               ec_prefixes=params.ec_prefixes,
+                               topn=params.topn,
+                               processes=params.processes,
+                               screen_inchi=params.screen_inchi,
+                               screen_mode=params.screen_mode,
+                               screen_steps=params.screen_steps)
+    if params.dedup and not params.build_store and not params.export and rr_status:
+        if not params.output_format=='csv':
+            logger.warning('Cannot deduplicate the rules with the output format '+str(params.output_format))
+        else:
+            rrDedup.dedupRules(params.output, params.output, params.dedup_mapping)
 
 if __name__ == "__main__":
     main()
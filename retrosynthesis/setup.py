@@ -19,7 +19,11 @@ setup(
             'rppipeline = retroPipeline:main',
             'retrorules = runRR:main',
             'runRP2paths = runRP2paths:main',
+            'rp2pathsShards = rp2pathsShards:main',
+            'rp2Database = rp2Database:main',
+            'rp2pathsRanking = rp2pathsRanking:main',
             'runRP2 = runRP2:main',
+            'runRP2batch = runRP2:main_batch',
         ]
     },
 )
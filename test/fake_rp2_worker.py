@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the RetroPath2.0 executor workflow, following the inbox/outbox/heartbeat protocol of rp2Executor
+
+Usage: fake_rp2_worker.py <jobs_dir> [fail|hang]
+
+Each start is appended to the starts.txt file of the parent folder of the jobs folder. The job is read from the
+fake.action workflow variable: done, error, sleep:<seconds> or die. A job with a source file writes one results row
+for each of its sources, except the sources named insink*, written to source-in-sink.csv, and noresult*
+
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import threading
+
+
+def _heartbeat(path, stop):
+    while not stop.is_set():
+        with open(path, 'a'):
+            os.utime(path, None)
+        time.sleep(0.1)
+
+
+def _workflow(variables):
+    with open(variables['input.sourcefile'], newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        sources = list(reader)
+    output_dir = variables['output.dir']
+    with open(os.path.join(output_dir, 'results.csv'), 'w', newline='') as results, open(os.path.join(output_dir, 'source-in-sink.csv'), 'w', newline='') as in_sink:
+        results_writer = csv.writer(results)
+        in_sink_writer = csv.writer(in_sink)
+        results_writer.writerow(['Initial source', 'Transformation ID', 'Reaction SMILES', 'Substrate SMILES', 'Product SMILES', 'In Sink', 'Sink name', 'Rule ID', 'EC number', 'Score', 'Iteration'])
+        in_sink_writer.writerow(['Name', 'InChI'])
+        for name, inchi in sources:
+            if name.startswith('insink'):
+                in_sink_writer.writerow([name, inchi])
+            elif not name.startswith('noresult'):
+                results_writer.writerow([name, 'TRS_0_0_'+name, 'CCO>>O.CC', 'CCO', 'O', '1', '[MNXM2]', '[R1]', '[1.1.1.1]', '0.5', '0'])
+
+
+def main():
+    jobs_dir = sys.argv[1]
+    mode = sys.argv[2] if len(sys.argv)>2 else 'ok'
+    with open(os.path.join(os.path.dirname(jobs_dir), 'starts.txt'), 'a') as f:
+        f.write(str(os.getpid())+'\n')
+    if mode=='fail':
+        sys.exit(1)
+    if mode=='hang':
+        #never sends a heartbeat
+        while not os.path.exists(os.path.join(jobs_dir, 'stop')):
+            time.sleep(0.05)
+        return
+    inbox = os.path.join(jobs_dir, 'inbox')
+    outbox = os.path.join(jobs_dir, 'outbox')
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(os.path.join(jobs_dir, 'heartbeat'), stop), daemon=True).start()
+    while not os.path.exists(os.path.join(jobs_dir, 'stop')):
+        for name in sorted(os.listdir(inbox)):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(inbox, name)) as f:
+                job = json.load(f)
+            os.remove(os.path.join(inbox, name))
+            variables = dict([(i[0], i[1]) for i in job['variables']])
+            action = variables.get('fake.action', 'done')
+            if 'input.sourcefile' in variables:
+                _workflow(variables)
+            if action=='die':
+                os._exit(3)
+            if action.startswith('sleep:'):
+                time.sleep(float(action.split(':')[1]))
+                action = 'done'
+            with open(os.path.join(outbox, name+'.tmp'), 'w') as f:
+                json.dump({'status': action, 'message': str(os.getpid())}, f)
+            os.rename(os.path.join(outbox, name+'.tmp'), os.path.join(outbox, name))
+        time.sleep(0.05)
+    stop.set()
+
+
+if __name__ == "__main__":
+    main()
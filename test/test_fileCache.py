@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import fileCache
+
+
+def _file(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_entry_round_trip(tmp_path):
+    cache_dir = str(tmp_path.joinpath('cache'))
+    key = fileCache.cacheKey('rules', 'abc', [2, 4])
+    assert key==fileCache.cacheKey('rules', 'abc', [2, 4])
+    assert not key==fileCache.cacheKey('rules', 'abc', [2, 4, 6])
+    assert fileCache.getEntry(cache_dir, key) is None
+    rules = _file(str(tmp_path.joinpath('rules.csv')), 'Rule ID\nRR-1\n')
+    entry_path = fileCache.putEntry(cache_dir, key, {'rules.csv': rules}, meta={'rows': 1})
+    assert fileCache.getEntry(cache_dir, key)==entry_path
+    assert fileCache.getMeta(entry_path)['rows']==1
+    with open(os.path.join(entry_path, 'rules.csv')) as f:
+        assert f.read()=='Rule ID\nRR-1\n'
+    #a second writer of the same key keeps the first entry
+    assert fileCache.putEntry(cache_dir, key, {'rules.csv': rules})==entry_path
+    assert fileCache.removeEntry(cache_dir, key)
+    assert fileCache.getEntry(cache_dir, key) is None
+
+
+def test_file_hash_is_memoised(tmp_path):
+    cache_dir = str(tmp_path.joinpath('cache'))
+    path = _file(str(tmp_path.joinpath('source.csv')), 'first')
+    digest = fileCache.fileHash(path, cache_dir)
+    assert digest==fileCache.fileHash(path)
+    assert os.listdir(os.path.join(cache_dir, 'hashes'))
+    #a new content of another size is hashed again
+    _file(path, 'second content')
+    assert not fileCache.fileHash(path, cache_dir)==digest
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path.joinpath('cache'))
+    data = _file(str(tmp_path.joinpath('data')), 'x'*100)
+    for i, key in enumerate(['a', 'b', 'c']):
+        fileCache.putEntry(cache_dir, key, {'data': data})
+        os.utime(os.path.join(cache_dir, key, fileCache.ENTRY_META), (time.time()-100+i, time.time()-100+i))
+    #reading an entry makes it the most recently used
+    assert fileCache.getEntry(cache_dir, 'a')
+    entry_size = sum([i.stat().st_size for i in os.scandir(os.path.join(cache_dir, 'a'))])
+    assert fileCache.evict(cache_dir, max_size=2*entry_size+50)==1
+    assert fileCache.getEntry(cache_dir, 'b') is None
+    assert fileCache.getEntry(cache_dir, 'a') and fileCache.getEntry(cache_dir, 'c')
+
+
+def test_lock_entry(tmp_path):
+    cache_dir = str(tmp_path.joinpath('cache'))
+    with fileCache.lockEntry(cache_dir, 'key'):
+        assert os.path.exists(os.path.join(cache_dir, 'locks', 'key.lock'))
+    #the lock is released when the block exits
+    with fileCache.lockEntry(cache_dir, 'key'):
+        pass
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import shutil
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+import procSupervisor
+
+
+@pytest.fixture(autouse=True)
+def fast_sampling(monkeypatch):
+    monkeypatch.setattr(procSupervisor, 'SAMPLE_INTERVAL', 0.05)
+    monkeypatch.setattr(procSupervisor, 'WAIT_INTERVAL', 0.01)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_failed_monitor_kills_the_group(tmp_path):
+    pid_path = str(tmp_path.joinpath('pid'))
+    pids = []
+
+    def monitor():
+        if os.path.exists(pid_path) and os.path.getsize(pid_path):
+            with open(pid_path) as f:
+                pids.append(int(f.read()))
+            raise RuntimeError('broken monitor')
+        return None
+
+    start = time.time()
+    with pytest.raises(RuntimeError):
+        procSupervisor.run(['sh', '-c', 'sleep 30 & echo $! > '+pid_path+'; wait'], timeout=60, monitor=monitor)
+    assert time.time()-start<10
+    #the child of the command is killed with its group, and the command is reaped
+    assert pids
+    for i in range(100):
+        if not _is_running(pids[0]):
+            break
+        time.sleep(0.05)
+    assert not _is_running(pids[0])
+
+
+def test_memory_limit_needs_prlimit(tmp_path, monkeypatch):
+    if not shutil.which(procSupervisor.PRLIMIT):
+        pytest.skip('prlimit is not installed')
+    result = procSupervisor.run([sys.executable, '-c', 'import resource; print(resource.getrlimit(resource.RLIMIT_AS)[0])'], max_virtual_memory=2*1024**3)
+    assert result['stdout'].strip()==str(2*1024**3)
+    #without prlimit the command is not started rather than run without limit
+    monkeypatch.setattr(procSupervisor, 'PRLIMIT', str(tmp_path.joinpath('missing-prlimit')))
+    with pytest.raises(ValueError):
+        procSupervisor.run([sys.executable, '-c', 'open('+repr(str(tmp_path.joinpath('started')))+', "w")'], max_virtual_memory=2*1024**3)
+    assert not tmp_path.joinpath('started').exists()
+
+
+def test_tree_sampler(tmp_path):
+    process = subprocess.Popen(['sh', '-c', 'sleep 30 & wait'], start_new_session=True)
+    try:
+        for i in range(100):
+            if len(procSupervisor.tree_pids(process.pid))>1:
+                break
+            time.sleep(0.05)
+        #the shell and its sleep child
+        assert len(procSupervisor.tree_pids(process.pid))==2
+        tmp_path.joinpath('output.txt').write_text('x'*1000)
+        sampler = procSupervisor.TreeSampler(process.pid, str(tmp_path))
+        sampler.sample()
+        sampler.sample()
+        metrics = sampler.metrics()
+        assert metrics['samples']==2
+        assert metrics['peak_threads']>=2
+        assert metrics['peak_rss']>0
+        assert metrics['output_size']==1000
+        assert metrics['user_time']>=0
+    finally:
+        procSupervisor.kill_group(process)
+        process.wait()
+
+
+def test_run_metrics(tmp_path):
+    output_dir = tmp_path.joinpath('output')
+    output_dir.mkdir()
+    code = 'import time; data = bytearray(64*1024*1024); open('+repr(str(output_dir.joinpath('out.txt')))+', "w").write("x"*100); time.sleep(0.3)'
+    result = procSupervisor.run([sys.executable, '-c', code], timeout=60, output_dir=str(output_dir))
+    assert result['returncode']==0
+    metrics = result['metrics']
+    #the peak resident memory of wait4 holds the allocated buffer
+    assert metrics['peak_rss']>=64*1024*1024
+    assert metrics['output_size']==100
+    assert metrics['wall_time']>=0.3
+    assert metrics['user_time'] is not None and metrics['sys_time'] is not None
@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import retroPipeline
+import runRP2paths
+
+
+def test_partial_results_are_opt_in():
+    assert retroPipeline._rp2Status('noerror') is None
+    #the early stop is requested by the caller and always goes on
+    assert retroPipeline._rp2Status('earlystopwarning') is None
+    assert retroPipeline._rp2Status('timeoutwarning')=='rp2_time_out'
+    assert retroPipeline._rp2Status('memwarning')=='rp2_mem'
+    assert retroPipeline._rp2Status('noresultwarning')=='rp2_no_rp2_results'
+    assert retroPipeline._rp2Status('timeoutwarning', continue_partial=True) is None
+    assert retroPipeline._rp2Status('memwarning', continue_partial=True) is None
+    assert retroPipeline._rp2Status('timeouterror', continue_partial=True)=='rp2_time_out'
+    assert retroPipeline._rp2Status('unknown')=='rp2_status'
+
+
+def test_remaining_time():
+    assert 9.9<retroPipeline._remainingTime(time.time()+600)<=10.0
+    assert retroPipeline._remainingTime(time.time()+30) is None
+    assert retroPipeline._remainingTime(time.time()-30) is None
+
+
+def test_no_time_left_for_rp2paths(tmp_path, monkeypatch):
+    #rp2paths is not started, rather than run with the default timeout
+    monkeypatch.setattr(runRP2paths, 'RP2PATHS_PATH', str(tmp_path.joinpath('missing')))
+    status, message, metrics = runRP2paths.run_rp2paths(str(tmp_path.joinpath('results.csv')), str(tmp_path.joinpath('out_paths.csv')), str(tmp_path.joinpath('compounds.txt')), timeout=0.0)
+    assert status=='timeout'
+    assert metrics is None
@@ -0,0 +1,71 @@
+import os
+import csv
+import sys
+import sqlite3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+import rp2Database
+
+RESULTS_HEADER = ['Initial source', 'Transformation ID', 'Reaction SMILES', 'Substrate SMILES', 'Substrate InChI', 'Product SMILES', 'Product InChI', 'In Sink', 'Sink name', 'Rule ID', 'EC number', 'Diameter', 'Score', 'Iteration']
+RESULTS_ROWS = [['target', 'TRS_0_0', 'CCO>>CC=O', 'CCO', 'InChI=1S/C2H6O/c1-2-3/h3H,2H2,1H3', 'CC=O', 'InChI=1S/C2H4O/c1-2-3/h2H,1H3', '0', '[]', '[RR-02-a, RR-02-b]', '[1.1.1.1]', '2', '0.5', '0'],
+                RESULTS_HEADER,
+                ['target', 'TRS_1_0', 'CC=O>>O', 'CC=O', 'InChI=1S/C2H4O/c1-2-3/h2H,1H3', 'O', 'InChI=1S/H2O/h1H2', '1', '[MNXM2]', '[RR-02-c]', '[1.2.1.1]', '2', 'x', '1']]
+PATHS_HEADER = ['Path ID', 'Unique ID', 'Rule ID', 'Left', 'Right']
+PATHS_ROWS = [['1', 'TRS_0_0', 'RR-02-a,RR-02-b', '1.CMPD_0000000001', '1.TARGET_0000000001'],
+              ['1', 'TRS_1_0', 'RR-02-c', '1.MNXM2', '1.CMPD_0000000001'],
+              ['2', 'TRS_0_1', 'RR-02-d', '1.MNXM2:1.MNXM2', '1.TARGET_0000000001']]
+
+
+def _csv(path, header, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
+
+
+@pytest.fixture
+def outputs(tmp_path):
+    compounds = tmp_path.joinpath('compounds.txt')
+    compounds.write_text('Compound ID\tStructure\nCMPD_0000000001\tCC=O\nMNXM2\tO\nTARGET_0000000001\tCCO\n')
+    return (_csv(str(tmp_path.joinpath('results.csv')), RESULTS_HEADER, RESULTS_ROWS),
+            _csv(str(tmp_path.joinpath('out_paths.csv')), PATHS_HEADER, PATHS_ROWS),
+            str(compounds))
+
+
+def test_write_database(tmp_path, outputs):
+    db_path = str(tmp_path.joinpath('run.db'))
+    counts = rp2Database.write_database(db_path, *outputs)
+    assert {i: counts[i] for i in counts if not i=='wall_time'}=={'scope': 2, 'scope_rules': 3, 'steps': 3, 'step_rules': 4, 'step_compounds': 6,
+                                                                 'compounds': 3, 'rules': 4, 'transformations': 3, 'pathways': 2}
+    assert not os.path.exists(db_path+'.tmp')
+    connection = sqlite3.connect(db_path)
+    try:
+        #the repeated header is skipped, and the invalid score is stored as NULL
+        assert list(connection.execute('SELECT source, in_sink, score, iteration FROM scope ORDER BY id'))==[('target', 0, 0.5, 0), ('target', 1, None, 1)]
+        assert sorted(connection.execute('SELECT path_id, rule_id FROM pathway_rules WHERE path_id=1'))==[(1, 'RR-02-a'), (1, 'RR-02-b'), (1, 'RR-02-c')]
+        #a compound repeated on a side is stored once with the sum of its coefficients
+        assert list(connection.execute('SELECT coefficient FROM step_compounds JOIN compounds ON compounds.id=step_compounds.compound JOIN steps ON steps.id=step_compounds.step WHERE steps.path_id=2 AND compounds.compound_id="MNXM2"'))==[(2.0,)]
+        assert list(connection.execute('SELECT structure FROM compounds WHERE compound_id="TARGET_0000000001"'))==[('CCO',)]
+    finally:
+        connection.close()
+
+
+def test_pathways_with_compound(tmp_path, outputs):
+    db_path = str(tmp_path.joinpath('run.db'))
+    rp2Database.write_database(db_path, *outputs)
+    assert rp2Database.pathways_with_compound(db_path, 'MNXM2')==[1, 2]
+    assert rp2Database.pathways_with_compound(db_path, 'CMPD_0000000001')==[1]
+    assert rp2Database.pathways_with_compound(db_path, 'MNXM3')==[]
+
+
+def test_failed_write_keeps_the_previous_file(tmp_path, outputs):
+    db_path = str(tmp_path.joinpath('run.db'))
+    rp2Database.write_database(db_path, *outputs)
+    with pytest.raises(OSError):
+        rp2Database.write_database(db_path, outputs[0], str(tmp_path.joinpath('missing.csv')))
+    assert not os.path.exists(db_path+'.tmp')
+    assert rp2Database.pathways_with_compound(db_path, 'MNXM2')==[1, 2]
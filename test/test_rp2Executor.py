@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+import rp2Executor
+
+FAKE_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_rp2_worker.py')
+
+
+@pytest.fixture(autouse=True)
+def fast_poll(monkeypatch):
+    monkeypatch.setattr(rp2Executor, 'POLL_INTERVAL', 0.05)
+
+
+def _executor(tmp_path, mode='ok', **kwargs):
+    return rp2Executor.RP2Executor(command=[sys.executable, FAKE_WORKER, '{jobs_dir}', mode], root_dir=str(tmp_path), **kwargs)
+
+
+def _starts(tmp_path):
+    with open(os.path.join(str(tmp_path), 'starts.txt')) as f:
+        return f.read().split()
+
+
+def test_done_and_error(tmp_path):
+    with _executor(tmp_path) as executor:
+        state, message, metrics = executor.submit([('fake.action', 'done', 'String')], 10)
+        assert state=='done'
+        assert metrics['wall_time']>=0
+        state, message, metrics = executor.submit([('fake.action', 'error', 'String')], 10)
+        assert state=='error'
+    #the same warm worker ran both jobs
+    assert len(_starts(tmp_path))==1
+
+
+def test_timeout_replaces_the_worker(tmp_path):
+    with _executor(tmp_path) as executor:
+        state, message, metrics = executor.submit([('fake.action', 'sleep:30', 'String')], 0.5)
+        assert state=='timeout'
+        assert executor.submit([('fake.action', 'done', 'String')], 10)[0]=='done'
+    assert len(_starts(tmp_path))==2
+
+
+def test_worker_death(tmp_path):
+    with _executor(tmp_path) as executor:
+        state, message, metrics = executor.submit([('fake.action', 'die', 'String')], 10)
+        assert state=='error'
+        assert executor.submit([('fake.action', 'done', 'String')], 10)[0]=='done'
+    assert len(_starts(tmp_path))==2
+
+
+def test_recycling_after_max_jobs(tmp_path):
+    with _executor(tmp_path, max_jobs=2) as executor:
+        pids = [executor.submit([('fake.action', 'done', 'String')], 10)[1] for i in range(3)]
+    assert pids[0]==pids[1]
+    assert not pids[1]==pids[2]
+    assert len(_starts(tmp_path))==2
+
+
+def test_failed_start_backoff(tmp_path):
+    with _executor(tmp_path, 'fail', start_backoff=60, max_start_failures=None) as executor:
+        assert executor.submit([], 10)[0]=='unavailable'
+        start = time.time()
+        assert executor.submit([], 10)[0]=='unavailable'
+        assert time.time()-start<1
+        assert not executor.disabled
+    #the slot is not started again during its backoff
+    assert len(_starts(tmp_path))==1
+
+
+def test_disabled_after_failed_starts(tmp_path):
+    with _executor(tmp_path, 'hang', workers=2, start_timeout=0.5, start_backoff=0, max_start_failures=2) as executor:
+        assert executor.submit([], 10)[0]=='unavailable'
+        assert executor.submit([], 10)[0]=='unavailable'
+        assert executor.disabled
+        start = time.time()
+        assert executor.submit([], 10)[0]=='unavailable'
+        assert time.time()-start<0.5
+    assert len(_starts(tmp_path))==2
+
+
+def test_limits_of_the_job(tmp_path):
+    with _executor(tmp_path, max_virtual_memory=4*1024**3) as executor:
+        #the workers cannot run within a lower limit, nor with a number of CPUs
+        assert executor.submit([('fake.action', 'done', 'String')], 10, max_virtual_memory=2*1024**3)[0]=='unavailable'
+        assert executor.submit([('fake.action', 'done', 'String')], 10, cpus=2)[0]=='unavailable'
+        assert not os.path.exists(os.path.join(str(tmp_path), 'starts.txt'))
+        assert executor.submit([('fake.action', 'done', 'String')], 10, max_virtual_memory=8*1024**3)[0]=='done'
+    with _executor(tmp_path) as executor:
+        #workers without limit do not take a job with one
+        assert executor.submit([('fake.action', 'done', 'String')], 10, max_virtual_memory=8*1024**3)[0]=='unavailable'
+        assert executor.submit([('fake.action', 'done', 'String')], 10)[0]=='done'
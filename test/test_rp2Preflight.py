@@ -0,0 +1,64 @@
+import os
+import csv
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+pytest.importorskip('rdkit')
+
+import rp2Preflight
+import runRR
+
+WATER = 'InChI=1S/H2O/h1H2'
+ETHANOL = 'InChI=1S/C2H6O/c1-2-3/h3H,2H2,1H3'
+
+
+def _sink(path, inchis):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Name', 'InChI'])
+        for i, inchi in enumerate(inchis):
+            writer.writerow(['MNXM'+str(i), inchi])
+    return path
+
+
+def _rules(path, rows=1):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(runRR.RULES_HEADER)
+        for i in range(rows):
+            writer.writerow(['R'+str(i)]+['x']*(len(runRR.RULES_HEADER)-1))
+    return path
+
+
+def test_statuses(tmp_path):
+    sink = _sink(str(tmp_path.joinpath('sink.csv')), [WATER])
+    rules = _rules(str(tmp_path.joinpath('rules.csv')))
+    assert rp2Preflight.preflight(sink, rules, ETHANOL)==(None, '')
+    assert rp2Preflight.preflight(sink, rules, WATER)[0]=='sourceinsinkerror'
+    #the statuses are those of run_rp2
+    assert rp2Preflight.preflight(sink, rules, 'InChI=1S/nonsense')[0]=='noresulterror'
+    assert rp2Preflight.preflight(str(tmp_path.joinpath('missing.csv')), rules, ETHANOL)[0]=='oserror'
+    bad_rules = str(tmp_path.joinpath('bad_rules.csv'))
+    with open(bad_rules, 'w') as f:
+        f.write('Rule ID,Rule\nR1,x\n')
+    assert rp2Preflight.preflight(sink, bad_rules, ETHANOL)[0]=='oserror'
+
+
+def test_memo_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(rp2Preflight, '_memo', rp2Preflight.collections.OrderedDict())
+    monkeypatch.setattr(rp2Preflight, 'MEMO_SIZE', 2)
+    sinks = [_sink(str(tmp_path.joinpath('sink'+str(i)+'.csv')), [WATER]) for i in range(3)]
+    for sink in sinks:
+        assert rp2Preflight.load_sink(sink)
+    assert len(rp2Preflight._memo)==2
+    #the last used sink is kept, the least recently used one is evicted
+    rp2Preflight.load_sink(sinks[1])
+    rp2Preflight.load_sink(sinks[0])
+    assert [i[1] for i in rp2Preflight._memo]==[os.path.realpath(sinks[1]), os.path.realpath(sinks[0])]
+    #a new version of a file is read again
+    _sink(sinks[0], [ETHANOL, WATER, 'InChI=1S/CH4/h1H4'])
+    os.utime(sinks[0], (0, 0))
+    assert len(rp2Preflight.load_sink(sinks[0]))==3
@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import rp2Results
+
+HEADER = '"Initial source","Transformation ID","In Sink","Substrate InChI","Product InChI","Iteration"\n'
+
+
+def _row(tid, in_sink, iteration, product='InChI=1S/H2O/h1H2'):
+    return '"target","'+tid+'","['+in_sink+']","[InChI=1S/CH4/h1H4]","['+product+']","'+iteration+'"\n'
+
+
+def _append(path, content):
+    with open(path, 'a') as f:
+        f.write(content)
+
+
+def test_tail_reads_complete_lines(tmp_path):
+    path = str(tmp_path.joinpath('results.csv'))
+    new_rows = []
+    tail = rp2Results.ResultsTail(path, on_rows=new_rows.extend, stop_sink_rows=2)
+    #the file is not written yet
+    assert tail() is None
+    _append(path, HEADER+_row('TRS_0_0', '0', '0')+_row('TRS_0_1', '1', '0')[:20])
+    assert tail() is None
+    assert [i['Transformation ID'] for i in new_rows]==['TRS_0_0']
+    #the line is read once it is complete, and the repeated header is skipped
+    _append(path, _row('TRS_0_1', '1', '0')[20:]+HEADER)
+    assert tail() is None
+    assert [i['Transformation ID'] for i in new_rows]==['TRS_0_0', 'TRS_0_1']
+    _append(path, _row('TRS_1_0', '1, 1', '1'))
+    assert tail()=='2 rows reaching the sink'
+    assert tail.rows==3
+
+
+def test_tail_stops_when_idle(tmp_path, monkeypatch):
+    path = str(tmp_path.joinpath('results.csv'))
+    tail = rp2Results.ResultsTail(path, stop_idle=1)
+    _append(path, HEADER)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    #the idle time only counts after the first row
+    assert tail() is None
+    _append(path, _row('TRS_0_0', '0', '0'))
+    assert tail() is None
+    monkeypatch.setattr(time, 'time', lambda: now+61)
+    assert tail()=='no new rows for 1 minutes'
+
+
+def test_tail_rewritten_file(tmp_path):
+    path = str(tmp_path.joinpath('results.csv'))
+    new_rows = []
+    tail = rp2Results.ResultsTail(path, on_rows=new_rows.extend)
+    _append(path, HEADER+_row('TRS_0_0', '0', '0'))
+    tail()
+    #the rows already passed are not passed again
+    os.remove(path)
+    _append(path, HEADER+_row('TRS_0_0', '0', '0')+_row('TRS_0_1', '1', '0'))
+    tail()
+    assert [i['Transformation ID'] for i in new_rows]==['TRS_0_0', 'TRS_0_1']
+
+
+def test_failing_callback_does_not_stop_the_run(tmp_path):
+    path = str(tmp_path.joinpath('results.csv'))
+
+    def on_rows(rows):
+        raise RuntimeError('broken callback')
+
+    tail = rp2Results.ResultsTail(path, on_rows=on_rows, stop_sink_rows=1)
+    _append(path, HEADER+_row('TRS_0_0', '1', '0'))
+    assert tail()=='1 rows reaching the sink'
+
+
+def _results(path):
+    content = (HEADER+_row('TRS_0_0', '0', '0')+_row('TRS_0_1', '1', '0', 'InChI=1S/H3N/h1H3')
+               +HEADER+_row('TRS_1_0', '1', '1')+_row('TRS_0_2', '1', '0')+_row('TRS_2_0', '0', '2')[:10])
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_scan(tmp_path):
+    summary = rp2Results.scan(_results(str(tmp_path.joinpath('results.csv'))))
+    #the truncated last line and the repeated header are left out
+    assert summary['rows']==4
+    assert summary['sink_rows']==3
+    assert summary['transformations']==4
+    assert summary['compounds']==3
+    assert summary['header']==[0, len(HEADER)]
+    assert summary['iterations']['0']['rows']==3
+    #the rows of the first iteration are split by the second header and the row of the second iteration
+    assert len(summary['iterations']['0']['offsets'])==2
+    assert summary['iterations']['1']['rows']==1
+
+
+def test_index_is_reused(tmp_path, monkeypatch):
+    path = _results(str(tmp_path.joinpath('results.csv')))
+    #the index of a file ending with a truncated line, still being written, is not kept
+    rp2Results.results_index(path)
+    assert not os.path.exists(path+rp2Results.INDEX_SUFFIX)
+    _append(path, _row('TRS_2_0', '0', '2')[10:])
+    summary = rp2Results.results_index(path)
+    assert os.path.exists(path+rp2Results.INDEX_SUFFIX)
+
+    def scan(results_path):
+        raise AssertionError('the results are scanned again')
+
+    monkeypatch.setattr(rp2Results, 'scan', scan)
+    assert rp2Results.results_index(path)==dict(summary, mtime=os.stat(path).st_mtime)
+    #a rewritten file is scanned again
+    monkeypatch.undo()
+    _append(path, _row('TRS_2_1', '0', '2'))
+    assert rp2Results.results_index(path)['rows']==6
+
+
+def test_read_iterations(tmp_path):
+    path = _results(str(tmp_path.joinpath('results.csv')))
+    assert [i['Transformation ID'] for i in rp2Results.read_iterations(path, [0])]==['TRS_0_0', 'TRS_0_1', 'TRS_0_2']
+    assert [i['Transformation ID'] for i in rp2Results.read_iterations(path, [1, 0])]==['TRS_0_0', 'TRS_0_1', 'TRS_1_0', 'TRS_0_2']
+    assert list(rp2Results.read_iterations(path, [5]))==[]
+
+
+def test_copy_complete_lines(tmp_path):
+    path = _results(str(tmp_path.joinpath('results.csv')))
+    output = str(tmp_path.joinpath('copy.csv'))
+    size = rp2Results.copy_complete_lines(path, output)
+    with open(path, 'rb') as f:
+        content = f.read()
+    with open(output, 'rb') as f:
+        assert f.read()==content[:size]
+    assert content[:size].endswith(b'\n') and len(content)-size==10
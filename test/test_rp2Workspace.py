@@ -0,0 +1,48 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+import rp2Workspace
+
+
+def _configuration(path):
+    bundle = path.joinpath('configuration', 'org.eclipse.osgi', '12', 'data')
+    bundle.mkdir(parents=True)
+    bundle.joinpath('bundle.jar').write_text('bundle')
+    path.joinpath('configuration', 'config.ini').write_text('osgi.bundles=x\n')
+    path.joinpath('configuration', '.lock').write_text('')
+    return path
+
+
+def test_areas_from_the_installation(tmp_path):
+    knime_dir = _configuration(tmp_path.joinpath('knime'))
+    knime_dir.joinpath('p2').mkdir()
+    area_dir = tmp_path.joinpath('areas')
+    args = rp2Workspace.knime_args(str(area_dir), template_dir=str(tmp_path.joinpath('no_template')), knime_dir=str(knime_dir))
+    assert args==rp2Workspace.area_args(str(area_dir))
+    assert area_dir.joinpath('workspace').is_dir()
+    #the configuration is private, the extracted bundles are linked and the lock is not cloned
+    assert area_dir.joinpath('configuration', 'config.ini').read_text()=='osgi.bundles=x\n'
+    assert not area_dir.joinpath('configuration', 'config.ini').samefile(knime_dir.joinpath('configuration', 'config.ini'))
+    assert area_dir.joinpath('configuration', 'org.eclipse.osgi', '12', 'data', 'bundle.jar').samefile(knime_dir.joinpath('configuration', 'org.eclipse.osgi', '12', 'data', 'bundle.jar'))
+    assert not area_dir.joinpath('configuration', '.lock').exists()
+    assert os.readlink(str(area_dir.joinpath('p2')))==str(knime_dir.joinpath('p2'))
+
+
+def test_areas_from_the_template(tmp_path):
+    template_dir = _configuration(tmp_path.joinpath('template'))
+    template_dir.joinpath('workspace', '.metadata').mkdir(parents=True)
+    area_dir = tmp_path.joinpath('areas')
+    rp2Workspace.knime_args(str(area_dir), template_dir=str(template_dir), knime_dir=str(tmp_path.joinpath('missing')))
+    assert rp2Workspace.is_template(str(template_dir))
+    assert area_dir.joinpath('workspace', '.metadata').is_dir()
+    assert area_dir.joinpath('configuration', 'org.eclipse.osgi', '12', 'data', 'bundle.jar').samefile(template_dir.joinpath('configuration', 'org.eclipse.osgi', '12', 'data', 'bundle.jar'))
+
+
+def test_no_configuration_to_clone(tmp_path):
+    #the launch fails rather than sharing the configuration of the installation
+    with pytest.raises(OSError):
+        rp2Workspace.knime_args(str(tmp_path.joinpath('areas')), template_dir=None, knime_dir=str(tmp_path.joinpath('missing')))
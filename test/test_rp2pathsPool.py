@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+import rp2pathsPool
+import runRP2paths
+
+#stand-in for the rp2paths entry point, the first line of the scope file is the action
+FAKE_MAIN = '''import os
+import sys
+import time
+
+outdir = sys.argv[sys.argv.index('--outdir')+1]
+with open(sys.argv[2]) as f:
+    action = f.readline().strip()
+if action=='timeout':
+    print('TIMEOUT: rp2paths stopped the enumeration')
+    sys.exit(0)
+if action=='memoryerror':
+    #the allocation fails under the virtual memory limit of the job
+    data = bytearray(1024*1024*1024)
+if action=='sleep':
+    time.sleep(30)
+with open(os.path.join(outdir, 'compounds.txt'), 'w') as f:
+    f.write('cmpd_id\\tstructure\\nTARGET_0000000001\\tC\\n')
+#rp2paths does not close this file, it is flushed when the job exits
+out_paths = open(os.path.join(outdir, 'out_paths.csv'), 'w')
+out_paths.write('"Path ID","Unique ID"\\n"1","MNXR1_1"\\n')
+'''
+
+
+def _package(tmp_path, importable=True):
+    package = tmp_path.joinpath('rp2paths')
+    package.mkdir()
+    package.joinpath('__init__.py').write_text('' if importable else 'raise ImportError("broken rp2paths")\n')
+    package.joinpath('__main__.py').write_text(FAKE_MAIN)
+    with open(str(tmp_path.joinpath('starts.txt')), 'w'):
+        pass
+    return str(tmp_path)
+
+
+def _pool(tmp_path, importable=True, **kwargs):
+    cwd = _package(tmp_path, importable)
+    #each start of a worker is counted before the modules are imported
+    command = [sys.executable, '-c', 'import sys, runpy; open("starts.txt", "a").write("start\\n"); sys.path.insert(0, '+repr(os.path.dirname(rp2pathsPool.__file__))+'); sys.argv = ["rp2pathsPool.py", "-worker"]; runpy.run_path('+repr(rp2pathsPool.__file__)+', run_name="__main__")']
+    return rp2pathsPool.RP2pathsPool(command=command, cwd=cwd, **kwargs)
+
+
+def _starts(tmp_path):
+    with open(str(tmp_path.joinpath('starts.txt'))) as f:
+        return len(f.read().split())
+
+
+def _run(tmp_path, pool, action, **kwargs):
+    scope = tmp_path.joinpath(action+'.csv')
+    scope.write_text(action+'\n')
+    out_paths = str(tmp_path.joinpath(action+'_out_paths.csv'))
+    out_compounds = str(tmp_path.joinpath(action+'_compounds.txt'))
+    status, message, metrics = runRP2paths.run_rp2paths(str(scope), out_paths, out_compounds, pool=pool, **kwargs)
+    return status, out_paths, out_compounds
+
+
+@pytest.fixture(autouse=True)
+def no_subprocess(monkeypatch, tmp_path):
+    #a job that does not run on the pool fails with an oserror instead of calling the rp2paths of the system
+    monkeypatch.setattr(runRP2paths, 'RP2PATHS_PATH', str(tmp_path.joinpath('missing')))
+    monkeypatch.setattr(rp2pathsPool, 'POLL_INTERVAL', 0.02)
+
+
+def test_statuses(tmp_path):
+    with _pool(tmp_path) as pool:
+        status, out_paths, out_compounds = _run(tmp_path, pool, 'noerror')
+        assert status=='noerror'
+        with open(out_paths) as f:
+            assert f.read()=='"Path ID","Unique ID"\n"1","MNXR1_1"\n'
+        with open(out_compounds) as f:
+            assert f.read().startswith('cmpd_id')
+        assert _run(tmp_path, pool, 'timeout')[0]=='timeout'
+        assert _run(tmp_path, pool, 'memoryerror', ram_limit=1)[0]=='memoryerror'
+    #the same warm worker ran every job
+    assert _starts(tmp_path)==1
+
+
+def test_killed_after_timeout(tmp_path, monkeypatch):
+    monkeypatch.setattr(runRP2paths, 'TIMEOUT_GRACE', 0)
+    with _pool(tmp_path) as pool:
+        start = time.time()
+        assert _run(tmp_path, pool, 'sleep', timeout=0.01)[0]=='timeout'
+        assert time.time()-start<10
+        assert _run(tmp_path, pool, 'noerror')[0]=='noerror'
+
+
+def test_broken_rp2paths_does_not_start(tmp_path):
+    with _pool(tmp_path, importable=False, start_backoff=60, max_start_failures=None) as pool:
+        assert pool.submit([], 10, resource.RLIM_INFINITY, str(tmp_path.joinpath('job.log'))) is None
+        start = time.time()
+        assert pool.submit([], 10, resource.RLIM_INFINITY, str(tmp_path.joinpath('job.log'))) is None
+        assert time.time()-start<1
+        assert not pool.disabled
+    #the slot is not started again during its backoff
+    assert _starts(tmp_path)==1
+
+
+def test_disabled_after_failed_starts(tmp_path):
+    with _pool(tmp_path, importable=False, workers=2, start_backoff=0, max_start_failures=2) as pool:
+        assert _run(tmp_path, pool, 'first')[0]=='oserror'
+        assert _run(tmp_path, pool, 'second')[0]=='oserror'
+        assert pool.disabled
+        assert _run(tmp_path, pool, 'third')[0]=='oserror'
+    assert _starts(tmp_path)==2
@@ -0,0 +1,71 @@
+import os
+import csv
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+import rp2pathsRanking
+
+RESULTS = [('TRS_A', '0.9'), ('TRS_B', '0.5'), ('TRS_C', '0.5'), ('TRS_D', 'x'), ('TRS_E', '0.9'), ('TRS_F', '0.5')]
+PATHS_HEADER = ['Path ID', 'Unique ID', 'Rule ID', 'Left', 'Right']
+PATHS_ROWS = [['1', 'TRS_B', 'RR-1', '1.MNXM2', '1.TARGET_0000000001'],
+              ['2', 'TRS_A', 'RR-2', '1.MNXM2:1.CMPD_0000000001', '1.TARGET_0000000001'],
+              ['2', 'TRS_C', 'RR-3', '1.MNXM3', '1.CMPD_0000000001'],
+              ['3', 'TRS_D', 'RR-4', '1.MNXM4', '1.TARGET_0000000001'],
+              ['4', 'TRS_E', 'RR-5', '1.MNXM5', '1.TARGET_0000000001'],
+              ['5', 'TRS_F', 'RR-6', '1.MNXM6', '1.TARGET_0000000001']]
+
+
+@pytest.fixture
+def outputs(tmp_path):
+    results_path = str(tmp_path.joinpath('results.csv'))
+    with open(results_path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(['Initial source', 'Transformation ID', 'Score'])
+        for tid, score in RESULTS:
+            writer.writerow(['target', tid, score])
+            #the header repeated by the workflow
+            writer.writerow(['Initial source', 'Transformation ID', 'Score'])
+    out_paths = str(tmp_path.joinpath('out_paths.csv'))
+    with open(out_paths, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(PATHS_HEADER)
+        writer.writerows(PATHS_ROWS)
+    return out_paths, results_path
+
+
+def test_score_pathways(outputs):
+    paths, scores = rp2pathsRanking.score_pathways(*outputs)
+    assert scores.loc['2', 'score_min']==0.5
+    assert scores.loc['2', 'score_sum']==pytest.approx(1.4)
+    assert scores.loc['2', 'length']==2
+    #the compounds of rp2paths are not sink precursors
+    assert scores.loc['2', 'sink_precursors']==2
+    assert scores['score_sum'].isna().tolist()==[False, False, True, False, False]
+
+
+def test_rank_order_and_ties(tmp_path, outputs):
+    ranked_paths = str(tmp_path.joinpath('ranked.csv'))
+    out_scores = str(tmp_path.joinpath('scores.csv'))
+    metrics = rp2pathsRanking.rank_pathways(*outputs, ranked_paths, out_scores=out_scores)
+    assert metrics['pathways']==5 and metrics['kept']==5
+    with open(ranked_paths, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0]==PATHS_HEADER
+    #the shortest pathway first on equal minimal scores, the order of the file on full ties, and the unscored pathway last
+    assert [i[0] for i in rows[1:]]==['4', '1', '5', '2', '2', '3']
+    assert rows[1]==PATHS_ROWS[4]
+    with open(out_scores, newline='') as f:
+        scores = list(csv.DictReader(f))
+    assert [(i['Path ID'], i['rank']) for i in scores]==[('4', '1'), ('1', '2'), ('5', '3'), ('2', '4'), ('3', '5')]
+
+
+def test_rank_top_and_key(tmp_path, outputs):
+    ranked_paths = str(tmp_path.joinpath('ranked.csv'))
+    assert rp2pathsRanking.rank_pathways(*outputs, ranked_paths, top=2, rank_by='score_sum')['kept']==2
+    with open(ranked_paths, newline='') as f:
+        assert [i['Path ID'] for i in csv.DictReader(f)]==['2', '2', '4']
+    with pytest.raises(ValueError):
+        rp2pathsRanking.rank_pathways(*outputs, ranked_paths, rank_by='unknown')
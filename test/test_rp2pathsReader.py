@@ -0,0 +1,57 @@
+import os
+import csv
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import rp2pathsReader
+
+HEADER = ['Path ID', 'Unique ID', 'Rule ID', 'Left', 'Right']
+ROWS = [['1', 'TRS_0_0_0', 'RR-02-a,RR-02-b', '1.MNXM2:2.CMPD_0000000001', '1.TARGET_0000000001'],
+        ['1', 'TRS_1_0_0', 'RR-02-c', '1.MNXM3', '1.CMPD_0000000001'],
+        ['2', 'TRS_0_1_0', 'RR-02-d', '1.MNXM4:1.MNXM2', '1.TARGET_0000000001'],
+        ['3', 'TRS_0_2_0', 'RR-02-b', '1.CMPD_0000000002', '1.TARGET_0000000001'],
+        ['3', 'TRS_1_1_0', 'RR-02-e', '1.MNXM3', '1.CMPD_0000000002'],
+        ['3', 'TRS_2_0_0', 'RR-02-f', '1.MNXM5', '1.MNXM3']]
+
+
+def _out_paths(path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(HEADER)
+        writer.writerows(ROWS)
+    return path
+
+
+def test_parse_side():
+    assert rp2pathsReader.parse_side('1.MNXM2:2.CMPD_0000000001')==(('MNXM2', 1), ('CMPD_0000000001', 2))
+    assert rp2pathsReader.parse_side('')==()
+
+
+def test_read_pathways(tmp_path):
+    pathways = list(rp2pathsReader.read_pathways(_out_paths(str(tmp_path.joinpath('out_paths.csv')))))
+    assert [(i.path_id, len(i)) for i in pathways]==[(1, 2), (2, 1), (3, 3)]
+    step = pathways[0].steps[0]
+    assert step.transformation_id=='TRS_0_0_0'
+    assert step.rule_ids==('RR-02-a', 'RR-02-b')
+    assert step.substrates==(('MNXM2', 1), ('CMPD_0000000001', 2))
+    assert step.products==(('TARGET_0000000001', 1),)
+    assert pathways[0].compounds()==['MNXM2', 'CMPD_0000000001', 'TARGET_0000000001', 'MNXM3']
+    assert pathways[0].rule_ids()==['RR-02-a', 'RR-02-b', 'RR-02-c']
+    #the IDs are shared by the pathways of the file
+    assert pathways[0].steps[0].products[0][0] is pathways[1].steps[0].products[0][0]
+
+
+def test_filter_pathways(tmp_path):
+    out_paths = _out_paths(str(tmp_path.joinpath('out_paths.csv')))
+    assert [i.path_id for i in rp2pathsReader.filter_pathways(out_paths, max_steps=2)]==[1, 2]
+    assert [i.path_id for i in rp2pathsReader.filter_pathways(out_paths, compounds=['MNXM3', 'TARGET_0000000001'])]==[1, 3]
+    assert [i.path_id for i in rp2pathsReader.filter_pathways(out_paths, rule_ids=['RR-02-b', 'RR-02-d'])]==[1, 2, 3]
+    assert [i.path_id for i in rp2pathsReader.filter_pathways(out_paths, max_steps=2, rule_ids=['RR-02-b'], predicate=lambda i: i.has_compound('MNXM2'))]==[1]
+
+
+def test_read_compounds(tmp_path):
+    compounds = tmp_path.joinpath('compounds.txt')
+    compounds.write_text('Compound ID\tStructure\nCMPD_0000000001\tCC=O\nMNXM2\tO\nTARGET_0000000001\tCCO\n')
+    assert list(rp2pathsReader.read_compounds(str(compounds)))==[('CMPD_0000000001', 'CC=O'), ('MNXM2', 'O'), ('TARGET_0000000001', 'CCO')]
+    assert list(rp2pathsReader.read_compounds(str(compounds), {'MNXM2'}))==[('MNXM2', 'O')]
@@ -0,0 +1,295 @@
+import os
+import csv
+import sys
+import time
+import importlib.machinery
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+import rp2pathsShards
+import runRP2paths
+
+HEADER = ['Initial source', 'Transformation ID', 'Reaction SMILES', 'Substrate SMILES', 'Product SMILES', 'In Sink', 'Sink name', 'Rule ID', 'EC number', 'Score', 'Iteration']
+#two targets, five components once the target and the sink compounds are left out, and a repeated header row
+REACTIONS = [('TRS_0_0', 'CCCCO', ['O', 'CC=O'], '0'),
+             ('TRS_0_1', 'CCCCO', ['CCC'], '0'),
+             ('TRS_0_2', 'CCCCO', ['C', 'N'], '0'),
+             ('TRS_1_0', 'CC=O', ['CO'], '1'),
+             ('TRS_1_1', 'CCC', ['CC', 'CCN'], '1'),
+             ('TRS_1_2', 'CCC', ['CS'], '1'),
+             ('TRS_1_3', 'CCCl', ['O'], '1'),
+             ('TRS_0_3', 'CCCCCO', ['CCCCN'], '0'),
+             ('TRS_1_4', 'CCCCN', ['N'], '1')]
+SINKS = {'O': 'MNXM2', 'C': 'MNXM10', 'N': 'MNXM9', 'CO': 'MNXM100', 'CC': 'MNXM3, MNXM33', 'CS': 'MNXM4'}
+#a cycle between two compounds, that has no bound on its pathways
+CYCLE = [('TRS_1_5', 'CC=O', ['CCCl'], '1'),
+         ('TRS_2_0', 'CCCl', ['CC=O'], '2')]
+#the pathways from the target to the sink, and the compounds numbered as rp2erxn numbers them
+PATHWAYS = '''
+def expand(smiles, seen):
+    if smiles in sinks:
+        return [[]]
+    paths = []
+    for tid in sorted(reactions):
+        if reactions[tid][0]==[smiles] and not tid in seen:
+            for combo in itertools.product(*[expand(i, seen|{tid}) for i in reactions[tid][1]]):
+                paths.append([tid]+[j for i in combo for j in i])
+    return paths
+
+paths = []
+for tid in sorted(reactions):
+    if iterations[tid]=='0':
+        for combo in itertools.product(*[expand(i, {tid}) for i in reactions[tid][1]]):
+            paths.append([tid]+[j for i in combo for j in i])
+if not paths:
+    sys.exit(1)
+with open(os.path.join(outdir, 'out_paths.csv'), 'w', newline='') as f:
+    writer = csv.DictWriter(f, fieldnames=['Path ID', 'Unique ID', 'Rule ID', 'Left', 'Right'], quoting=csv.QUOTE_ALL, lineterminator='\\r\\n')
+    writer.writeheader()
+    #the order of the enumeration is not the canonical one
+    for path_id, path in enumerate(reversed(paths), 1):
+        for tid in path:
+            writer.writerow({'Path ID': path_id,
+                             'Unique ID': tid,
+                             'Rule ID': 'R1',
+                             'Left': ':'.join(['1.'+cids[i] for i in reactions[tid][1]]),
+                             'Right': '1.'+cids[reactions[tid][0][0]]})
+'''
+#stand-in for the rp2paths entry point, on its own
+FAKE_MAIN = '''import os
+import csv
+import sys
+import itertools
+
+infile = sys.argv[2]
+outdir = sys.argv[sys.argv.index('--outdir')+1]
+reactions = {}
+iterations = {}
+sinks = {}
+targets = []
+with open(infile) as f:
+    for row in csv.DictReader(f):
+        if row['Initial source']=='Initial source':
+            continue
+        left, right = row['Reaction SMILES'].split('>>')
+        reactions[row['Transformation ID']] = (sorted(left.split('.')), sorted(right.split('.')))
+        iterations[row['Transformation ID']] = row['Iteration']
+        if row['Iteration']=='0':
+            targets += [i for i in left.split('.') if not i in targets]
+        if row['In Sink']=='1':
+            sinks[row['Product SMILES']] = sorted(row['Sink name'].strip('[]').split(', '), key=lambda i: int(i[4:]))
+uids = {}
+for tid in sorted(reactions):
+    for smiles in sorted(set(reactions[tid][0]+reactions[tid][1])):
+        uids.setdefault(smiles, 'CMPD_'+str(len(uids)+1).zfill(10))
+ids = {}
+for smiles in uids:
+    if smiles in sinks:
+        ids[smiles] = sinks[smiles]
+    elif smiles in targets:
+        ids[smiles] = ['TARGET_'+str(targets.index(smiles)+1).zfill(10)]
+    else:
+        ids[smiles] = [uids[smiles]]
+cids = {i: ids[i][0] for i in ids}
+with open(os.path.join(outdir, 'compounds.txt'), 'w', newline='') as f:
+    writer = csv.writer(f, delimiter='\\t')
+    writer.writerow(['Compound ID', 'Structure'])
+    for smiles in sorted(ids, key=lambda i: ids[i]):
+        for cid in ids[smiles]:
+            writer.writerow([cid, smiles])
+'''+PATHWAYS
+#stand-in for the rp2paths entry point: the compounds of the real rp2erxn
+RP2ERXN_MAIN = '''import os
+import csv
+import sys
+import itertools
+
+from rp2paths import rp2erxn
+
+infile = sys.argv[2]
+outdir = sys.argv[sys.argv.index('--outdir')+1]
+rp2erxn.compute(infile,
+                cmpdfile=os.path.join(outdir, 'compounds.txt'),
+                rxnfile=os.path.join(outdir, 'reactions.txt'),
+                sinkfile=os.path.join(outdir, 'sinks.txt'))
+cids = {}
+with open(os.path.join(outdir, 'compounds.txt')) as f:
+    for row in csv.DictReader(f, delimiter='\\t'):
+        cids.setdefault(row['Structure'], row['Compound ID'])
+reactions = {}
+iterations = {}
+sinks = set()
+with open(infile) as f:
+    for row in csv.DictReader(f):
+        if row['Initial source']=='Initial source':
+            continue
+        left, right = row['Reaction SMILES'].split('>>')
+        reactions[row['Transformation ID']] = (left.split('.'), right.split('.'))
+        iterations[row['Transformation ID']] = row['Iteration']
+        if row['In Sink']=='1':
+            sinks.add(row['Product SMILES'])
+'''+PATHWAYS
+
+
+def _rp2paths_dir():
+    spec = importlib.machinery.PathFinder.find_spec('rp2paths', sys.path+[runRP2paths.RP2PATHS_PATH])
+    if not spec or not spec.submodule_search_locations:
+        return None
+    for path in spec.submodule_search_locations:
+        if os.path.exists(os.path.join(path, 'rp2erxn.py')):
+            return path
+    return None
+
+
+@pytest.fixture(autouse=True)
+def small_scopes(monkeypatch):
+    #the scope of the tests is split despite its size
+    monkeypatch.setattr(rp2pathsShards, 'SHARD_MIN_TRANSFORMATIONS', 0)
+
+
+@pytest.fixture
+def fake_rp2paths(tmp_path, monkeypatch):
+    package = tmp_path.joinpath('fake', 'rp2paths')
+    package.mkdir(parents=True)
+    package.joinpath('__init__.py').write_text('')
+    package.joinpath('__main__.py').write_text(FAKE_MAIN)
+    monkeypatch.setattr(runRP2paths, 'RP2PATHS_PATH', str(package.parent))
+    return str(package.parent)
+
+
+@pytest.fixture
+def rp2paths(tmp_path, monkeypatch):
+    rp2paths_dir = _rp2paths_dir()
+    if not rp2paths_dir:
+        pytest.skip('rp2paths is not installed')
+    pytest.importorskip('rdkit')
+    package = tmp_path.joinpath('fake', 'rp2paths')
+    package.mkdir(parents=True)
+    #the modules of rp2paths are imported from the installed package, without its entry point
+    package.joinpath('__init__.py').write_text('__path__.append('+repr(rp2paths_dir)+')\n')
+    package.joinpath('__main__.py').write_text(RP2ERXN_MAIN)
+    monkeypatch.setattr(runRP2paths, 'RP2PATHS_PATH', str(package.parent))
+    return str(package.parent)
+
+
+def _scope(path, reactions=REACTIONS):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(HEADER)
+        for tid, substrate, products, iteration in reactions:
+            for product in products:
+                writer.writerow(['target', tid, substrate+'>>'+'.'.join(products), substrate, product,
+                                 '1' if product in SINKS else '0', '['+SINKS.get(product, '')+']', '[R1]', '[1.1.1.1]', '0.5', iteration])
+            if tid=='TRS_0_2':
+                writer.writerow(HEADER)
+    return path
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _compare(tmp_path, results, **kwargs):
+    serial = [str(tmp_path.joinpath('serial_out_paths.csv')), str(tmp_path.joinpath('serial_compounds.txt'))]
+    assert runRP2paths.run_rp2paths(results, serial[0], serial[1], timeout=1)[0]=='noerror'
+    sharded = [str(tmp_path.joinpath('sharded_out_paths.csv')), str(tmp_path.joinpath('sharded_compounds.txt'))]
+    status, message, metrics = rp2pathsShards.run_rp2paths_sharded(results, sharded[0], sharded[1], timeout=1, **kwargs)
+    assert status=='noerror'
+    #the CMPD_ and TARGET_ IDs of the parts are those of the whole scope, and the pathways are in the same order
+    assert _read(sharded[0])==_read(serial[0])
+    assert _read(sharded[1])==_read(serial[1])
+    return serial, metrics
+
+
+def _record(monkeypatch):
+    calls = []
+    run_rp2paths = runRP2paths.run_rp2paths
+
+    def record(rp2_pathways, out_paths, out_compounds, timeout, ram_limit, pool):
+        calls.append((rp2_pathways, timeout, ram_limit))
+        return run_rp2paths(rp2_pathways, out_paths, out_compounds, timeout, ram_limit, pool)
+
+    monkeypatch.setattr(runRP2paths, 'run_rp2paths', record)
+    return calls
+
+
+def test_read_scope_components(tmp_path):
+    scope = rp2pathsShards.read_scope(_scope(str(tmp_path.joinpath('results.csv'))))
+    assert len(scope['rows'])==5
+    assert scope['components']['TRS_0_0']==scope['components']['TRS_1_0']
+    assert scope['components']['TRS_0_3']==scope['components']['TRS_1_4']
+    assert not scope['components']['TRS_0_0']==scope['components']['TRS_0_1']
+    assert scope['compounds']['CCCCO']==['TARGET_0000000001']
+    assert scope['compounds']['CC']==['MNXM3', 'MNXM33']
+    #three pathways for the first target, as CCN is not in the sink, and one for the second
+    assert scope['max_paths']==4
+
+
+def test_max_pathways():
+    reactions = {'T1': (['A'], ['B', 'B']), 'T2': (['B'], ['S1']), 'T3': (['B'], ['S2']), 'T4': (['A'], ['S1'])}
+    assert rp2pathsShards.max_pathways(reactions, {'S1': [], 'S2': []}, ['A'])==5
+    assert rp2pathsShards.max_pathways(reactions, {'S1': [], 'S2': []}, ['A'], cap=3)==4
+    reactions['T5'] = (['B'], ['A'])
+    assert rp2pathsShards.max_pathways(reactions, {'S1': [], 'S2': []}, ['A']) is None
+
+
+def test_sharded_matches_serial(tmp_path, fake_rp2paths):
+    results = _scope(str(tmp_path.joinpath('results.csv')))
+    serial, metrics = _compare(tmp_path, results, ram_limit=8, workers=4)
+    assert metrics['shards']==4
+    with open(serial[0], newline='') as f:
+        rows = list(csv.DictReader(f))
+    #the pathways of a single step come first, and are sorted on their transformation IDs
+    assert [(i['Path ID'], i['Unique ID']) for i in rows]==[('1', 'TRS_0_2'),
+                                                          ('2', 'TRS_0_0'), ('2', 'TRS_1_0'),
+                                                          ('3', 'TRS_0_1'), ('3', 'TRS_1_2'),
+                                                          ('4', 'TRS_0_3'), ('4', 'TRS_1_4')]
+
+
+def test_sharded_matches_rp2erxn(tmp_path, rp2paths):
+    results = _scope(str(tmp_path.joinpath('results.csv')))
+    assert _compare(tmp_path, results, ram_limit=8, workers=4)[1]['shards']==4
+
+
+def test_shards_share_the_ram_limit(tmp_path, fake_rp2paths, monkeypatch):
+    calls = _record(monkeypatch)
+    results = _scope(str(tmp_path.joinpath('results.csv')))
+    status = rp2pathsShards.run_rp2paths_sharded(results, str(tmp_path.joinpath('out_paths.csv')), str(tmp_path.joinpath('compounds.txt')), timeout=1, ram_limit=5, workers=4)[0]
+    assert status=='noerror'
+    #two parts of 2.5 GB, and not three or four of 5 GB
+    assert [i[2] for i in calls]==[2.5, 2.5]
+
+
+def test_shards_share_the_timeout(tmp_path, fake_rp2paths, monkeypatch):
+    calls = _record(monkeypatch)
+    read_scope = rp2pathsShards.read_scope
+
+    def slow_read_scope(results_path):
+        time.sleep(1)
+        return read_scope(results_path)
+
+    #the time spent reading the scope is taken from the timeout of the parts
+    monkeypatch.setattr(rp2pathsShards, 'read_scope', slow_read_scope)
+    results = _scope(str(tmp_path.joinpath('results.csv')))
+    status = rp2pathsShards.run_rp2paths_sharded(results, str(tmp_path.joinpath('out_paths.csv')), str(tmp_path.joinpath('compounds.txt')), timeout=1, ram_limit=8, workers=4)[0]
+    assert status=='noerror'
+    timeouts = [i[1] for i in calls]
+    assert len(timeouts)==4
+    assert all([i<=1-1/60.0 for i in timeouts])
+
+
+@pytest.mark.parametrize('reactions, max_paths, min_transformations', [(REACTIONS+CYCLE, 150, 0),
+                                                                      (REACTIONS, 2, 0),
+                                                                      (REACTIONS, 150, 100)])
+def test_scope_runs_once(tmp_path, fake_rp2paths, monkeypatch, reactions, max_paths, min_transformations):
+    monkeypatch.setattr(rp2pathsShards, 'RP2PATHS_MAX_PATHS', max_paths)
+    monkeypatch.setattr(rp2pathsShards, 'SHARD_MIN_TRANSFORMATIONS', min_transformations)
+    calls = _record(monkeypatch)
+    results = _scope(str(tmp_path.joinpath('results.csv')), reactions)
+    status = rp2pathsShards.run_rp2paths_sharded(results, str(tmp_path.joinpath('out_paths.csv')), str(tmp_path.joinpath('compounds.txt')), timeout=1, ram_limit=8, workers=4)[0]
+    assert status=='noerror'
+    #the cycle, the cap or the size of the scope is known before rp2paths runs, and the scope is not run again
+    assert [i[0] for i in calls]==[results]
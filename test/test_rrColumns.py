@@ -0,0 +1,65 @@
+import os
+import csv
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+import rrColumns
+import runRR
+
+ROWS = [['RR-02-00001-02', '[#6:1]>>[#6:1]', '1.1.1.1', '1', '2', '1.0', 'MNXR1', '1', '1', 'both', '0.9'],
+        ['RR-02-00002-04', '[#7:1]>>[#7:1]', '2.7.1.1', '1', '4', '1.0', 'MNXR2', '1', '1', 'retro', '0.5'],
+        ['RR-02-00003-02', '[#8:1]>>[#8:1]', '1.14.1.1', '1', '2', '1.0', 'MNXR3', '1', '1', 'forward', '0.7']]
+BAD_ROW = ['RR-02-00004-02', '[#16:1]>>[#16:1]', '1.1.1.2', '1', 'two', '1.0', 'MNXR4', '1', '1', 'both', '0.1']
+
+
+def _rules(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(runRR.RULES_HEADER)
+        writer.writerows(rows)
+    return path
+
+
+def _read(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_select_filters():
+    columns = rrColumns.fromRows(runRR.RULES_HEADER, [list(i) for i in ROWS])
+    assert rrColumns.select(columns, diameters=[2]).tolist()==[0, 2]
+    assert rrColumns.select(columns, usages=['both', 'retro']).tolist()==[0, 1]
+    assert rrColumns.select(columns, min_score=0.6).tolist()==[0, 2]
+    #whole EC levels: 1.1 does not match 1.14.1.1
+    assert rrColumns.select(columns, ec_prefixes=['1.1']).tolist()==[0]
+    assert rrColumns.select(columns, topn=1).tolist()==[0, 1]
+
+
+def test_bad_row_policy():
+    with pytest.raises(ValueError):
+        rrColumns.fromRows(runRR.RULES_HEADER, [list(i) for i in ROWS+[BAD_ROW]])
+    columns = rrColumns.fromRows(runRR.RULES_HEADER, [list(i) for i in ROWS+[BAD_ROW]], skip_bad_rows=True)
+    assert len(columns['diameter'])==3
+
+
+def test_csv_paths_fail_on_the_same_rows(tmp_path):
+    rule_file = _rules(str(tmp_path.joinpath('rules.csv')), ROWS+[BAD_ROW])
+    output = str(tmp_path.joinpath('out.csv'))
+    assert not runRR.parseRules(rule_file, output, diameters=[2, 4])
+    assert not runRR.parseRules(rule_file, output, diameters=[2, 4], min_score=0.1)
+    assert not os.path.exists(output)
+    assert not runRR.exportRules([{'rules_type': 'all', 'diameters': [2], 'output': output}], rule_file)
+
+
+def test_columns_match_the_scan_and_are_cached(tmp_path):
+    rule_file = _rules(str(tmp_path.joinpath('rules.csv')), ROWS)
+    scanned = str(tmp_path.joinpath('scanned.csv'))
+    filtered = str(tmp_path.joinpath('filtered.csv'))
+    assert runRR.parseRules(rule_file, scanned, 'retro', diameters=[2, 4])
+    assert runRR.parseRules(rule_file, filtered, 'retro', diameters=[2, 4], min_score=0.0)
+    assert _read(filtered)==_read(scanned)
+    columns = runRR._loadColumns(None, rule_file)
+    assert runRR._loadColumns(None, rule_file) is columns
@@ -0,0 +1,54 @@
+import os
+import csv
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import rrDedup
+import runRR
+
+RULE = '([#6&H3:1]-[#6&H2:2]-[#8&H1:3])>>([#6&H3:1]-[#6&H1:2]=[#8&H0:3])'
+#the same rule with other atom maps and atom order
+RENUMBERED_RULE = '([#8&H1:7]-[#6&H2:5]-[#6&H3:9])>>([#8&H0:7]=[#6&H1:5]-[#6&H3:9])'
+OTHER_RULE = '([#7&H2:1]-[#6&H2:2])>>([#8&H0:1]=[#6&H1:2])'
+
+
+def _row(i, smarts, usage='both', score='0.5'):
+    return ['RR-02-'+str(i).zfill(5)+'-02', smarts, '1.1.1.1', '1', '2', '1.0', 'MNXR'+str(i), '1', '1', usage, score]
+
+
+def _rules(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(runRR.RULES_HEADER)
+        writer.writerows(rows)
+    return path
+
+
+def _read(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_canonical_smarts():
+    assert rrDedup.canonicalSmarts(RULE)==rrDedup.canonicalSmarts(RENUMBERED_RULE)
+    assert not rrDedup.canonicalSmarts(RULE)==rrDedup.canonicalSmarts(OTHER_RULE)
+    assert rrDedup.canonicalSmarts('([#6:1]>>') is None
+
+
+def test_dedup_keeps_the_best_score(tmp_path):
+    rows = [_row(0, RULE, score='0.2'),
+            _row(1, OTHER_RULE),
+            _row(2, RENUMBERED_RULE, score='0.9'),
+            #a rule with another usage is not a duplicate
+            _row(3, RULE, usage='retro'),
+            _row(4, RULE, score='0.9'),
+            _row(5, 'not a rule')]
+    output = str(tmp_path.joinpath('dedup.csv'))
+    mapping = str(tmp_path.joinpath('mapping.csv'))
+    assert rrDedup.dedupRules(_rules(str(tmp_path.joinpath('rules.csv')), rows), output, mapping)==2
+    #the first of the best scores is kept, in the order of the input
+    assert [i[0] for i in _read(output)[1:]]==[rows[1][0], rows[2][0], rows[3][0], rows[5][0]]
+    assert _read(mapping)==[rrDedup.MAPPING_HEADER,
+                            [rows[2][0], rows[0][0], 'MNXR0', '2', '0.2'],
+                            [rows[2][0], rows[4][0], 'MNXR4', '2', '0.9']]
@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import rrScreen
+import rrColumns
+import runRR
+
+ETHANOL = 'InChI=1S/C2H6O/c1-2-3/h3H,2H2,1H3'
+#alcohol oxidation, with the explicit hydrogens of the RetroRules templates
+H_EXPLICIT_RULE = '([#8&v2:1](-[#6&v4:2](-[#6&v4:3])(-[#1&v1:4])-[#1&v1:5])-[#1&v1:6])>>([#8&v2:1]=[#6&v4:2](-[#6&v4:3])-[#1&v1:4])'
+H_COUNT_RULE = '([#6&H3:1]-[#6&H2:2]-[#8&H1:3])>>([#6&H3:1]-[#6&H1:2]=[#8&H0:3])'
+#amine deamination, cannot fire on ethanol
+NITROGEN_RULE = '([#7&v3:1](-[#6&v4:2])(-[#1&v1:3])-[#1&v1:4])>>([#8&v2:1]=[#6&v4:2])'
+
+
+def _columns(rules):
+    rows = [['RR-02-'+str(i).zfill(5)+'-02', smarts, '1.1.1.1', '1', '2', '1.0', 'MNXR'+str(i), '1', '1', 'both', '1.0'] for i, smarts in enumerate(rules)]
+    return rrColumns.fromRows(runRR.RULES_HEADER, rows)
+
+
+def test_target_mask_explicit_hydrogens():
+    columns = _columns([H_EXPLICIT_RULE, H_COUNT_RULE, NITROGEN_RULE])
+    screen = rrScreen.fromColumns(columns)
+    assert screen['parsed'].all()
+    mask = rrScreen.screenMask(columns, screen, ETHANOL, 'target')
+    assert mask.tolist()==[True, True, False]
+
+
+def test_conservative_mask_keeps_reachable_rules():
+    columns = _columns([H_EXPLICIT_RULE, NITROGEN_RULE])
+    screen = rrScreen.fromColumns(columns)
+    mask = rrScreen.screenMask(columns, screen, ETHANOL, 'conservative', 1)
+    assert mask.tolist()==[True, False]
+
+
+def test_bad_source_inchi():
+    columns = _columns([H_EXPLICIT_RULE])
+    screen = rrScreen.fromColumns(columns)
+    assert rrScreen.screenMask(columns, screen, 'InChI=1S/bad', 'target') is None
@@ -0,0 +1,59 @@
+import os
+import csv
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import rrStore
+import runRR
+
+#diameters and usages interleaved, as in the RetroRules files
+ROWS = [['RR-02-'+str(i).zfill(5)+'-'+str(diameter), '[#6:1]>>[#6:'+str(i)+']', '1.1.1.'+str(i), '1', str(diameter), '1.0', 'MNXR'+str(i), '1', '1', usage, '0.5']
+        for i, (diameter, usage) in enumerate([(2, 'both'), (4, 'retro'), (2, 'forward'), (2, 'forward'), (16, 'both'), (4, 'both'), (2, 'retro'), (4, 'retro'), (16, 'forward')])]
+
+
+def _rules(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(runRR.RULES_HEADER)
+        writer.writerows(rows)
+    return path
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_store_keeps_the_source_order(tmp_path):
+    rule_file = _rules(str(tmp_path.joinpath('rules.csv')), ROWS)
+    store_path = str(tmp_path.joinpath('store'))
+    assert rrStore.buildStore({'all': rule_file}, store_path)
+    assert sorted(os.listdir(os.path.join(store_path, 'all')))==['16.csv', '2.csv', '4.csv', 'columns', 'runs.npy', 'screen']
+    for rules_type in ['all', 'retro', 'forward']:
+        for diameters in [[2], [2, 4], [4, 16], [2, 4, 6, 8, 10, 12, 14, 16]]:
+            scanned = str(tmp_path.joinpath('scanned.csv'))
+            assembled = str(tmp_path.joinpath('assembled.csv'))
+            assert runRR.parseRules(rule_file, scanned, rules_type, diameters)
+            with open(assembled, 'wb') as f:
+                assert rrStore.writeRules(f, 'all', diameters, runRR.RULE_USAGES[rules_type], store_path)
+            assert _read(assembled)==_read(scanned)
+
+
+def test_bad_row_fails_the_build(tmp_path):
+    rule_file = _rules(str(tmp_path.joinpath('rules.csv')), ROWS+[['RR-bad', '', '', '1', 'x', '', '', '', '', 'both', '']])
+    store_path = str(tmp_path.joinpath('store'))
+    assert not rrStore.buildStore({'all': rule_file}, store_path)
+    assert not os.path.exists(store_path)
+    assert not os.path.exists(store_path+'.tmp')
+
+
+def test_find_source_and_freshness(tmp_path):
+    rule_file = _rules(str(tmp_path.joinpath('rules.csv')), ROWS)
+    store_path = str(tmp_path.joinpath('store'))
+    assert rrStore.buildStore({'all': rule_file}, store_path)
+    assert rrStore.findSource(rule_file=rule_file, store_path=store_path)=='all'
+    assert rrStore.loadIndex(store_path) is rrStore.loadIndex(store_path)
+    _rules(rule_file, ROWS[:3])
+    os.utime(rule_file, (1, 1))
+    assert rrStore.findSource(rule_file=rule_file, store_path=store_path) is None
@@ -0,0 +1,105 @@
+import os
+import csv
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+import rp2Executor
+import runRP2
+
+FAKE_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_rp2_worker.py')
+
+
+@pytest.fixture
+def executor(tmp_path, monkeypatch):
+    monkeypatch.setattr(rp2Executor, 'POLL_INTERVAL', 0.05)
+    with rp2Executor.RP2Executor(command=[sys.executable, FAKE_WORKER, '{jobs_dir}'], root_dir=str(tmp_path.joinpath('executor'))) as executor:
+        yield executor
+
+
+def test_batch_splits_the_groups(tmp_path, executor):
+    targets = [('t1', 'InChI=1S/CH4/h1H4'),
+               ('insink1', 'InChI=1S/H2O/h1H2'),
+               ('noresult1', 'InChI=1S/CH4O/c1-2/h2H,1H3'),
+               ('t/2', 'InChI=1S/C2H6/c1-2/h1-2H3'),
+               ('insink2', 'InChI=1S/H3N/h1H3')]
+    results_dir = str(tmp_path.joinpath('results'))
+    statuses = runRP2.run_rp2_batch('sink.csv', 'rules.csv', targets, results_dir, 3, group_size=3, executor=executor, preflight=False)
+    assert {i: statuses[i][0] for i in statuses}=={'t1': 'noerror',
+                                                   'insink1': 'sourceinsinkerror',
+                                                   'noresult1': 'noresulterror',
+                                                   't/2': 'noerror',
+                                                   'insink2': 'sourceinsinkerror'}
+    #the command of the messages is the one of a KNIME launch, with its private areas
+    assert b' -data ' in statuses['noresult1'][1]
+    assert sorted(os.listdir(results_dir))==['t1_results.csv', 't_2_results.csv']
+    for name, file_name in [('t1', 't1_results.csv'), ('t/2', 't_2_results.csv')]:
+        with open(os.path.join(results_dir, file_name), newline='') as f:
+            rows = list(csv.reader(f))
+        assert rows[0][0]=='Initial source'
+        assert [i[0] for i in rows[1:]]==[name]
+
+
+def test_batch_rejects_duplicate_names(tmp_path):
+    targets = [('t/1', 'InChI=1S/CH4/h1H4'), ('t_1', 'InChI=1S/H2O/h1H2')]
+    assert runRP2.run_rp2_batch('sink.csv', 'rules.csv', targets, str(tmp_path), 3, preflight=False) is None
+
+
+def test_jvm_options(tmp_path):
+    knime_ini = tmp_path.joinpath('knime.ini')
+    knime_ini.write_text('-vmargs\n-Xmx2048m\n')
+    max_virtual_memory = 8*1024*1024*1024
+    options = runRP2.jvm_options(max_virtual_memory, cpus=2, gc_log='/tmp/gc.log', knime_ini=str(knime_ini))
+    assert options==['-Xmx6144m', '-Xms1536m',
+                     '-XX:CompressedClassSpaceSize='+runRP2.JVM_CLASS_SPACE,
+                     '-XX:ReservedCodeCacheSize='+runRP2.JVM_CODE_CACHE,
+                     '-XX:+'+runRP2.JVM_GC,
+                     '-XX:ActiveProcessorCount=2', '-XX:ParallelGCThreads=2',
+                     '-Xlog:gc:file=/tmp/gc.log:uptime']
+    #the heap and its headroom bound the virtual memory of the process
+    assert runRP2.jvm_virtual_memory(max_virtual_memory)==6144*1024*1024+runRP2.JVM_VIRTUAL_HEADROOM
+    #the JVM refuses a second collector
+    knime_ini.write_text('-vmargs\n-XX:+UseG1GC\n')
+    options = runRP2.jvm_options(max_virtual_memory, knime_ini=str(knime_ini))
+    assert not [i for i in options if runRP2.GC_OPTION_PATTERN.match(i)]
+
+
+def test_parse_gc_log(tmp_path):
+    gc_log = tmp_path.joinpath('gc.log')
+    gc_log.write_text('[0.012s] Using Parallel\n'
+                      '[1.204s] GC(0) Pause Young (Allocation Failure) 64M->12M(245M) 10.500ms\n'
+                      '[3.981s] GC(1) Pause Full (Ergonomics) 1G->300M(2G) 120.250ms\n')
+    assert runRP2.parse_gc_log(str(gc_log))=={'heap_peak': 1024*1024*1024,
+                                               'heap_committed': 2*1024*1024*1024,
+                                               'gc_pauses': 2,
+                                               'gc_pause_time': 0.131}
+    assert runRP2.parse_gc_log(str(tmp_path.joinpath('missing.log'))) is None
+
+
+def test_cache_key(tmp_path):
+    cache_dir = str(tmp_path.joinpath('cache'))
+    sink = tmp_path.joinpath('sink.csv')
+    sink.write_text('"Name","InChI"\n"MNXM2","InChI=1S/H2O/h1H2"\n')
+    rules = tmp_path.joinpath('rules.csv')
+    rules.write_text('"Rule ID"\n"RR-1"\n')
+    key = runRP2.rp2_cache_key(cache_dir, str(sink), str(rules), 'InChI=1S/CH4/h1H4', 3)
+    #the key does not depend on the paths of the files, only on their content
+    sink_copy = tmp_path.joinpath('sink_copy.csv')
+    sink_copy.write_text(sink.read_text())
+    assert runRP2.rp2_cache_key(cache_dir, str(sink_copy), str(rules), ' InChI=1S/CH4/h1H4', 3)==key
+    assert not runRP2.rp2_cache_key(cache_dir, str(sink), str(rules), 'InChI=1S/CH4/h1H4', 4)==key
+    assert not runRP2.rp2_cache_key(cache_dir, str(sink), str(rules), 'InChI=1S/CH4/h1H4', 3, topx=50)==key
+    sink.write_text('"Name","InChI"\n"MNXM3","InChI=1S/H3N/h1H3"\n')
+    assert not runRP2.rp2_cache_key(cache_dir, str(sink), str(rules), 'InChI=1S/CH4/h1H4', 3)==key
+    assert runRP2.rp2_cache_key(cache_dir, str(tmp_path.joinpath('missing.csv')), str(rules), 'InChI=1S/CH4/h1H4', 3) is None
+
+
+def test_partial_entries_within_limits():
+    cached_limits = {'timeout': 30, 'ram_limit': 8, 'stop_sink_rows': None, 'stop_idle': None}
+    assert runRP2._within_limits({'timeout': 30, 'ram_limit': 4, 'stop_sink_rows': 10, 'stop_idle': None}, cached_limits)
+    #a run with a larger or no limit may find more than the partial results
+    assert not runRP2._within_limits({'timeout': 60, 'ram_limit': 8}, cached_limits)
+    assert not runRP2._within_limits({'timeout': None, 'ram_limit': 8}, cached_limits)
+    assert not runRP2._within_limits({'timeout': 30, 'ram_limit': 8}, None)
@@ -0,0 +1,135 @@
+import os
+import io
+import bz2
+import csv
+import sys
+import gzip
+import lzma
+import tarfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'retrosynthesis'))
+
+import pytest
+
+import runRR
+
+ROWS = [['RR-02-'+str(i).zfill(5)+'-'+str(diameter), '[#6:1]>>[#6:'+str(i)+']', '1.1.1.'+str(i), '1', str(diameter), '1.0', 'MNXR'+str(i), '1', '1', usage, '0.5']
+        for i, (diameter, usage) in enumerate([(2, 'both'), (4, 'retro'), (2, 'forward'), (16, 'both'), (4, 'both')])]
+
+
+def _rules(path, rows=ROWS):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(runRR.RULES_HEADER)
+        writer.writerows(rows)
+    return path
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _compress(path, codec):
+    content = _read(path)
+    if codec=='tar':
+        with tarfile.open(path+'.tar.gz', 'w:gz') as tf:
+            tf.add(path, arcname='rules.csv')
+        return path+'.tar.gz'
+    opener = {'gz': gzip.open, 'xz': lzma.open, 'bz2': bz2.open}[codec]
+    with opener(path+'.'+codec, 'wb') as f:
+        f.write(content)
+    return path+'.'+codec
+
+
+def _decompress(path, output_format):
+    if output_format=='tar':
+        with tarfile.open(path, 'r:*') as tf:
+            return tf.extractfile(tf.getmembers()[0]).read()
+    opener = {'csv': open, 'gz': gzip.open, 'xz': lzma.open, 'bz2': bz2.open}[output_format]
+    with opener(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('codec', ['gz', 'xz', 'bz2', 'tar'])
+def test_compressed_input(tmp_path, codec):
+    rule_file = _rules(str(tmp_path.joinpath('rules.csv')))
+    plain = str(tmp_path.joinpath('plain.csv'))
+    assert runRR.parseRules(rule_file, plain, 'retro', [2, 4])
+    output = str(tmp_path.joinpath('output.csv'))
+    assert runRR.parseRules(_compress(rule_file, codec), output, 'retro', [2, 4])
+    assert _read(output)==_read(plain)
+
+
+@pytest.mark.parametrize('output_format', runRR.OUTPUT_FORMATS)
+def test_compressed_output(tmp_path, output_format):
+    rule_file = _rules(str(tmp_path.joinpath('rules.csv')))
+    plain = str(tmp_path.joinpath('plain.csv'))
+    assert runRR.parseRules(rule_file, plain)
+    output = str(tmp_path.joinpath('output.'+output_format))
+    assert runRR.parseRules(rule_file, output, output_format=output_format, compression_level=1)
+    assert _decompress(output, output_format)==_read(plain)
+
+
+def test_truncated_input(tmp_path):
+    rule_file = _compress(_rules(str(tmp_path.joinpath('rules.csv')), ROWS*200), 'gz')
+    with open(rule_file, 'rb') as f:
+        content = f.read()
+    with open(rule_file, 'wb') as f:
+        f.write(content[:len(content)//2])
+    output = str(tmp_path.joinpath('output.csv'))
+    #the partial output is removed
+    assert not runRR.parseRules(rule_file, output)
+    assert not os.path.exists(output)
+
+
+def _tsv(path, rows=ROWS):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(runRR.TSV_COLUMNS)
+        writer.writerows(rows)
+    return path
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_tsv_matches_csv(tmp_path, processes):
+    csv_output = str(tmp_path.joinpath('csv_output.csv'))
+    assert runRR.parseRules(_rules(str(tmp_path.joinpath('rules.csv'))), csv_output, 'forward', [2, 16])
+    #a row with an invalid diameter is skipped
+    tsv_file = _tsv(str(tmp_path.joinpath('rules.tsv')), ROWS[:2]+[ROWS[0][:4]+['x']+ROWS[0][5:]]+ROWS[2:])
+    tsv_output = str(tmp_path.joinpath('tsv_output.csv'))
+    assert runRR.parseRules(tsv_file, tsv_output, 'forward', [2, 16], input_format='tsv', processes=processes)
+    assert _read(tsv_output)==_read(csv_output)
+
+
+def test_tsv_chunks_keep_the_order(tmp_path):
+    tsv_file = _tsv(str(tmp_path.joinpath('rules.tsv')), ROWS*5)
+    outputs = []
+    for processes, chunk_lines in [(1, runRR.TSV_CHUNK_LINES), (2, 3)]:
+        o = io.BytesIO()
+        with open(tsv_file, newline='') as in_f:
+            assert runRR._writeTSV(o, in_f, [2, 4, 16], processes=processes, chunk_lines=chunk_lines)
+        outputs.append(o.getvalue())
+    assert outputs[0]==outputs[1]
+    assert len(outputs[0].splitlines())==len(ROWS)*5+1
+
+
+def test_export_matches_parse(tmp_path):
+    rule_file = _rules(str(tmp_path.joinpath('rules.csv')))
+    specs = [{'rules_type': 'retro', 'diameters': [2, 4], 'output': str(tmp_path.joinpath('retro.csv'))},
+             {'rules_type': 'forward', 'diameters': [16], 'output': str(tmp_path.joinpath('forward.gz')), 'output_format': 'gz'},
+             {'rules_type': 'all', 'output': str(tmp_path.joinpath('all.csv'))}]
+    assert runRR.exportRules(specs, rule_file)
+    for spec in specs:
+        parsed = str(tmp_path.joinpath('parsed.csv'))
+        assert runRR.parseRules(rule_file, parsed, spec['rules_type'], spec.get('diameters', [2,4,6,8,10,12,14,16]))
+        assert _decompress(spec['output'], spec.get('output_format', 'csv'))==_read(parsed)
+
+
+def test_export_fails_on_invalid_diameter(tmp_path):
+    rule_file = _rules(str(tmp_path.joinpath('rules.csv')), ROWS+[ROWS[0][:4]+['x']+ROWS[0][5:]])
+    specs = [{'rules_type': 'all', 'output': str(tmp_path.joinpath('all.csv'))},
+             {'rules_type': 'retro', 'output': str(tmp_path.joinpath('retro.csv'))}]
+    assert not runRR.exportRules(specs, rule_file)
+    #no partial output is left
+    assert not os.path.exists(specs[0]['output']) and not os.path.exists(specs[1]['output'])